@@ -9,7 +9,7 @@ import json
 from xutils import fsutil
 from xutils import dbutil
 
-dbutil.register_table("bookmark", "TXT书签")
+dbutil.register_table("bookmark", "TXT书签", binlog=True)
 
 def print_blue(msg):
     print("\033[34m\033[01m%s\033[0m" % msg, end = '')
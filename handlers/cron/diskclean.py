@@ -9,6 +9,7 @@ import xconfig
 import xauth
 import handlers.note.dao as note_dao
 import handlers.note.dao_delete as dao_delete
+from handlers.fs import fs_image
 from xutils import dateutil
 from xutils.db.binlog import BinLog
 
@@ -85,6 +86,12 @@ class handler:
         rm_expired_files(xconfig.TRASH_DIR, xconfig.TRASH_EXPIRE)
         rm_expired_files(xconfig.TMP_DIR, xconfig.TMP_EXPIRE, hard=True)
 
+        # 缩略图缓存, 原图修改以后旧的缩略图不会再被访问
+        thumbnail_expire_seconds = xconfig.FileConfig.thumbnail_cache_expire_days * dateutil.SECONDS_PER_DAY
+        thumbnail_dir = fs_image.get_thumbnail_cache_dir()
+        if os.path.exists(thumbnail_dir):
+            rm_expired_files(thumbnail_dir, thumbnail_expire_seconds, hard=True)
+
         # 删除回收站过期的笔记
         rm_expired_notes(xconfig.NOTE_REMOVED_EXPIRE)
 
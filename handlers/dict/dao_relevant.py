@@ -12,7 +12,7 @@ from xutils import dbutil
 from xutils.dateutil import is_str
 from xutils.functions import listremove
 
-dbutil.register_table("dict_relevant", "相关词词库", type="hash")
+dbutil.register_table("dict_relevant", "相关词词库", type="hash", binlog=True)
 _db = dbutil.get_hash_table("dict_relevant")
 
 class RelevantWord:
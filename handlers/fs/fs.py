@@ -14,6 +14,7 @@ import os
 import sys
 import time
 import datetime
+import uuid
 
 import mimetypes
 import web
@@ -114,6 +115,8 @@ def process_file_list(pathlist, parent = None):
 class FileSystemHandler:
 
     mime_types = xconfig.MIME_TYPES
+    # Range请求最多支持的范围数量
+    max_range_count = 16
 
     encodings = {
         # 二进制传输的编码格式
@@ -195,69 +198,107 @@ class FileSystemHandler:
 
     def read_range(self, path, http_range, blocksize):
         xutils.trace("Download", "==> HTTP_RANGE %s" % http_range)
-        range_list = http_range.split("bytes=")
-        if len(range_list) == 2:
-            # 包含完整的范围
-            range_list = range_list[1]
-            try:
-                range_start, range_end = range_list.split('-')
-                range_start = int(range_start)
-                total_size = os.stat(path).st_size
-                if range_end != "":
-                    range_end = int(range_end)
-                else:
-                    range_end  = total_size-1
-                    web.header("Content-Length", total_size)
-                content_range = "bytes %s-%s/%s" % (range_start, range_end, total_size)
-                # 设置HTTP响应状态
-                web.ctx.status = "206 Partial Content"
-                # 发送HTTP首部
-                web.header("Accept-Ranges", "bytes")
-                web.header("Content-Range", content_range)
-
-                xutils.trace("Download", "<== Content-Range:%s" % content_range)
-                # 发送数据
-                fp = open(path, "rb")
-                try:
-                    fp.seek(range_start)
-                    rest = range_end - range_start + 1
-                    readsize = min(rest, blocksize)
-                    while readsize > 0:
-                        # print("%s send %s K" % (time.ctime(), readsize))
-                        yield fp.read(readsize)
-                        rest -= readsize
-                        readsize = min(rest, blocksize)
-                finally:
-                    # 基本上和with等价，这里打印出来
-                    xutils.trace("Download", "close %s" % path)
-                    fp.close()
-            except Exception as e:
-                # 其他未知异常
-                xutils.print_stacktrace()
-                # yield最好不要和return value混用
-                yield self.read_all(path, blocksize)
-        else:
+        total_size = os.stat(path).st_size
+        range_list = fs_helper.parse_http_range(http_range, total_size)
+        if range_list == None:
             # 处理不了，返回所有的数据
-            yield self.read_all(path, blocksize)
+            return self.read_all(path, blocksize)
+
+        if len(range_list) == 0:
+            web.ctx.status = "416 Range Not Satisfiable"
+            web.header("Content-Range", "bytes */%s" % total_size)
+            web.header("Content-Length", 0)
+            return b''
+
+        if len(range_list) > self.max_range_count:
+            # 范围太多的请求按照规范可以忽略
+            return self.read_all(path, blocksize)
+
+        # 设置HTTP响应状态
+        web.ctx.status = "206 Partial Content"
+        web.header("Accept-Ranges", "bytes")
+
+        if len(range_list) > 1:
+            return self.read_multi_range(path, range_list, total_size, blocksize)
+
+        range_start, range_end = range_list[0]
+        content_range = "bytes %s-%s/%s" % (range_start, range_end, total_size)
+        web.header("Content-Range", content_range)
+        xutils.trace("Download", "<== Content-Range:%s" % content_range)
+        return self.send_file(path, range_start, range_end - range_start + 1, blocksize)
+
+    def read_multi_range(self, path, range_list, total_size, blocksize):
+        """多个范围, 返回multipart/byteranges"""
+        boundary = uuid.uuid4().hex
+        content_type = "application/octet-stream"
+        headers = []
+        for key, value in web.ctx.headers:
+            if key.lower() == "content-type":
+                content_type = value
+            else:
+                headers.append((key, value))
+        web.ctx.headers = headers
+        web.header("Content-Type", "multipart/byteranges; boundary=%s" % boundary)
+
+        parts = []
+        content_length = 0
+        for range_start, range_end in range_list:
+            part_header = "--%s\r\nContent-Type: %s\r\nContent-Range: bytes %s-%s/%s\r\n\r\n" % (
+                boundary, content_type, range_start, range_end, total_size)
+            part_header = part_header.encode("utf-8")
+            parts.append((part_header, range_start, range_end))
+            content_length += len(part_header) + (range_end - range_start + 1) + 2
+        tail = ("--%s--\r\n" % boundary).encode("utf-8")
+        content_length += len(tail)
+        web.header("Content-Length", content_length)
+        return self.iter_multi_range(path, parts, tail, blocksize)
+
+    def iter_multi_range(self, path, parts, tail, blocksize):
+        with open(path, "rb") as fp:
+            for part_header, range_start, range_end in parts:
+                yield part_header
+                fp.seek(range_start)
+                yield from self.iter_file(fp, range_end - range_start + 1, blocksize)
+                yield b"\r\n"
+        yield tail
+
+    def iter_file(self, fp, length, blocksize):
+        while length > 0:
+            block = fp.read(min(length, blocksize))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+    def iter_file_and_close(self, fp, length, blocksize):
+        with fp:
+            yield from self.iter_file(fp, length, blocksize)
+
+    def send_file(self, path, start, length, blocksize):
+        """发送文件的一段, 服务器支持wsgi.file_wrapper的时候交给服务器发送(sendfile零拷贝)"""
+        web.header("Content-Length", length)
+        fp = open(path, "rb")
+        try:
+            fp.seek(start)
+        except:
+            fp.close()
+            raise
+        file_wrapper = web.ctx.environ.get("wsgi.file_wrapper")
+        if file_wrapper != None:
+            return file_wrapper(fp, blocksize)
+        return self.iter_file_and_close(fp, length, blocksize)
 
     def read_all(self, path, blocksize):
         total_size = os.stat(path).st_size
-        web.header("Content-Length", total_size)
-        with open(path, "rb") as fp:
-            block = fp.read(blocksize)
-            while block:
-                # print("%s Read %s K" % (time.ctime(), blocksize))
-                yield block
-                block = fp.read(blocksize)
+        return self.send_file(path, 0, total_size, blocksize)
             
     def read_thumbnail(self, path, blocksize):
-        # TODO 限制进程数量
-        # 在SAE环境中，pillow处理图片后无法释放内存，改成用子进程处理
-        data = fs_image.create_thumbnail_data(path)
-        if data != None:
-            yield data
+        # 缩略图由工作进程生成并缓存在磁盘上, 生成失败返回原图
+        thumbnail_path = fs_image.get_thumbnail_path(path)
+        if thumbnail_path != None:
+            return self.read_all(thumbnail_path, blocksize)
         else:
-            yield from self.read_all(path, blocksize)
+            return self.read_all(path, blocksize)
     
     def set_cache_control(self, mtime, etag, expire_days=30):
         # 如果Edge浏览器没有按照cache-control的建议执行，将浏览器设置重置
@@ -652,7 +693,7 @@ class ToolListHandler:
     def GET(self):
         raise web.found("/plugin_list?category=dir&show_back=true")
 
-dbutil.register_table("fs_bookmark", "文件收藏夹")
+dbutil.register_table("fs_bookmark", "文件收藏夹", binlog=True)
 xutils.register_func("fs.process_file_list", process_file_list)
 
 xurls = (
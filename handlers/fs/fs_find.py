@@ -3,17 +3,16 @@
 # @since 2017/??/??
 # @modified 2022/04/10 23:56:20
 import os
-import sys
 
 import xutils
 import xauth
 import xtemplate
 import xconfig
-from fnmatch import fnmatch
+from fnmatch import fnmatchcase
 from xutils import dbutil
 from xutils import Storage
 
-from .fs_helper import get_index_db
+from .fs_helper import get_index_db, FileInfoModel, FileNameIndexDao
 
 dbutil.register_table("fs_index", "文件索引")
 
@@ -29,24 +28,24 @@ def clear_file_index():
         # key的格式为 fs_index:fpath
         index_db.delete(index_obj)
 
-def find_in_cache0(key):
-    input_key = key.upper()
+def scan_file_index(key, path="", maxsize=1000):
+    """扫描文件索引, 用于没有可用三元组的短查询"""
+    pattern = key.lower()
+    prefix = ""
+    if path != "":
+        prefix = os.path.join(path, "")
     plist = []
-
-    def search_file_func(key, value):
-        fpath = get_fpath_from_key(key)
-        if fnmatch(fpath.upper(), input_key):
-            plist.append(fpath)
-
-    dbutil.prefix_list("fs_index", search_file_func)
-    return plist
-
-def find_in_cache(key, maxsize=sys.maxsize):
-    quoted_key = xutils.quote_unicode(key)
-    plist = find_in_cache0(key)
-    if quoted_key != key:
-        plist += find_in_cache0(quoted_key)
-    return plist
+    for record in FileInfoModel.iter_by_prefix(prefix):
+        if fnmatchcase(FileNameIndexDao.get_index_name(record.fpath), pattern):
+            plist.append(record)
+    return FileNameIndexDao.sort_result(plist)[:maxsize]
+
+def find_in_cache(key, path="", maxsize=1000):
+    """按照文件名在索引中查找, 结果按照路径深度和修改时间排序"""
+    plist = FileNameIndexDao.search(key, path=path, limit=maxsize)
+    if plist == None:
+        plist = scan_file_index(key, path, maxsize)
+    return [record.fpath for record in plist]
 
 def get_index_dirs():
     index_dirs = xauth.get_user_config("admin", "index_dirs")
@@ -77,7 +76,7 @@ class SearchHandler:
             plist = []
         elif path == os.path.abspath(xconfig.DATA_DIR) and xconfig.USE_CACHE_SEARCH:
             # search in cache
-            plist = find_in_cache(find_key)
+            plist = find_in_cache(find_key, path)
         else:
             plist = xutils.search_path(path, find_key)
 
@@ -13,7 +13,9 @@ import xconfig
 import xauth
 import xconfig
 import os
+import re
 import xtables
+from fnmatch import fnmatchcase
 from xutils import dbutil
 from xutils import format_size
 from xutils import fsutil, six
@@ -23,6 +25,7 @@ from xutils.sqldb import TableProxy
 from xutils import Storage
 
 _index_db = xtables.get_table_by_name("file_info")
+_name_index_db = xtables.get_table_by_name("file_name_index")
 
 
 class FileInfo(Storage):
@@ -34,6 +37,112 @@ class FileInfo(Storage):
         self.ftype = ""
         self.user_id = 0
         self.fsize = 0
+        self.fhash = ""
+
+class FileNameIndexDao:
+    """文件名的三元组索引, 支持子串和通配符(glob)查询
+
+    - 索引的是文件名(basename)的小写形式, urlencode的文件名先解码
+    - 查询时从通配符之间的字面量提取三元组, 包含全部三元组的文件是候选, 再用通配符校验
+    - 字面量都不足三个字符的查询没有可用的三元组, 由调用方回退到扫描
+    """
+
+    gram_size = 3
+    batch_size = 200
+
+    @classmethod
+    def get_index_name(cls, fpath=""):
+        name = os.path.basename(fpath)
+        if "%" in name:
+            name = xutils.unquote(name)
+        return name.lower()
+
+    @classmethod
+    def split_grams(cls, text=""):
+        # type: (str) -> set[str]
+        size = cls.gram_size
+        return set([text[i:i+size] for i in range(len(text) - size + 1)])
+
+    @classmethod
+    def get_pattern_grams(cls, pattern=""):
+        # type: (str) -> set[str]
+        """提取通配符之间的字面量的三元组"""
+        pattern = re.sub(r"\[[^\]]*\]", "?", pattern.lower())
+        grams = set()
+        for literal in re.split(r"[*?]", pattern):
+            grams.update(cls.split_grams(literal))
+        return grams
+
+    @classmethod
+    def update_index(cls, file_id=0, fpath=""):
+        cls.update_index_batch([(file_id, fpath)])
+
+    @classmethod
+    def update_index_batch(cls, file_list):
+        # type: (list[tuple[int, str]]) -> None
+        values = []
+        for file_id, fpath in file_list:
+            for gram in cls.split_grams(cls.get_index_name(fpath)):
+                values.append(dict(gram=gram, file_id=file_id))
+        for i in range(0, len(values), cls.batch_size):
+            _name_index_db.multiple_insert(values[i:i+cls.batch_size])
+
+    @classmethod
+    def delete_index(cls, file_ids):
+        # type: (list[int]) -> None
+        if len(file_ids) == 0:
+            return
+        _name_index_db.delete(where="file_id IN $file_ids", vars=dict(file_ids=file_ids))
+
+    @classmethod
+    def list_file_ids(cls, grams):
+        # type: (set[str]) -> list[int]
+        """包含全部三元组的文件ID"""
+        sql = ("SELECT file_id FROM file_name_index WHERE gram IN $grams"
+               " GROUP BY file_id HAVING COUNT(1) >= $count")
+        vars = dict(grams=list(grams), count=len(grams))
+        return [record.file_id for record in _name_index_db.query(sql, vars=vars)]
+
+    @classmethod
+    def search(cls, pattern="", path="", limit=1000):
+        """按照文件名搜索, 结果按照路径深度和修改时间排序
+        没有可用的三元组时返回None"""
+        grams = cls.get_pattern_grams(pattern)
+        if len(grams) == 0:
+            return None
+
+        pattern = pattern.lower()
+        prefix = ""
+        if path != "":
+            prefix = os.path.join(os.path.abspath(path), "")
+
+        result = []
+        file_ids = cls.list_file_ids(grams)
+        for i in range(0, len(file_ids), cls.batch_size):
+            records = _index_db.select(what="id, fpath, mtime", where="id IN $ids",
+                                       vars=dict(ids=file_ids[i:i+cls.batch_size]))
+            for record in records:
+                if not record.fpath.startswith(prefix):
+                    continue
+                if fnmatchcase(cls.get_index_name(record.fpath), pattern):
+                    result.append(record)
+        return cls.sort_result(result)[:limit]
+
+    @classmethod
+    def sort_result(cls, records):
+        records.sort(key=lambda x: str(x.mtime), reverse=True)
+        records.sort(key=lambda x: x.fpath.count(os.sep))
+        return records
+
+    @classmethod
+    def rebuild(cls):
+        """重建全部索引"""
+        _name_index_db.check_write_state()
+        _name_index_db.raw_query("DELETE FROM file_name_index")
+        for records in _index_db.iter_batch(batch_size=1000):
+            with _name_index_db.transaction():
+                cls.update_index_batch([(record.id, record.fpath) for record in records])
+
 
 class FileInfoDao:
 
@@ -42,21 +151,35 @@ class FileInfoDao:
         fpath = os.path.abspath(fpath)
         return _index_db.select_first(where = dict(fpath = fpath))
     
+    @classmethod
+    def get_by_fhash(cls, fhash=""):
+        if fhash == "":
+            return None
+        return _index_db.select_first(where = dict(fhash = fhash))
+    
     @classmethod
     def delete_by_fpath(cls, fpath=""):
         fpath = os.path.abspath(fpath)
-        return _index_db.delete(where=dict(fpath=fpath))
+        with _index_db.transaction():
+            records = _index_db.select(what="id", where=dict(fpath=fpath))
+            FileNameIndexDao.delete_index([record.id for record in records])
+            return _index_db.delete(where=dict(fpath=fpath))
     
     @classmethod
     def delete_by_id(cls, id=0):
-        return _index_db.delete(where=dict(id=id))
+        with _index_db.transaction():
+            FileNameIndexDao.delete_index([id])
+            return _index_db.delete(where=dict(id=id))
     
     @classmethod
     def upsert(cls, info: FileInfo):
         info.fpath = os.path.abspath(info.fpath)
         old = cls.get_by_fpath(info.fpath)
         if old == None:
-            return _index_db.insert(**info)
+            with _index_db.transaction():
+                new_id = _index_db.insert(**info)
+                FileNameIndexDao.update_index(new_id, info.fpath)
+                return new_id
         else:
             updates = dict(**info)
             updates.pop("ctime") # 不更新创建时间
@@ -66,6 +189,44 @@ class FileInfoDao:
     def prefix_count(cls, fpath):
         return _index_db.count(where = "fpath LIKE $fpath", vars = dict(fpath = fpath + "%"))
 
+    @classmethod
+    def iter_by_prefix(cls, fpath, batch_size=1000):
+        """按照路径前缀遍历索引, 只查询比较变化需要的字段"""
+        last_id = 0
+        while True:
+            records = _index_db.select(what = "id, fpath, fsize, mtime, ftype",
+                                       where = "id > $last_id AND fpath LIKE $fpath",
+                                       vars = dict(last_id = last_id, fpath = fpath + "%"),
+                                       limit = batch_size, order = "id")
+            if len(records) == 0:
+                break
+            yield from records
+            last_id = records[-1].id
+
+    @classmethod
+    def batch_save(cls, insert_list, update_list):
+        # type: (list[FileInfo], list[tuple[int, FileInfo]]) -> None
+        """在一个事务里批量写入, update_list的元素是(id, info)"""
+        with _index_db.transaction():
+            name_list = []
+            for info in insert_list:
+                new_id = _index_db.insert(**info)
+                name_list.append((new_id, info.fpath))
+            FileNameIndexDao.update_index_batch(name_list)
+            for id, info in update_list:
+                updates = dict(**info)
+                updates.pop("ctime") # 不更新创建时间
+                _index_db.update(**updates, where = dict(id=id))
+
+    @classmethod
+    def batch_delete_by_ids(cls, ids):
+        # type: (list[int]) -> None
+        if len(ids) == 0:
+            return
+        with _index_db.transaction():
+            FileNameIndexDao.delete_index(ids)
+            _index_db.delete(where = "id in $ids", vars = dict(ids = ids))
+
 
 class FileInfoModel(FileInfoDao):
     pass
@@ -168,6 +329,40 @@ def sort_files_by_size(filelist):
     filelist.sort(key = key_func, reverse = True)
 
 
+def parse_http_range(http_range, total_size):
+    # type: (str, int) -> list[tuple[int, int]]|None
+    """解析Range请求头, 返回[(start, end)], end包含在内
+    - 格式不支持返回None, 按照规范忽略Range返回整个文件
+    - 所有的范围都无法满足返回空列表(416)
+    """
+    http_range = http_range.strip()
+    if not http_range.startswith("bytes="):
+        return None
+    result = []
+    for item in http_range[len("bytes="):].split(","):
+        start, sep, end = item.strip().partition("-")
+        if sep == "" or not (start == "" or start.isdigit()) or not (end == "" or end.isdigit()):
+            return None
+        if start == "":
+            # 后缀范围, 表示最后N个字节
+            if end == "":
+                return None
+            length = int(end)
+            if length > 0 and total_size > 0:
+                result.append((max(0, total_size - length), total_size - 1))
+            continue
+        range_start = int(start)
+        if end != "" and int(end) < range_start:
+            return None
+        if range_start >= total_size:
+            continue
+        range_end = total_size - 1
+        if end != "":
+            range_end = min(int(end), range_end)
+        result.append((range_start, range_end))
+    return result
+
+
 xutils.register_func("fs.get_file_thumbnail", get_file_thumbnail)
 xutils.register_func("fs.get_file_download_link", get_file_download_link)
 xutils.register_func("fs.get_index_dirs", get_index_dirs)
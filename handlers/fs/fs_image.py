@@ -1,14 +1,25 @@
 # encoding=utf-8
+"""图片缩略图服务
+
+- 缩略图缓存在磁盘上, 缓存key由文件路径、修改时间和大小计算, 文件修改以后自动失效
+- 缩略图由固定数量的常驻工作进程生成(tools/image-thumbnail.py --worker), 任务通过队列分发
+- 在SAE环境中, pillow处理图片后无法释放内存, 所以不在主进程处理, 工作进程处理一定数量的任务以后重启
+"""
 import logging
 import traceback
+import threading
+import hashlib
+import queue
+import json
 import sys
 import subprocess
-import base64
 import xconfig
+import xmanager
+import xutils
 import os
 
 from io import BytesIO
-from xutils import cacheutil
+from concurrent.futures import Future
 
 def do_create_thumbnail_inner(img_path):
     """创建缩略图"""
@@ -43,47 +54,235 @@ def do_create_thumbnail_inner(img_path):
         return None
 
 
-class ImageCache:
+class ThumbnailCache:
+    """缩略图的磁盘缓存"""
+
+    def __init__(self, cache_dir=""):
+        self.cache_dir = cache_dir
 
-    cache = cacheutil.PrefixedCache("image-cache:")
+    def get_cache_path(self, path):
+        # type: (str) -> str|None
+        """返回缩略图的缓存路径, 文件不存在返回None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key_text = "%s|%s|%s" % (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        key = hashlib.sha1(key_text.encode("utf-8")).hexdigest()
+        name, ext = os.path.splitext(path)
+        return os.path.join(self.cache_dir, key[:2], key + ext.lower())
 
-    @classmethod
-    def get(cls, path):
-        cls.cache.get(path)
+    def get(self, path):
+        # type: (str) -> str|None
+        """返回已经生成的缩略图路径"""
+        cache_path = self.get_cache_path(path)
+        if cache_path != None and os.path.exists(cache_path):
+            return cache_path
+        return None
 
-    @classmethod
-    def save(cls, path, data):
-        cls.cache.put(path, data)
+    def save(self, cache_path, data):
+        # type: (str, bytes) -> None
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        with open(tmp_path, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp_path, cache_path)
 
 
-def do_create_thumbnail(path, debug=False):
-    if debug:
-        return do_create_thumbnail_inner(path)
-    else:
-        logging.info("path=%s", path)
-        # multiprocessing在Windows和Mac的性能比较差，因为他们默认使用新线程而不是fork的方式创建线程，
+class ThumbnailWorker:
+    """常驻的缩略图工作进程"""
+
+    def __init__(self):
         script_path = os.path.join(xconfig.FileConfig.source_root_dir, "tools/image-thumbnail.py")
-        args = [sys.executable, script_path, path]
-        with subprocess.Popen(args, stdout=subprocess.PIPE) as proc:
-            assert proc.stdout != None
-            buf = proc.stdout.read()
-            if buf.strip() == "":
+        args = [sys.executable, script_path, "--worker"]
+        self.proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     encoding="utf-8", bufsize=1)
+        self.task_count = 0
+
+    def create_thumbnail(self, src, dest, timeout=30):
+        # type: (str, str, float) -> bool
+        assert self.proc.stdin != None
+        assert self.proc.stdout != None
+        self.task_count += 1
+        self.proc.stdin.write(json.dumps(dict(src=src, dest=dest)) + "\n")
+        self.proc.stdin.flush()
+        timed_out = threading.Event()
+
+        def kill_on_timeout():
+            # 杀掉工作进程以后readline会读到EOF返回
+            timed_out.set()
+            self.proc.kill()
+
+        timer = threading.Timer(timeout, kill_on_timeout)
+        timer.daemon = True
+        timer.start()
+        try:
+            result = self.proc.stdout.readline()
+        finally:
+            timer.cancel()
+        if timed_out.is_set():
+            raise Exception("thumbnail worker timeout, timeout=%ss" % timeout)
+        if result == "":
+            raise Exception("thumbnail worker exited, code=%s" % self.proc.poll())
+        return result.strip() == "ok"
+
+    def close(self):
+        try:
+            if self.proc.stdin != None:
+                self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except Exception:
+            self.proc.kill()
+
+
+class ThumbnailTask:
+
+    def __init__(self, src="", dest=""):
+        self.src = src
+        self.dest = dest
+        self.future = Future()
+
+
+class ThumbnailService:
+    """缩略图服务, 每个工作线程持有一个常驻的工作进程"""
+
+    def __init__(self, cache, pool_size=2, queue_size=1000, max_tasks_per_worker=500, task_timeout=30):
+        self.cache = cache # type: ThumbnailCache
+        self.pool_size = pool_size
+        self.max_tasks_per_worker = max_tasks_per_worker
+        # 单个任务的超时时间(秒), 超时的工作进程会被杀掉重启
+        self.task_timeout = task_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.RLock()
+        # 正在生成的任务, 相同的图片只生成一次
+        self.pending = dict() # type: dict[str, ThumbnailTask]
+        self.threads = [] # type: list[threading.Thread]
+
+    def start(self):
+        with self.lock:
+            if len(self.threads) > 0:
+                return
+            for i in range(self.pool_size):
+                thread = threading.Thread(target=self.run_worker, name="ThumbnailWorker-%d" % i)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def run_worker(self):
+        worker = None
+        while True:
+            task = self.queue.get()
+            try:
+                if worker == None or worker.task_count >= self.max_tasks_per_worker:
+                    if worker != None:
+                        worker.close()
+                    worker = ThumbnailWorker()
+                ok = worker.create_thumbnail(task.src, task.dest, timeout=self.task_timeout)
+                task.future.set_result(ok)
+            except Exception as e:
+                logging.error("create thumbnail failed, path=%s, err=%s", task.src, e)
+                task.future.set_result(False)
+                if worker != None:
+                    worker.close()
+                worker = None
+            finally:
+                with self.lock:
+                    self.pending.pop(task.dest, None)
+
+    def create_thumbnail_in_process(self, src, dest):
+        data = do_create_thumbnail_inner(src)
+        if data == None:
+            return False
+        self.cache.save(dest, data)
+        return True
+
+    def submit(self, path):
+        # type: (str) -> Future|None
+        """提交生成任务, 队列满了返回None"""
+        dest = self.cache.get_cache_path(path)
+        if dest == None:
+            return None
+
+        future = Future()
+        if os.path.exists(dest):
+            future.set_result(True)
+            return future
+
+        if self.pool_size <= 0:
+            # 不使用工作进程, 直接在当前线程生成
+            future.set_result(self.create_thumbnail_in_process(path, dest))
+            return future
+
+        self.start()
+        with self.lock:
+            task = self.pending.get(dest)
+            if task != None:
+                return task.future
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            task = ThumbnailTask(path, dest)
+            self.pending[dest] = task
+            try:
+                self.queue.put_nowait(task)
+            except queue.Full:
+                logging.warning("thumbnail queue is full, path=%s", path)
+                self.pending.pop(dest, None)
                 return None
-            return base64.b64decode(buf.decode("utf-8"))
+            return task.future
 
-def create_thumbnail_data(path):
-    cache_data = ImageCache.get(path)
-    if cache_data != None:
-        logging.info("hit image cache, path=%s", path)
-        return cache_data
+    def get_thumbnail(self, path, timeout=60):
+        # type: (str, float) -> str|None
+        """返回缩略图的路径, 没有缓存的时候等待生成"""
+        cache_path = self.cache.get(path)
+        if cache_path != None:
+            return cache_path
+
+        future = self.submit(path)
+        if future == None:
+            return None
+        try:
+            if future.result(timeout=timeout):
+                return self.cache.get(path)
+        except Exception as e:
+            logging.error("wait thumbnail failed, path=%s, err=%s", path, e)
+        return None
+
+    def prefetch(self, path):
+        """提前生成缩略图, 不等待结果"""
+        return self.submit(path)
+
+
+_service = None # type: ThumbnailService|None
 
+def get_thumbnail_cache_dir():
+    return os.path.join(xconfig.FileConfig.data_dir, "cache", "thumbnail")
+
+def get_thumbnail_service():
+    global _service
+    if _service == None:
+        cache = ThumbnailCache(get_thumbnail_cache_dir())
+        _service = ThumbnailService(cache, pool_size=xconfig.FileConfig.thumbnail_workers)
+    return _service
+
+def get_thumbnail_path(path):
+    # type: (str) -> str|None
     try:
-        # SAE上处理PIL存在泄漏，暂时先通过子进程处理
-        data = do_create_thumbnail(path)
-        if data != None:
-            ImageCache.save(path, data)
-        return data
+        return get_thumbnail_service().get_thumbnail(path)
     except Exception as e:
-        logging.error("image thumbnail data: exception occurs")
+        logging.error("image thumbnail: exception occurs")
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+
+def create_thumbnail_data(path):
+    cache_path = get_thumbnail_path(path)
+    if cache_path == None:
+        return None
+    with open(cache_path, "rb") as fp:
+        return fp.read()
+
+
+@xmanager.listen("fs.upload")
+def on_fs_upload(ctx):
+    """上传图片以后提前生成缩略图"""
+    fpath = ctx.fpath
+    if fpath != None and xutils.is_img_file(fpath):
+        get_thumbnail_service().prefetch(fpath)
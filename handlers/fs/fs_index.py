@@ -10,6 +10,7 @@ import logging
 import os
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import xauth
 import xtemplate
@@ -17,66 +18,199 @@ import xconfig
 import xmanager
 import xutils
 from xutils import Storage
-from xutils.sqldb import TableProxy
 from xutils import fsutil
-from .fs_helper import get_index_dirs, get_index_db, FileInfoModel, FileInfo
+from .fs_helper import get_index_dirs, FileInfoModel, FileInfo
+
+class DirScanResult:
+
+    def __init__(self, dirname="", depth=0):
+        self.dirname = dirname
+        self.depth = depth
+        self.stat = None # type: os.stat_result|None
+        # [(fpath, stat)], stat为None表示无法读取
+        self.files = [] # type: list[tuple[str, os.stat_result|None]]
+        self.subdirs = [] # type: list[str]
+        self.ok = True
+
 
 class IndexBuilder:
+    """文件索引构建器
+
+    - 多线程使用os.scandir扫描目录, 每个目录是一个任务
+    - 和索引中的mtime/fsize比较, 只写入变化的文件, 写入和删除按批次在事务中执行
+    - 目录大小在扫描完成以后自底向上一次计算
+    """
 
     _lock = threading.RLock()
     _is_building = False
 
-    def calc_dir_size(self, db, dirname, depth=1000):
-        dirname = os.path.abspath(dirname)
-        size = 0
+    max_depth = 1000
+    batch_size = 500
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.stats = Storage(dirs=0, files=0, inserted=0, updated=0, deleted=0)
+        self.insert_list = [] # type: list[FileInfo]
+        self.update_list = [] # type: list[tuple[int, FileInfo]]
+        self.delete_list = [] # type: list[int]
+
+    def scan_dir(self, dirname, depth):
+        # type: (str, int) -> DirScanResult
+        """扫描一个目录, 在线程池中执行"""
+        result = DirScanResult(dirname, depth)
         try:
-            for fname in os.listdir(dirname):
-                fpath = os.path.join(dirname, fname)
-                size += self.calc_size(db, fpath, depth-1)
-        except:
+            result.stat = os.stat(dirname)
+            with os.scandir(dirname) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_symlink():
+                            # 软链接会导致循环引用,即使用真实的路径也不能解决这个问题
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            result.subdirs.append(entry.path)
+                        else:
+                            result.files.append((entry.path, entry.stat(follow_symlinks=False)))
+                    except OSError:
+                        result.files.append((entry.path, None))
+        except OSError:
             # 无法读取目录
             xutils.print_exc()
+            result.ok = False
+        return result
+
+    def walk(self, root):
+        # type: (str) -> dict[str, DirScanResult]
+        results = {} # type: dict[str, DirScanResult]
+        with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="FsIndex") as executor:
+            pending = {executor.submit(self.scan_dir, root, 0)}
+            while len(pending) > 0:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    results[result.dirname] = result
+                    if result.depth + 1 >= self.max_depth:
+                        logging.error("too deep depth: %s", result.dirname)
+                        result.ok = False
+                        continue
+                    for subdir in result.subdirs:
+                        pending.add(executor.submit(self.scan_dir, subdir, result.depth + 1))
+        return results
+
+    def load_index(self, root):
+        """读取已有的索引, 返回 {fpath: record}"""
+        index = dict()
+        prefix = root + os.sep
+        for record in FileInfoModel.iter_by_prefix(root):
+            # LIKE前缀也会匹配到同名前缀的兄弟目录
+            if record.fpath == root or record.fpath.startswith(prefix):
+                index[record.fpath] = record
+        return index
+
+    def is_changed(self, old, fsize, ftype, mtime):
+        # type: (Storage, int, str, str) -> bool
+        if old.fsize != fsize or old.ftype != ftype:
+            return True
+        if fsize < 0:
+            # 无法读取的文件没有修改时间
+            return False
+        old_mtime = old.mtime
+        if not isinstance(old_mtime, str):
+            # MySQL返回的是datetime
+            old_mtime = xutils.format_datetime(old_mtime)
+        return old_mtime != mtime
+
+    def add_entry(self, index, fpath, st, fsize, ftype):
+        # type: (dict, str, os.stat_result|None, int, str) -> None
+        """和索引比较, 变化的时候才创建FileInfo"""
+        mtime = ""
+        if st != None:
+            mtime = xutils.format_datetime(st.st_mtime)
+        old = index.pop(fpath, None)
+        if old != None and not self.is_changed(old, fsize, ftype, mtime):
+            return
 
         info = FileInfo()
-        info.fpath = dirname
-        info.fsize = size
-        info.ftype = "dir"
-        FileInfoModel.upsert(info)
-        return size
-
+        info.fpath = fpath
+        info.fsize = fsize
+        info.ftype = ftype
+        if st != None:
+            info.ctime = xutils.format_datetime(st.st_ctime)
+            info.mtime = mtime
+        if old == None:
+            self.insert_list.append(info)
+        else:
+            self.update_list.append((old.id, info))
+        self.flush()
 
-    def calc_size(self, db, fpath, depth=1000): 
-        # type: (TableProxy, str, int) -> int
-        if depth <= 0:
-            logging.error("too deep depth")
+    def add_file(self, index, fpath, st):
+        # type: (dict, str, os.stat_result|None) -> int
+        if st == None:
+            self.add_entry(index, fpath, None, -1, "")
             return 0
-        
+        self.add_entry(index, fpath, st, st.st_size, fsutil.get_file_ext(fpath))
+        return st.st_size
+
+    def flush(self, force=False):
+        size = len(self.insert_list) + len(self.update_list) + len(self.delete_list)
+        if size == 0 or (size < self.batch_size and not force):
+            return
+        FileInfoModel.batch_save(self.insert_list, self.update_list)
+        FileInfoModel.batch_delete_by_ids(self.delete_list)
+        self.stats.inserted += len(self.insert_list)
+        self.stats.updated += len(self.update_list)
+        self.stats.deleted += len(self.delete_list)
+        self.insert_list = []
+        self.update_list = []
+        self.delete_list = []
+
+    def build(self, fpath):
+        # type: (str) -> int
+        """构建索引, 返回总大小"""
         if os.path.islink(fpath):
-            # 软链接会导致循环引用,即使用真实的路径也不能解决这个问题
             return 0
 
-        fpath = os.path.realpath(fpath)
-        logging.info("fs_index path: %s", fpath)
+        root = os.path.realpath(fpath)
+        index = self.load_index(root)
 
-        if os.path.isdir(fpath):
-            return self.calc_dir_size(db, fpath, depth-1)
-        try:
-            st = os.stat(fpath)
-            info = FileInfo()
-            info.fsize = st.st_size
-            info.fpath = fpath
-            info.ctime = xutils.format_datetime(st.st_ctime)
-            info.mtime = xutils.format_datetime(st.st_mtime)
-            info.ftype = fsutil.get_file_ext(fpath)
-            FileInfoModel.upsert(info)
-            return st.st_size
-        except:
-            xutils.print_exc()
-            info = FileInfo()
-            info.fsize = -1
-            info.fpath = fpath
-            FileInfoModel.upsert(info)
-            return 0
+        if not os.path.isdir(root):
+            try:
+                st = os.stat(root)
+            except OSError:
+                st = None
+            size = self.add_file(index, root, st)
+            self.flush(force=True)
+            return size
+
+        results = self.walk(root)
+
+        # 自底向上计算目录大小
+        dir_size = dict() # type: dict[str, int]
+        for result in sorted(results.values(), key=lambda x: x.depth, reverse=True):
+            size = 0
+            for file_path, st in result.files:
+                size += self.add_file(index, file_path, st)
+            for subdir in result.subdirs:
+                size += dir_size.get(subdir, 0)
+            dir_size[result.dirname] = size
+            self.stats.dirs += 1
+            self.stats.files += len(result.files)
+
+            if not result.ok:
+                # 目录没有完整扫描, 保留原来的大小
+                index.pop(result.dirname, None)
+                continue
+
+            self.add_entry(index, result.dirname, result.stat, size, "dir")
+
+        # 删除已经不存在的文件, 无法读取的目录保留原来的索引
+        skip_prefixes = tuple([x.dirname + os.sep for x in results.values() if not x.ok])
+        for record in index.values():
+            if len(skip_prefixes) > 0 and record.fpath.startswith(skip_prefixes):
+                continue
+            self.delete_list.append(record.id)
+            self.flush()
+        self.flush(force=True)
+        return dir_size.get(root, 0)
 
     @classmethod
     def build_fs_index(cls, dirname, sync=False):
@@ -98,10 +232,13 @@ class IndexBuilder:
     def do_build_index(cls, dirname):
         cls._is_building = True
         try:
-            builder = IndexBuilder()
-            db = get_index_db()
-            size = builder.calc_size(db, dirname)
-            logging.info("Total size:%s", size)
+            start_time = time.time()
+            builder = IndexBuilder(workers=xconfig.FileConfig.fs_index_workers)
+            size = builder.build(dirname)
+            stats = builder.stats
+            logging.info("fs_index %s, size:%s, dirs:%s, files:%s, inserted:%s, updated:%s, deleted:%s, cost:%.2fs",
+                         dirname, size, stats.dirs, stats.files, stats.inserted,
+                         stats.updated, stats.deleted, time.time() - start_time)
             return size
         finally:
             cls._is_building = False
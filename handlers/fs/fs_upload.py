@@ -11,6 +11,8 @@ import xtemplate
 import xmanager
 import time
 import math
+import json
+import threading
 from xutils import fsutil, Storage
 from xtemplate import T
 from xnote_event import FileUploadEvent
@@ -176,13 +178,15 @@ class UploadHandler:
                 for chunk in file.file:
                     fout.write(chunk)
             
+            # 先修正图片方向, 监听上传事件的处理(比如生成缩略图)读到的是最终的文件
+            try_fix_orientation(filepath)
+
             event = FileUploadEvent()
             event.fpath = filepath
             event.user_name = user_info.name
             event.user_id = user_info.id
             xmanager.fire("fs.upload", event)
 
-            try_fix_orientation(filepath)
             try_touch_note(note_id)
 
         return dict(code="success", webpath=webpath, link=get_link(filename, webpath))
@@ -215,29 +219,144 @@ class UploadHandler:
                                 get_display_name=get_display_name)
 
 
+def get_upload_id():
+    """webuploader上传的时候会带上文件ID和文件的修改时间"""
+    file_id = xutils.get_argument_str("id")
+    last_modified = xutils.get_argument_str("lastModifiedDate")
+    if file_id == "" and last_modified == "":
+        return ""
+    return "%s|%s" % (file_id, last_modified)
+
+
+class RangeUploadManifest:
+    """分片上传的清单, 记录已经接收的分片, 上传中断以后可以续传
+
+    - 分片直接写入临时文件`<filepath>.part`对应的偏移位置, 不需要再合并分片
+    - 清单保存在`<filepath>.part.json`, 上传ID、文件大小或者分片数量变化说明是新的上传
+    - 所有分片接收完成并且校验文件大小以后重命名为目标文件
+    """
+
+    copy_buffer_size = 64 * 1024
+
+    _lock = threading.RLock()
+
+    def __init__(self, filepath="", chunks=1, size=-1, chunk_size=5*1024*1024, upload_id=""):
+        self.filepath = filepath
+        # 客户端上传的标识(webuploader的文件ID+文件修改时间), 同名同大小的其他文件不能复用清单
+        self.upload_id = upload_id
+        # 客户端(webuploader)的分片大小, 分片的偏移是 chunk * chunk_size
+        self.chunk_size = chunk_size
+        self.part_path = filepath + ".part"
+        self.manifest_path = filepath + ".part.json"
+        self.chunks = chunks
+        # 文件的大小, 客户端没有提供的时候是-1, 收到最后一个分片以后确定
+        self.size = size
+        self.received = set() # type: set[int]
+
+    def load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return False
+        if data.get("chunks") != self.chunks or data.get("chunk_size") != self.chunk_size:
+            return False
+        if data.get("upload_id", "") != self.upload_id:
+            return False
+        if self.size >= 0 and data.get("size", -1) >= 0 and data.get("size") != self.size:
+            return False
+        if not os.path.exists(self.part_path):
+            return False
+        if self.size < 0:
+            self.size = data.get("size", -1)
+        self.received = set(data.get("received", []))
+        return True
+
+    def save(self):
+        data = dict(chunks=self.chunks, chunk_size=self.chunk_size, upload_id=self.upload_id,
+                    size=self.size, received=sorted(self.received))
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(data, fp)
+        os.replace(tmp_path, self.manifest_path)
+
+    def open_part_file(self):
+        """打开临时文件, 新的上传预先分配好文件大小"""
+        if not self.load():
+            self.received = set()
+            with open(self.part_path, "wb") as fp:
+                if self.size > 0:
+                    fp.truncate(self.size)
+            self.save()
+        return open(self.part_path, "r+b")
+
+    def get_chunk_length(self, chunk):
+        if self.size < 0:
+            return -1
+        return min(self.chunk_size, self.size - chunk * self.chunk_size)
+
+    def write_chunk(self, chunk, stream):
+        """把分片写入对应的偏移位置, 所有分片完成以后返回True"""
+        if chunk < 0 or chunk >= self.chunks:
+            raise Exception("invalid chunk %s" % chunk)
+        if self.size >= 0 and self.chunks != max(1, math.ceil(self.size / self.chunk_size)):
+            raise Exception("chunk size mismatch, chunk_size=%s" % self.chunk_size)
+
+        offset = chunk * self.chunk_size
+        with self._lock:
+            fp = self.open_part_file()
+
+        with fp:
+            fp.seek(offset)
+            length = 0
+            while True:
+                buf = stream.read(self.copy_buffer_size)
+                if not buf:
+                    break
+                fp.write(buf)
+                length += len(buf)
+
+        with self._lock:
+            if not self.load():
+                # 并发的上传重置了清单
+                raise Exception("upload file broken")
+            expect_length = self.get_chunk_length(chunk)
+            if expect_length >= 0 and length != expect_length:
+                raise Exception("chunk %s size mismatch, expect %s, got %s" % (chunk, expect_length, length))
+            if chunk + 1 < self.chunks and length != self.chunk_size:
+                raise Exception("chunk %s size mismatch, expect %s, got %s" % (chunk, self.chunk_size, length))
+            if chunk + 1 == self.chunks:
+                self.size = offset + length
+            self.received.add(chunk)
+            self.save()
+            if len(self.received) < self.chunks:
+                return False
+            self.finish()
+            return True
+
+    def finish(self):
+        """校验文件大小, 重命名为目标文件"""
+        with open(self.part_path, "r+b") as fp:
+            fp.truncate(self.size)
+        if os.path.getsize(self.part_path) != self.size:
+            raise Exception("upload file broken")
+        os.replace(self.part_path, self.filepath)
+        xutils.remove(self.manifest_path, True)
+
+
 class RangeUploadHandler:
 
-    def merge_files(self, dirname, filename, chunks):
-        dest_path = os.path.join(dirname, filename)
+    def fire_upload_event(self, filepath):
         user_info = xauth.current_user()
         assert user_info != None
-        user_name = user_info.name
-
-        with open(dest_path, "wb") as fp:
-            for chunk in range(chunks):
-                tmp_path = os.path.join(dirname, filename)
-                tmp_path = "%s_%d.part" % (tmp_path, chunk)
-                if not os.path.exists(tmp_path):
-                    raise Exception("upload file broken")
-                with open(tmp_path, "rb") as tmp_fp:
-                    fp.write(tmp_fp.read())
-                xutils.remove(tmp_path, True)
+        # 先修正图片方向, 监听上传事件的处理(比如生成缩略图)读到的是最终的文件
+        try_fix_orientation(filepath)
 
-            event = FileUploadEvent()
-            event.user_name = user_name
-            event.user_id = user_info.id
-            event.fpath = dest_path
-            xmanager.fire("fs.upload", event)
+        event = FileUploadEvent()
+        event.user_name = user_info.name
+        event.user_id = user_info.id
+        event.fpath = filepath
+        xmanager.fire("fs.upload", event)
 
     def is_fixed_name(self, filename):
         name, ext = os.path.splitext(filename)
@@ -251,10 +370,11 @@ class RangeUploadHandler:
     @xauth.login_required()
     def POST(self):
         user_name = xauth.current_name()
-        part_file = True
-        chunksize = 5 * 1024 * 1024
         chunk = xutils.get_argument_int("chunk")
         chunks = xutils.get_argument("chunks", 1, type=int)
+        size = xutils.get_argument_int("size", -1)
+        chunk_size = xutils.get_argument_int("chunk_size", 5 * 1024 * 1024)
+        upload_id = get_upload_id()
         file = xutils.get_argument("file", {})
         prefix = xutils.get_argument("prefix", "")
         dirname = xutils.get_argument_str("dirname", xconfig.DATA_DIR)
@@ -304,32 +424,21 @@ class RangeUploadHandler:
                 web.ctx.status = "500 Server Error"
                 return dict(code="fail", message="文件已存在")
 
-            if part_file:
-                tmp_name = "%s_%d.part" % (filename, chunk)
-                seek = 0
-            else:
-                tmp_name = filename
-                seek = chunk * chunksize
-
             xutils.makedirs(dirname)
-            tmp_path = os.path.join(dirname, tmp_name)
-
-            with open(tmp_path, "wb") as fp:
-                fp.seek(seek)
-                if seek != 0:
-                    xutils.log("seek to {}", seek)
-                for file_chunk in file.file:
-                    fp.write(file_chunk)
+            manifest = RangeUploadManifest(filepath, chunks=chunks, size=size, chunk_size=chunk_size, upload_id=upload_id)
+            try:
+                finished = manifest.write_chunk(chunk, file.file)
+            except Exception as e:
+                xutils.print_exc()
+                web.ctx.status = "500 Server Error"
+                return dict(code="fail", message=str(e))
         else:
             return dict(code="fail", message=u"请选择文件")
-        if part_file and chunk+1 == chunks:
-            self.merge_files(dirname, filename, chunks)
 
-        try_fix_orientation(filepath)
-        try_touch_note(note_id)
+        if finished:
+            self.fire_upload_event(filepath)
+            try_touch_note(note_id)
 
-        if note_id != None and note_id != "":
-            xutils.call("note.touch", note_id)
         return dict(code="success", webpath=webpath, link=get_link(origin_name, webpath))
 
 
@@ -360,10 +469,36 @@ class UploadSearchHandler:
 
 
 class CheckHandler:
+    """查询分片上传已经接收的分片, 用于续传"""
 
     @xauth.login_required()
     def GET(self):
-        pass
+        user_name = xauth.current_name_str()
+        name = xutils.get_argument_str("name")
+        chunks = xutils.get_argument_int("chunks", 1)
+        size = xutils.get_argument_int("size", -1)
+        chunk_size = xutils.get_argument_int("chunk_size", 5 * 1024 * 1024)
+        upload_id = get_upload_id()
+        dirname = xutils.get_argument_str("dirname", xconfig.DATA_DIR)
+        dirname = dirname.replace("$DATA", xconfig.DATA_DIR)
+
+        if ".." in dirname:
+            return dict(code="fail", message="can not access parent directory")
+        if xauth.current_role() != "admin":
+            user_upload_dir = get_user_upload_dir(user_name)
+            if not fsutil.is_parent_dir(user_upload_dir, dirname):
+                return dict(code="403", message="无权操作")
+
+        filename = get_safe_file_name(os.path.basename(name))
+        filepath = os.path.join(dirname, filename)
+        if os.path.exists(filepath):
+            return dict(code="success", exists=True, chunks=[])
+
+        manifest = RangeUploadManifest(filepath, chunks=chunks, size=size, chunk_size=chunk_size, upload_id=upload_id)
+        received = []
+        if manifest.load():
+            received = sorted(manifest.received)
+        return dict(code="success", exists=False, chunks=received)
 
 
 xutils.register_func("fs.get_upload_file_path", get_upload_file_path)
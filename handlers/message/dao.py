@@ -15,7 +15,7 @@ from xutils import dateutil
 from xutils.functions import del_dict_key
 from xtemplate import T
 from xutils.db.dbutil_helper import new_from_dict
-from xnote.service import TagBindService, TagTypeEnum
+from xnote.service import TagBindService, TagTypeEnum, SearchIndexService, SearchTypeEnum
 from .message_model import is_task_tag
 
 VALID_MESSAGE_PREFIX_TUPLE = ("message:", "msg_key:", "msg_task:")
@@ -138,14 +138,17 @@ def build_task_index(kw):
 
 def execute_after_create(kw):
     build_task_index(kw)
+    MsgSearchIndexDao.update_index(kw)
 
 
 def execute_after_update(kw):
     build_task_index(kw)
+    MsgSearchIndexDao.update_index(kw)
 
 
 def execute_after_delete(kw):
     build_task_index(kw)
+    MsgSearchIndexDao.delete_index(kw.get_int_id())
 
 def _create_message_with_date(kw):
     assert isinstance(kw, MessageDO)
@@ -174,6 +177,7 @@ def _create_message_with_date(kw):
     msg_id = MsgIndexDao.insert(msg_index)
     _msg_db.update_by_id(str(msg_id), kw)
     kw.id = kw._key
+    execute_after_create(kw)
     return kw._key
 
 
@@ -264,37 +268,36 @@ def search_message(user_name, key, offset=0, limit=20, *, search_tags=None, no_t
     assert date != None
 
     words = get_words_from_key(key)
+    user_id = xauth.UserDao.get_id_by_name(user_name)
+    # 倒排索引只能按照词元匹配, 关键字包含符号或者需要检查标签的时候, 需要用原文再过滤一次
+    need_check = (no_tag is True) or not MsgSearchIndexDao.is_plain_words(words)
 
-    def search_func_default(key, value):
+    def is_match(value):
         if value.content is None:
             return False
         if no_tag is True and has_tag_fast(value.content):
             return False
-        value_date = dateutil.format_date(value.ctime)
-        if value_date == None or not value_date.startswith(date):
-            return False
         return textutil.contains_all(value.content.lower(), words)
 
-    def search_func_with_tags(key, value):
-        if value.tag not in search_tags:
-            return False
-        return search_func_default(key, value)
-
-    if search_tags != None:
-        search_func = search_func_with_tags
-    else:
-        search_func = search_func_default
-
-    if count_only:
-        chatlist = []
-    else:
-        chatlist = _msg_db.list(filter_func=search_func, offset=offset,
-                                limit=limit, reverse=True, user_name=user_name)
-        # 按照创建时间倒排 (按日期补充的随手记的key不是按时间顺序的)
-    
-    chatlist = MessageDO.from_dict_list(chatlist)
-    chatlist.sort(key = lambda x:x.ctime, reverse=True)
-    amount = _msg_db.count(filter_func=search_func, user_name=user_name)
+    chatlist = []
+    amount = 0
+    index_list = MsgSearchIndexDao.list_index(user_id, key, search_tags=search_tags, date=date)
+    if not need_check:
+        # 索引的结果就是最终结果, 只需要加载当前页的数据
+        if not count_only:
+            chatlist = MessageDao.batch_get_by_index_list(index_list[offset:offset+limit], user_name)
+        return chatlist, len(index_list)
+
+    batch_size = MsgSearchIndexDao.batch_size
+    for batch_start in range(0, len(index_list), batch_size):
+        batch_index = index_list[batch_start:batch_start+batch_size]
+        batch_result = MessageDao.batch_get_by_index_list(batch_index, user_name)
+        batch_result = [x for x in batch_result if is_match(x)]
+        if not count_only:
+            page_start = max(0, offset - amount)
+            page_end = max(0, offset + limit - amount)
+            chatlist += batch_result[page_start:page_end]
+        amount += len(batch_result)
     return chatlist, amount
 
 
@@ -776,6 +779,74 @@ class MsgIndexDao:
         return cls.db.select_first(where=where, vars=vars)
 
 
+class MsgSearchIndexDao:
+    """随手记的全文索引, 在创建/更新/删除的时候同步维护"""
+    service = SearchIndexService(SearchTypeEnum.msg)
+    batch_size = 200
+    # 倒排索引可以精确匹配的关键字
+    plain_word_pattern = re.compile(r"^([0-9a-z_]+|[\u3400-\u4dff\u4e00-\u9fff]{1,2})$")
+
+    @classmethod
+    def is_plain_words(cls, words=[]):
+        for word in words:
+            if cls.plain_word_pattern.match(word) == None:
+                return False
+        return True
+
+    @classmethod
+    def update_index(cls, message: MessageDO):
+        user_id = message.user_id
+        if user_id in (0, None):
+            user_id = xauth.UserDao.get_id_by_name(message.user)
+        if user_id == 0:
+            return
+        cls.service.update_index(user_id=user_id, target_id=message.get_int_id(), text=message.content or "")
+
+    @classmethod
+    def delete_index(cls, msg_id=0):
+        cls.service.delete_index(target_id=msg_id)
+
+    @classmethod
+    def list_index(cls, user_id=0, key="", search_tags=None, date=""):
+        """查询匹配的索引记录, 标签和日期使用索引表过滤, 按照创建时间倒序"""
+        if user_id == 0:
+            return []
+
+        where = "user_id=$user_id"
+        vars = dict(user_id=user_id)
+        if search_tags != None:
+            where += " AND tag IN $search_tags"
+            vars["search_tags"] = list(search_tags)
+        if date != "":
+            where += " AND date LIKE $date_prefix"
+            vars["date_prefix"] = date + "%"
+
+        words = textutil.split_words(key)
+        if len(textutil.split_query_tokens(words)) == 0:
+            # 没有可以检索的词元, 只按照条件过滤
+            return MsgIndexDao.db.select(what="id,ctime", where=where, vars=vars, order="ctime desc")
+
+        id_list = sorted(cls.service.match(user_id, words).target_ids)
+        result = []
+        for start in range(0, len(id_list), cls.batch_size):
+            batch_vars = dict(vars)
+            batch_vars["id_list"] = id_list[start:start+cls.batch_size]
+            result += MsgIndexDao.db.select(what="id,ctime", where=where + " AND id IN $id_list", vars=batch_vars)
+        result.sort(key = lambda x:(x.ctime, x.id), reverse=True)
+        return result
+
+    @classmethod
+    def rebuild_user_index(cls, user_name=""):
+        user_id = xauth.UserDao.get_id_by_name(user_name)
+        count = 0
+        for index_list in MsgIndexDao.db.iter_batch(batch_size=cls.batch_size, where="AND user_id=$user_id", vars=dict(user_id=user_id)):
+            for message in MessageDao.batch_get_by_index_list(index_list, user_name):
+                cls.update_index(message)
+                count += 1
+        logging.info("rebuild message search index, user=%s, count=%s", user_name, count)
+        return count
+
+
 class MsgTagInfo(Storage):
     def __init__(self):
         self._key = "" # kv的真实key
@@ -37,12 +37,12 @@ from xutils.db.dbutil_helper import new_from_dict
 from xutils import lists
 from web.db import SQLLiteral
 
-def register_note_table(name, description, check_user=False, user_attr=None):
+def register_note_table(name, description, check_user=False, user_attr=None, binlog=False):
     dbutil.register_table(name, description, category="note",
-                          check_user=check_user, user_attr=user_attr)
+                          check_user=check_user, user_attr=user_attr, binlog=binlog)
     
-register_note_table("notebook", "笔记分组", check_user=True, user_attr="creator")
-register_note_table("token", "用于分享的令牌")
+register_note_table("notebook", "笔记分组", check_user=True, user_attr="creator", binlog=True)
+register_note_table("token", "用于分享的令牌", binlog=True)
 
 NOTE_DAO = xutils.DAO("note")
 
@@ -195,7 +195,9 @@ class NoteIndexDao:
             index_do[key] = note_do.get(key)
         index_do.pop("id", None)
         index_do.before_save(note_do)
-        return cls.db.insert(**index_do)
+        new_id = cls.db.insert(**index_do)
+        NoteStatDao.update_bucket(index_do.creator_id, note_do.creator, new_index=index_do)
+        return new_id
     
     @classmethod
     def update(cls, note_do: NoteDO):
@@ -207,7 +209,27 @@ class NoteIndexDao:
                 index_do[key] = value
         index_do.before_save(note_do)
         note_id = int(note_do.id)
-        return cls.db.update(where=dict(id=note_id), **index_do)
+        old_index = cls.get_stat_fields(note_id)
+        result = cls.db.update(where=dict(id=note_id), **index_do)
+        cls.update_stat(old_index, index_do, note_do.creator)
+        return result
+
+    @classmethod
+    def get_stat_fields(cls, note_id=0):
+        """查询统计需要的字段"""
+        return cls.db.select_first(what="creator_id,type,is_deleted,level", where=dict(id=note_id))
+
+    @classmethod
+    def update_stat(cls, old_index, new_index, creator=""):
+        if old_index == None:
+            return
+        if new_index != None:
+            new_index = Storage(type=new_index.get("type", old_index.type),
+                                is_deleted=new_index.get("is_deleted", old_index.is_deleted),
+                                level=new_index.get("level", old_index.level))
+            if (new_index.type, new_index.is_deleted, new_index.level) == (old_index.type, old_index.is_deleted, old_index.level):
+                return
+        NoteStatDao.update_bucket(old_index.creator_id, creator, old_index=old_index, new_index=new_index)
 
     @classmethod
     def update_visit_cnt(cls, note_id=0, user_id=0, visit_cnt=0):
@@ -222,7 +244,10 @@ class NoteIndexDao:
 
     @classmethod
     def update_level(cls, note_id=0, level=0):
-        return cls.db.update(where=dict(id=note_id), level=level, mtime=xutils.format_datetime())
+        old_index = cls.get_stat_fields(int(note_id))
+        result = cls.db.update(where=dict(id=note_id), level=level, mtime=xutils.format_datetime())
+        cls.update_stat(old_index, dict(level=level))
+        return result
 
     @classmethod
     def get_by_id(cls, id=0):
@@ -361,7 +386,10 @@ class NoteIndexDao:
     
     @classmethod
     def delete_by_id(cls, note_id=0):
-        return cls.db.delete(where=dict(id=note_id))
+        old_index = cls.get_stat_fields(note_id)
+        result = cls.db.delete(where=dict(id=note_id))
+        cls.update_stat(old_index, None)
+        return result
     
     @classmethod
     def find_prev(cls, creator_id=0, parent_id=0, name=""):
@@ -1602,37 +1630,36 @@ def search_name(words, creator="", parent_id=0, orderby="hot_index", limit=1000)
     return result
 
 
-def search_content(words, creator="", orderby="hot_index", limit=1000):
-    # TODO 全文搜索排序使用索引
+def rank_content(words, creator="", top_k=20):
+    """全文搜索, 按照相关性(BM25)排序, 只返回前 top_k 个笔记
+    @return (notes, total)
+    """
     assert isinstance(words, list)
-    words = [word.lower() for word in words]
-
-    def is_match(value):
-        if value.content is None:
-            return False
-        return (value.creator == creator or value.is_public) \
-            and textutil.contains_all(value.content.lower(), words)
+    from .dao_search import NoteSearchIndexDao
 
     creator_id = xauth.UserDao.get_id_by_name(creator)
-    result = []
-
-    for index_list in NoteIndexDao.iter_batch(creator_id=creator_id, batch_size=20):
-        id_list = [str(x.id) for x in index_list]
-        batch_result = _full_db.batch_get_by_id(id_list)
-        for key in batch_result:
-            value = batch_result[key]
-            if is_match(value):
-                value.content = ""
-                value.data = ""
-                result.append(value)
-            if len(result) > limit:
-                break
+    if creator_id == 0:
+        return [], 0
 
-    # 补全信息
-    build_note_list_info(result)
+    id_list, total = NoteSearchIndexDao.rank(creator_id=creator_id, words=words, top_k=top_k)
+    note_dict = dict()
+    for note in NoteIndexDao.get_by_id_list(id_list):
+        note_dict[note.id] = note
 
-    # 对笔记进行排序
-    sort_notes(result, orderby)
+    result = []
+    for note_id in id_list:
+        note = note_dict.get(note_id)
+        if note != None:
+            result.append(note)
+    return result, total
+
+
+def search_content(words, creator="", orderby="score", limit=1000):
+    """基于倒排索引的全文搜索, 多个关键字之间是AND关系"""
+    result, total = rank_content(words, creator, top_k=limit)
+    if orderby != "score":
+        # 对笔记进行排序
+        sort_notes(result, orderby)
     return result
 
 
@@ -1795,9 +1822,12 @@ class NoteStatDO(Storage):
         self.comment_count = 0
         self.tag_count = 0
         self.update_time = 0.0
+        # 按照 type:is_deleted:level 分桶的笔记数量
+        self.buckets = {} # type: dict[str, int]
 
     def is_expired(self):
-        expire_time = 60 * 60 # 1小时
+        # 笔记数量是增量维护的, 定期全量校准一次
+        expire_time = 60 * 60 * 24 # 1天
         return time.time() - self.update_time > expire_time
 
     @classmethod
@@ -1806,6 +1836,133 @@ class NoteStatDO(Storage):
         result.update(dict_value)
         return result
 
+    @staticmethod
+    def get_bucket_key(type="", is_deleted=0, level=0):
+        return "%s:%s:%s" % (type, is_deleted, level)
+
+    def add_bucket(self, type="", is_deleted=0, level=0, delta=1):
+        key = self.get_bucket_key(type, is_deleted, level)
+        value = self.buckets.get(key, 0) + delta
+        if value <= 0:
+            self.buckets.pop(key, None)
+        else:
+            self.buckets[key] = value
+
+    def compute_counts(self):
+        """根据分桶计算各个类型的数量"""
+        type_count = dict()
+        self.total = 0
+        self.group_count = 0
+        self.sticky_count = 0
+        self.removed_count = 0
+        for key, amount in self.buckets.items():
+            type, is_deleted, level = key.rsplit(":", 2)
+            if is_deleted != "0":
+                self.removed_count += amount
+                continue
+            if type == "group":
+                self.group_count += amount
+            else:
+                self.total += amount
+            if level == "1":
+                self.sticky_count += amount
+            type_count[type] = type_count.get(type, 0) + amount
+
+        self.doc_count = type_count.get("doc", 0)
+        self.gallery_count = type_count.get("gallery", 0)
+        self.list_count = type_count.get("list", 0)
+        self.table_count = type_count.get("table", 0) + type_count.get("csv", 0)
+        self.plan_count = type_count.get("plan", 0)
+        self.log_count = type_count.get("log", 0)
+
+
+class NoteStatDao:
+    """笔记统计
+    - 全量刷新: note_index 上一次 GROUP BY type,is_deleted,level 的查询
+    - 增量更新: note_index 写入/评论/标签变更的时候更新对应的计数
+    """
+
+    prefix = "user_stat"
+
+    @classmethod
+    def get_key(cls, user_name=""):
+        return "%s:%s:note" % (cls.prefix, user_name)
+
+    @classmethod
+    def get(cls, user_name=""):
+        value = dbutil.get(cls.get_key(user_name))
+        if value == None or "buckets" not in value:
+            # 旧版本的统计数据没有分桶信息, 需要全量刷新
+            return None
+        return NoteStatDO.from_dict(value)
+
+    @classmethod
+    def save(cls, user_name="", stat=None):
+        dbutil.put(cls.get_key(user_name), stat)
+
+    @classmethod
+    def count_buckets(cls, creator_id=0):
+        records = NoteIndexDao.db.select(what="type,is_deleted,level,COUNT(*) AS amount",
+                                         where=dict(creator_id=creator_id),
+                                         group="type,is_deleted,level")
+        buckets = dict()
+        for record in records:
+            key = NoteStatDO.get_bucket_key(record.type, record.is_deleted, record.level)
+            buckets[key] = buckets.get(key, 0) + record.amount
+        return buckets
+
+    @classmethod
+    def refresh(cls, user_name=""):
+        creator_id = xauth.UserDao.get_id_by_name(user_name)
+        stat = NoteStatDO()
+        stat.buckets = cls.count_buckets(creator_id)
+        stat.compute_counts()
+        stat.dict_count = count_dict(user_name)
+        stat.comment_count = NoteDao.count_comment(user_name)
+        stat.tag_count = NoteDao.count_tag(user_name)
+        stat.update_time = time.time()
+        cls.save(user_name, stat)
+        return stat
+
+    @classmethod
+    def get_user_name(cls, creator_id=0, creator=""):
+        if creator != "" and creator != None:
+            return creator
+        user_info = xauth.UserDao.get_by_id(creator_id)
+        if user_info == None:
+            return None
+        return user_info.name
+
+    @classmethod
+    def update_bucket(cls, creator_id=0, creator="", old_index=None, new_index=None):
+        """note_index 变更后增量更新统计, 还没有统计数据的时候跳过, 查询的时候会全量刷新"""
+        user_name = cls.get_user_name(creator_id, creator)
+        if user_name == None:
+            return
+        with dbutil.get_write_lock(user_name):
+            stat = cls.get(user_name)
+            if stat == None:
+                return
+            if old_index != None:
+                stat.add_bucket(old_index.type, old_index.is_deleted, old_index.level, -1)
+            if new_index != None:
+                stat.add_bucket(new_index.type, new_index.is_deleted, new_index.level, 1)
+            stat.compute_counts()
+            cls.save(user_name, stat)
+
+    @classmethod
+    def incr(cls, user_name="", field="", delta=1):
+        """更新评论/标签这种计数"""
+        if user_name == None or user_name == "":
+            return
+        with dbutil.get_write_lock(user_name):
+            stat = cls.get(user_name)
+            if stat == None:
+                return
+            stat[field] = max(0, (stat.get(field) or 0) + delta)
+            cls.save(user_name, stat)
+
+
 @xutils.async_func_deco()
 def refresh_note_stat_async(user_name):
     """异步刷新笔记统计"""
@@ -1816,27 +1973,7 @@ def refresh_note_stat(user_name):
     assert user_name != None, "[refresh_note_stat.assert] user_name != None"
 
     with dbutil.get_write_lock(user_name):
-        stat = NoteStatDO()
-        if user_name is None:
-            return stat
-
-        stat.total = count_by_creator(user_name)
-        stat.group_count = count_group(user_name)
-        stat.doc_count = count_by_type(user_name, "doc")
-        stat.gallery_count = count_by_type(user_name, "gallery")
-        stat.list_count = count_by_type(user_name, "list")
-        stat.table_count = count_by_type(user_name, "table")
-        stat.plan_count = count_by_type(user_name, "plan")
-        stat.log_count = count_by_type(user_name, "log")
-        stat.sticky_count = count_sticky(user_name)
-        stat.removed_count = count_removed(user_name)
-        stat.dict_count = count_dict(user_name)
-        stat.comment_count = NoteDao.count_comment(user_name)
-        stat.tag_count = NoteDao.count_tag(user_name)
-        stat.update_time = time.time()
-
-        dbutil.put("user_stat:%s:note" % user_name, stat)
-        return stat
+        return NoteStatDao.refresh(user_name)
 
 def get_empty_note_stat():
     stat = NoteStatDO()
@@ -1848,13 +1985,12 @@ def get_empty_note_stat():
 def get_note_stat(user_name):
     if user_name == None:
         return get_empty_note_stat()
-    stat = dbutil.get("user_stat:%s:note" % user_name)
+    stat = NoteStatDao.get(user_name)
     if stat is None:
         stat = refresh_note_stat(user_name)
-    else:
-        stat = NoteStatDO.from_dict(stat)
-        if stat.is_expired():
-            stat = refresh_note_stat(user_name)
+    elif stat.is_expired():
+        # 统计是增量维护的, 过期之后异步校准
+        refresh_note_stat_async(user_name)
     if stat.tag_count == None:
         stat.tag_count = 0
     return stat
@@ -1930,6 +2066,7 @@ xutils.register_func("note.get_or_create", get_or_create_note)
 xutils.register_func("note.get_virtual_group", get_virtual_group)
 xutils.register_func("note.search_name", search_name)
 xutils.register_func("note.search_content", search_content)
+xutils.register_func("note.rank_content", rank_content)
 xutils.register_func("note.search_public", search_public)
 xutils.register_func("note.batch_query_list", batch_query_list)
 
@@ -53,6 +53,7 @@ class CommentDao:
         comment.ctime = dateutil.format_datetime()
         index_id = comment_service.create(type=comment.type, user_id=comment.user_id, target_id=int(comment.note_id))
         _comment_db.update_by_id(str(index_id), comment)
+        note_dao.NoteStatDao.incr(comment.user, "comment_count", 1)
         xmanager.fire("comment.create", comment)
         return index_id
         
@@ -72,6 +73,7 @@ class CommentDao:
         comment = get_comment(comment_id)
         if comment != None:
             _comment_db.delete(comment)
+            note_dao.NoteStatDao.incr(comment.user, "comment_count", -1)
             xmanager.fire("comment.delete", comment)
         comment_service.delete_by_id(int(comment_id))
 
@@ -10,6 +10,7 @@
 """
 
 import xutils
+import xmanager
 from .dao_api import NoteDao
 from .dao import (
     delete_history,
@@ -33,6 +34,8 @@ def delete_note_physically(creator, note_id):
     NoteIndexDao.delete_by_id(int(note_id))
     delete_history(note_id)
 
+    xmanager.fire("note.remove", dict(id=note_id))
+
 
 def delete_note(id):
     note = get_by_id(id)
@@ -65,6 +68,8 @@ def delete_note(id):
     # 删除访问日志
     NoteDao.delete_visit_log(note.creator, note.id)
 
+    xmanager.fire("note.remove", dict(id=note.id))
+
 def recover_note(id):
     """恢复删除的笔记"""
     note = get_by_id(id)
@@ -85,6 +90,8 @@ def recover_note(id):
     # 更新数量
     update_children_count(note.parent_id)
 
+    xmanager.fire("note.recover", dict(id=note.id))
+
 xutils.register_func("note.delete", delete_note)
 xutils.register_func("note.delete_physically", delete_note_physically)
 
@@ -0,0 +1,141 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 10:30:12
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 10:30:12
+@FilePath     : /xnote/handlers/note/dao_search.py
+@Description  : 笔记全文索引
+"""
+
+import heapq
+import logging
+import xmanager
+from xutils import textutil
+from xnote.service import SearchIndexService, SearchTypeEnum
+from . import dao as note_dao
+
+
+class NoteSearchIndexDao:
+    """笔记内容的倒排索引, 通过 note.add/note.updated/note.remove 事件增量维护"""
+
+    service = SearchIndexService(SearchTypeEnum.note)
+    # 标题和标签命中的权重, 内容的权重是1
+    name_weight = 3.0
+    tag_weight = 2.0
+    # 标题和标签的平均长度, 用于BM25的长度归一化
+    name_avg_len = 8
+    tag_avg_len = 2
+    # 每次查询笔记索引的数量
+    batch_size = 200
+
+    @classmethod
+    def update_by_id(cls, note_id=0):
+        note = note_dao.get_by_id(note_id)
+        if note is None:
+            cls.delete_by_id(note_id)
+            return
+        cls.update_note(note)
+
+    @classmethod
+    def update_note(cls, note):
+        note_id = int(note.id)
+        if note.is_deleted or note.creator_id in (0, None):
+            cls.delete_by_id(note_id)
+            return
+        cls.service.update_index(user_id=note.creator_id, target_id=note_id, text=note.content)
+
+    @classmethod
+    def delete_by_id(cls, note_id=0):
+        cls.service.delete_index(target_id=int(note_id))
+
+    @classmethod
+    def search(cls, creator_id=0, words=[], limit=1000):
+        return cls.service.search(user_id=creator_id, words=words, limit=limit)
+
+    @classmethod
+    def score_field(cls, text="", tokens=[], idf_dict={}, avg_len=0):
+        """按照BM25计算标题/标签这种短字段的得分"""
+        if text == "" or text == None:
+            return 0.0
+        tf_dict = dict()
+        doc_len = 0
+        for token, _ in textutil.split_index_tokens(text):
+            tf_dict[token] = tf_dict.get(token, 0) + 1
+            doc_len += 1
+
+        score = 0.0
+        for token in tokens:
+            tf = tf_dict.get(token, 0)
+            if tf == 0 and not textutil.is_cjk(token[0]):
+                # 英文单词按照前缀匹配
+                tf = sum([tf_dict[x] for x in tf_dict if x.startswith(token)])
+            score += cls.service.compute_bm25(tf, doc_len, avg_len, idf_dict.get(token, 0.0))
+        return score
+
+    @classmethod
+    def rank(cls, creator_id=0, words=[], top_k=20):
+        # type: (int, list[str], int) -> tuple[list[int], int]
+        """按照相关性排序, 只保留前 top_k 个结果
+        @return (id_list, total)
+        """
+        service = cls.service
+        match_result = service.match(creator_id, words)
+        if len(match_result.target_ids) == 0:
+            return [], 0
+
+        scores = service.score_bm25(creator_id, match_result)
+        stat = service.get_corpus_stat(creator_id)
+        idf_dict = dict()
+        for token in match_result.tokens:
+            df = match_result.df_dict.get(token, 0)
+            idf_dict[token] = service.compute_idf(stat.doc_count, df)
+
+        heap = [] # type: list[tuple[float, int]]
+        total = 0
+        id_list = sorted(match_result.target_ids)
+        for start in range(0, len(id_list), cls.batch_size):
+            batch_ids = id_list[start:start+cls.batch_size]
+            records = note_dao.NoteIndexDao.db.select(what="id,name,tag_str,is_deleted",
+                where="id IN $id_list", vars=dict(id_list=batch_ids))
+            for record in records:
+                if record.is_deleted != 0:
+                    continue
+                total += 1
+                score = scores.get(record.id, 0.0)
+                score += cls.name_weight * cls.score_field(record.name, match_result.tokens, idf_dict, cls.name_avg_len)
+                score += cls.tag_weight * cls.score_field(record.tag_str, match_result.tokens, idf_dict, cls.tag_avg_len)
+                item = (score, record.id)
+                if top_k <= 0 or len(heap) < top_k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+        heap.sort(reverse=True)
+        return [x[1] for x in heap], total
+
+    @classmethod
+    def rebuild_user_index(cls, creator_id=0):
+        """重建用户的全部笔记索引"""
+        count = 0
+        for index_list in note_dao.NoteIndexDao.iter_batch(creator_id=creator_id, batch_size=20):
+            id_list = [str(x.id) for x in index_list]
+            batch_result = note_dao._full_db.batch_get_by_id(id_list)
+            for key in batch_result:
+                note = batch_result[key]
+                if note is None:
+                    continue
+                cls.update_note(note)
+                count += 1
+        logging.info("rebuild note search index, creator_id=%s, count=%s", creator_id, count)
+        return count
+
+
+@xmanager.listen(["note.add", "note.updated", "note.recover"])
+def on_note_update(ctx):
+    NoteSearchIndexDao.update_by_id(ctx.get("id"))
+
+@xmanager.listen("note.remove")
+def on_note_remove(ctx):
+    NoteSearchIndexDao.delete_by_id(ctx.get("id"))
@@ -168,6 +168,7 @@ class TagMetaDao:
     @staticmethod
     def delete(tag_info):
         tag_meta_db.delete(tag_info)
+        note_dao.NoteStatDao.incr(tag_info.user, "tag_count", -1)
 
     @staticmethod
     def create(tag_info: TagMeta):
@@ -176,6 +177,7 @@ class TagMetaDao:
         assert tag_info.tag_type != ""
         assert tag_info.amount != None
         tag_meta_db.insert(tag_info)
+        note_dao.NoteStatDao.incr(tag_info.user, "tag_count", 1)
 
     @classmethod
     def get_by_name(cls, user_name, tag_name, tag_type="", group_id=None):
@@ -44,7 +44,11 @@ def search(ctx, expression=None):
         return files
 
     if ctx.search_note_content:
-        files += NOTE_DAO.search_content(words, xauth.current_name())
+        # 只需要当前页以及之前的结果, 剩余的只计数
+        top_k = ctx.offset + ctx.limit
+        notes, total = NOTE_DAO.rank_content(words, xauth.current_name(), top_k=top_k)
+        ctx.skipped_count += total - len(notes)
+        files += notes
     
     if ctx.search_note:
         files += NOTE_DAO.search_name(words, xauth.current_name())
@@ -4,6 +4,7 @@
 # @modified 2022/04/16 18:03:13
 
 import re
+import copy
 import time
 import math
 import web
@@ -21,6 +22,7 @@ from xutils import dateutil
 from xutils import mem_util
 from xutils import six
 from xtemplate import T
+from .search_engine import SearchEngine, SearchTask
 
 NOTE_DAO = xutils.DAO("note")
 MSG_DAO  = xutils.DAO("message")
@@ -89,8 +91,47 @@ class SearchContext:
         self.files    = [] # 文件
 
         # 分页信息
-        self.offset = 1
+        self.offset = 0
         self.limit = 20
+        # 只计数没有返回的结果数量, 比如全文搜索只保留了前面几页
+        self.skipped_count = 0
+        # 超时被丢弃的处理器
+        self.dropped_handlers = []
+        # 处理器超时以后设置为True, 耗时的处理器可以检查这个标记提前结束
+        self.cancelled = False
+
+    # 处理器追加写入的结果字段
+    result_fields = ("commands", "tools", "dicts", "messages", "notes", "files")
+    # 合并时单独处理的字段
+    _merge_skip_fields = result_fields + ("skipped_count", "dropped_handlers", "cancelled", "_fork_values")
+
+    def fork(self):
+        """复制一个子上下文, 结果字段清空, 用于并发执行处理器"""
+        sub_ctx = copy.copy(self)
+        for field in self.result_fields:
+            setattr(sub_ctx, field, [])
+        sub_ctx.skipped_count = 0
+        sub_ctx.dropped_handlers = []
+        sub_ctx.cancelled = False
+        # 记录复制时的字段值, 合并的时候只覆盖处理器修改过的字段
+        sub_ctx._fork_values = dict(self.__dict__)
+        return sub_ctx
+
+    def merge(self, sub_ctx):
+        # type: (SearchContext) -> None
+        """合并子上下文: 结果字段追加, 计数累加, 其他被处理器修改过的字段覆盖"""
+        for field in self.result_fields:
+            getattr(self, field).extend(getattr(sub_ctx, field))
+        self.skipped_count += sub_ctx.skipped_count
+        self.stop = self.stop or sub_ctx.stop
+
+        fork_values = sub_ctx.__dict__.get("_fork_values", {})
+        missing = object()
+        for field, value in sub_ctx.__dict__.items():
+            if field in self._merge_skip_fields or field == "stop":
+                continue
+            if fork_values.get(field, missing) is not value:
+                setattr(self, field, value)
 
     def join_as_files(self):
         return self.commands + self.tools + self.dicts + self.messages + self.notes + self.files
@@ -177,6 +218,8 @@ class SearchHandler:
         words      = textutil.split_words(key)
         user_name  = xauth.get_current_name()
         ctx        = build_search_context(user_name, category, key)
+        ctx.offset = offset
+        ctx.limit  = limit
 
         logger = mem_util.MemLogger("do_search")
 
@@ -187,29 +230,32 @@ class SearchHandler:
             return self.do_search_by_type(ctx, key, search_type)
         
         # 阻断性的搜索，比如特定语法的
-        xmanager.fire("search.before", ctx)
+        SearchEngine.fire("search.before", ctx)
         if ctx.stop:
             files = ctx.join_as_files()
             return files, len(files)
 
         logger.info("after fire search.before")
 
-        # 普通的搜索行为
-        xmanager.fire("search", ctx)
+        # 普通的搜索行为和搜索规则并发执行, 搜索规则包含笔记搜索, 不能被丢弃
+        rule_files = []
 
-        logger.info("after fire search")
+        def apply_rules(rule_ctx):
+            rule_files.extend(RuleManager.apply(rule_ctx, key))
 
-        ctx.files = RuleManager.apply(ctx, key)
+        rule_task = SearchTask(key="search.rules", func=apply_rules, ctx=ctx.fork(), required=True)
+        SearchEngine.fire("search", ctx, extra_tasks=[rule_task])
+        # 和串行执行的时候一样, 搜索规则的结果替换ctx.files
+        ctx.files = rule_files
 
-        logger.info("after apply_search_rules")
+        logger.info("after fire search and apply_search_rules")
 
         if ctx.stop:
             files = ctx.join_as_files()
             return files, len(files)
 
         # 慢搜索,如果时间过长,这个服务会被降级
-        # TODO: 异步操作需要其他线程辅助执行
-        xmanager.fire("search.slow", ctx)
+        SearchEngine.fire("search.slow", ctx)
 
         logger.info("after fire search.slow")
 
@@ -220,10 +266,13 @@ class SearchHandler:
         page_ctx.tools = []
         
         search_result = ctx.join_as_files()
-        
-        fill_note_info(search_result)
+        total = len(search_result) + ctx.skipped_count
+
+        # 只处理当前页的数据
+        page_result = search_result[offset:offset+limit]
+        fill_note_info(page_result)
 
-        return search_result[offset:offset+limit], len(search_result)
+        return page_result, total
 
     @mem_util.log_mem_info_deco("do_search_with_profile", log_args = True)
     def do_search_with_profile(self, page_ctx, key, offset, limit):
@@ -0,0 +1,149 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 18:02:33
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 18:02:33
+@FilePath     : /xnote/handlers/search/search_engine.py
+@Description  : 搜索执行引擎
+
+同一个阶段的搜索处理器之间没有依赖, 并发执行
+- 每个处理器使用独立的子上下文(ctx.fork), 完成后按照注册顺序合并到主上下文, 结果顺序和串行执行一致
+- 整个阶段有一个时间预算, 超时的处理器结果直接丢弃, 记录到 ctx.dropped_handlers
+- 超时的处理器设置 ctx.cancelled 通知提前结束, 还在运行的时候后续的搜索直接跳过这个处理器, 避免占满线程池
+- 搜索的总耗时从所有处理器耗时之和变成最慢的那个处理器
+"""
+
+import time
+import logging
+import threading
+import web
+import xconfig
+import xmanager
+import xutils
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+class SearchTask:
+    """一个并发执行的搜索任务"""
+
+    def __init__(self, key="", func=None, ctx=None, required=False):
+        self.key = key
+        self.func = func
+        self.ctx = ctx
+        # 必须的任务没有时间限制, 比如笔记搜索
+        self.required = required
+        self.future = None
+
+
+class SearchEngine:
+
+    _pool = None # type: ThreadPoolExecutor|None
+    _lock = threading.RLock()
+    # 超时以后还在运行的任务数, key是处理器的key
+    _stale_tasks = dict() # type: dict[str, int]
+
+    @classmethod
+    def is_parallel(cls):
+        return xconfig.WebConfig.search_parallel and xconfig.WebConfig.search_workers > 1
+
+    @classmethod
+    def get_pool(cls):
+        if cls._pool == None:
+            with cls._lock:
+                if cls._pool == None:
+                    cls._pool = ThreadPoolExecutor(max_workers=xconfig.WebConfig.search_workers,
+                                                   thread_name_prefix="SearchWorker")
+        return cls._pool
+
+    @classmethod
+    def get_timeout(cls):
+        return xconfig.WebConfig.search_handler_timeout_ms / 1000.0
+
+    @classmethod
+    def create_handler_task(cls, handler, ctx):
+        return SearchTask(key=handler.key, func=handler.execute, ctx=ctx.fork())
+
+    @classmethod
+    def is_stale(cls, key):
+        with cls._lock:
+            return cls._stale_tasks.get(key, 0) > 0
+
+    @classmethod
+    def mark_stale(cls, task):
+        # type: (SearchTask) -> None
+        """超时的任务已经在运行, 无法取消, 记录下来直到运行结束"""
+        with cls._lock:
+            cls._stale_tasks[task.key] = cls._stale_tasks.get(task.key, 0) + 1
+
+        def on_done(future):
+            with cls._lock:
+                count = cls._stale_tasks.get(task.key, 0) - 1
+                if count > 0:
+                    cls._stale_tasks[task.key] = count
+                else:
+                    cls._stale_tasks.pop(task.key, None)
+
+        task.future.add_done_callback(on_done)
+
+    @classmethod
+    def fire(cls, event_type, ctx, extra_tasks=[]):
+        """执行一个阶段的所有处理器"""
+        handlers = xmanager.get_event_manager().get_handlers(event_type)
+        parallel = cls.is_parallel() and len(handlers) + len(extra_tasks) > 1
+        tasks = []
+        for handler in handlers:
+            if parallel and cls.is_stale(handler.key):
+                # 上一次超时的调用还没有结束, 直接跳过
+                ctx.dropped_handlers.append(handler.key)
+                continue
+            tasks.append(cls.create_handler_task(handler, ctx))
+        tasks += extra_tasks
+
+        if len(tasks) == 0:
+            return
+        if not parallel:
+            # 串行执行, 直接使用主上下文
+            for task in tasks:
+                task.func(ctx)
+            return
+        cls.run_tasks(ctx, tasks)
+
+    @classmethod
+    def run_tasks(cls, ctx, tasks):
+        # type: (object, list[SearchTask]) -> None
+        pool = cls.get_pool()
+        # web.ctx是线程变量, 需要复制到工作线程里, 否则拿不到当前用户
+        web_ctx = web.ctx.copy()
+        for task in tasks:
+            task.future = pool.submit(cls.run_task, task, web_ctx)
+
+        deadline = time.time() + cls.get_timeout()
+        for task in tasks:
+            try:
+                if task.required:
+                    task.future.result()
+                else:
+                    task.future.result(timeout=max(0, deadline - time.time()))
+            except TimeoutError:
+                task.ctx.cancelled = True
+                if not task.future.cancel():
+                    cls.mark_stale(task)
+                ctx.dropped_handlers.append(task.key)
+                logging.warning("search handler timeout, key=%s", task.key)
+                continue
+            except:
+                xutils.print_exc()
+                continue
+            ctx.merge(task.ctx)
+
+    @staticmethod
+    def run_task(task, web_ctx):
+        # type: (SearchTask, dict) -> None
+        web.ctx.clear()
+        web.ctx.update(web_ctx)
+        try:
+            task.func(task.ctx)
+        finally:
+            web.ctx.clear()
@@ -8,9 +8,12 @@ import zipfile
 import os
 import time
 import sys
+import json
+import gzip
 import logging
 import threading
 import sqlite3
+import hashlib
 
 import xutils
 import xconfig
@@ -22,6 +25,7 @@ from xutils import Storage
 from xutils import dbutil
 from xutils import fsutil, logutil
 from xutils.db.driver_sqlite import SqliteKV
+from xutils.db.binlog import BinLog, BinLogOpType
 import xtables
 
 config = xconfig
@@ -35,6 +39,10 @@ _dest_path = os.path.join(_dirname, "static", _zipname)
 # 备份的锁
 _backup_lock = threading.RLock()
 _import_logger = logutil.new_mem_logger("import_db", size = 20)
+# 增量备份的清单文件, 记录当前的全量备份和之后的增量备份
+_manifest_name = "backup_manifest.json"
+# 增量备份不需要复制的内部表(binlog/索引/缓存)
+_delta_skip_tables = ("_binlog", "_binlog_seg", "_index", "_idx_version", "_index_repair", "_cache", "_ttl")
 
 def zip_xnote(nameblacklist = [_zipname]):
     dirname = "./"
@@ -68,15 +76,31 @@ def chk_scripts_backup():
     destfile = os.path.join(xconfig.BACKUP_DIR, time.strftime("scripts.%Y-%m-%d.zip"))
     xutils.zip_dir(dirname, destfile)
 
+
+class _OnlineBackupRestartError(Exception):
+    """在线备份重新开始的次数过多"""
+
+
 class DBBackup:
     """数据库备份"""
 
     _progress = 0.0
     _start_time = -1
     _total = 0
-
-    def __init__(self):
+    # 在线备份每一步复制的页数, 每一步结束以后会释放读锁
+    online_step_pages = 1000
+    # 在线备份每一步之间的间隔, 让写入有机会执行
+    online_step_sleep = 0.01
+    # 小文件一次复制完成, 不会因为写入重新开始
+    online_small_file_size = 16 * 1024 * 1024
+    # 分步复制的时候源文件被修改会从头开始, 超过次数以后一次复制完成
+    online_max_restarts = 5
+
+    def __init__(self, backup_dir=""):
         self.db_backup_file = os.path.join(xconfig.TMP_DIR, "temp.db")
+        if backup_dir == "":
+            backup_dir = os.path.join(xconfig.BACKUP_DIR, "db")
+        self.backup_dir = backup_dir
 
     @staticmethod
     def progress():
@@ -111,18 +135,140 @@ class DBBackup:
             logging.info("删除db备份文件:%s", db_backup_file)
             fsutil.rmfile(db_backup_file, hard = True)
 
-        # TODO 删除多余的备份文件
+    def clean_delta_files(self, manifest=None):
+        """删除清单里面没有引用的增量备份文件, 新的全量备份写入以后之前的增量备份都失效了"""
+        if not os.path.exists(self.backup_dir):
+            return
+        keep_files = set()
+        if manifest != None:
+            keep_files = set([delta["file"] for delta in manifest.deltas])
+        for fname in os.listdir(self.backup_dir):
+            if not (fname.endswith(".delta.gz") or fname.endswith(".delta.gz.tmp")):
+                continue
+            if fname in keep_files:
+                continue
+            fpath = os.path.join(self.backup_dir, fname)
+            logging.info("删除增量备份文件:%s", fpath)
+            fsutil.rmfile(fpath, hard = True)
     
     def get_backup_logger(self):
         return logutil.get_mem_logger("backup_db", size = 20, ttl = -1)
 
+    def is_online_backup(self):
+        """sqlite使用页复制的在线备份"""
+        return xconfig.DatabaseConfig.db_driver_sql == "sqlite" and xconfig.FileConfig.db_backup_online
+
     def dump_db(self, backup_kv = True, backup_sql=True):
         count = 0
+        online_backup = False
+        if backup_sql and self.is_online_backup():
+            # 页复制会覆盖整个目标文件, 所以要在KV备份之前执行
+            online_backup = self.backup_sql_tables_online()
         if backup_kv:
             count = self.backup_kv_store()
-        if backup_sql:
+        if backup_sql and not online_backup:
+            # 在线备份失败的时候降级为按行复制
             self.backup_sql_tables()
         return count
+
+    def get_sql_db_paths(self):
+        """按照数据库文件对表进行分组, 默认的数据库文件排在最前面
+        @return list[tuple[str, list[str]]]
+        """
+        path_dict = dict() # type: dict[str, list[str]]
+        table_dict = xtables.TableManager.get_table_info_dict()
+        for table_name in table_dict:
+            table_info = table_dict[table_name]
+            if table_info.is_deleted or table_name == "kv_store":
+                # kv_store在backup_kv_store里面备份
+                continue
+            path_dict.setdefault(table_info.dbpath, []).append(table_name)
+
+        main_path = xconfig.FileConfig.record_db_file
+        return sorted(path_dict.items(), key=lambda item: item[0] != main_path)
+
+    def backup_sql_tables_online(self):
+        """使用sqlite的在线备份接口按页复制数据库文件
+        @return {bool} 是否备份成功, 失败的时候会删除不完整的备份文件
+        """
+        logger = self.get_backup_logger()
+        start_time = time.time()
+        DBBackup._start_time = start_time
+        try:
+            for index, item in enumerate(self.get_sql_db_paths()):
+                dbpath, table_names = item
+                if index == 0:
+                    self.backup_sqlite_file(dbpath, self.db_backup_file)
+                    continue
+                # 其他数据库文件先复制到临时文件, 再合并到备份文件
+                temp_path = self.db_backup_file + ".part"
+                self.backup_sqlite_file(dbpath, temp_path)
+                self.merge_sqlite_tables(temp_path, table_names)
+                fsutil.rmfile(temp_path, hard = True)
+            logger.log("online backup done, cost_time:(%.2fs)", time.time() - start_time)
+            return True
+        except:
+            err_info = xutils.print_exc()
+            logger.log("online backup failed: (%s)" % err_info)
+            for path in (self.db_backup_file, self.db_backup_file + ".part"):
+                if os.path.exists(path):
+                    fsutil.rmfile(path, hard = True)
+            return False
+        finally:
+            DBBackup._start_time = -1
+            DBBackup._progress = 0.0
+
+    def backup_sqlite_file(self, source_path, target_path):
+        logger = self.get_backup_logger()
+        pages = self.online_step_pages
+        if os.path.getsize(source_path) <= self.online_small_file_size:
+            pages = -1
+        restarts = 0
+        last_remaining = -1
+
+        def on_progress(status, remaining, total):
+            nonlocal restarts, last_remaining
+            DBBackup._total = total
+            if total > 0:
+                DBBackup._progress = (total - remaining) / total
+            logger.log("backup file:(%s), pages:(%d/%d)" % (source_path, total - remaining, total))
+            if last_remaining >= 0 and remaining > last_remaining:
+                # 源文件被其他连接修改, sqlite从头开始复制
+                restarts += 1
+            last_remaining = remaining
+            if restarts > self.online_max_restarts:
+                raise _OnlineBackupRestartError(source_path)
+            time.sleep(self.online_step_sleep)
+
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(target_path)
+        try:
+            try:
+                source.backup(target, pages=pages, progress=on_progress)
+            except _OnlineBackupRestartError:
+                logger.log("backup file:(%s) restarted %d times, copy all pages at once" % (source_path, restarts))
+                source.backup(target, pages=-1)
+        finally:
+            target.close()
+            source.close()
+
+    def merge_sqlite_tables(self, source_path, table_names):
+        db = sqlite3.connect(self.db_backup_file)
+        try:
+            db.execute("ATTACH DATABASE ? AS source", (source_path,))
+            for table_name in table_names:
+                exists = db.execute("SELECT 1 FROM main.sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone()
+                if exists != None:
+                    logging.warning("backup table conflict: %s", table_name)
+                    continue
+                schema_sql = "SELECT sql FROM source.sqlite_master WHERE tbl_name=? AND sql IS NOT NULL ORDER BY type='table' DESC"
+                for (create_sql,) in db.execute(schema_sql, (table_name,)).fetchall():
+                    db.execute(create_sql)
+                db.execute("INSERT INTO main.`%s` SELECT * FROM source.`%s`" % (table_name, table_name))
+            db.commit()
+            db.execute("DETACH DATABASE source")
+        finally:
+            db.close()
     
     def backup_sql_tables(self):
         logger = self.get_backup_logger()
@@ -181,27 +327,29 @@ class DBBackup:
         count = 0
         try:
             batch = dbutil.create_write_batch()
-            for key, value in dbutil.get_instance().RangeIter(include_value = True):
-                # 可能是bytearray
-                key = bytes(key)
-                value = bytes(value)
-                
-                if key.startswith(b"_index$"):
-                    # 索引不需要备份
-                    continue
-
-                batch.put_bytes(key, value)
-                count += 1
-                # 更新进度
-                DBBackup._progress = count / total_count
-                if count % 100 == 0:
-                    db2.Write(batch)
-                    batch = dbutil.create_write_batch()
-
-                    cost_time = time.time() - start_time
-                    progress = count/total_count*100.0
-                    qps = calc_qps(count, cost_time)
-                    logger.log("proceed:(%d), progress:(%.2f%%), qps:(%.2f)" % (count, progress, qps))
+            # 在快照上遍历, 备份的是同一时刻的数据, 并且不阻塞写入
+            with dbutil.DBSnapshot() as snapshot:
+                for key, value in snapshot.RangeIter(include_value = True):
+                    # 可能是bytearray
+                    key = bytes(key)
+                    value = bytes(value)
+                    
+                    if key.startswith(b"_index$"):
+                        # 索引不需要备份
+                        continue
+
+                    batch.put_bytes(key, value)
+                    count += 1
+                    # 更新进度
+                    DBBackup._progress = count / total_count
+                    if count % 100 == 0:
+                        db2.Write(batch)
+                        batch = dbutil.create_write_batch()
+
+                        cost_time = time.time() - start_time
+                        progress = count/total_count*100.0
+                        qps = calc_qps(count, cost_time)
+                        logger.log("proceed:(%d), progress:(%.2f%%), qps:(%.2f)" % (count, progress, qps))
 
             db2.Write(batch)
             db2.Close()
@@ -233,10 +381,37 @@ class DBBackup:
                 _backup_lock.release()
 
     def do_execute(self, backup_kv=True):
+        if backup_kv:
+            manifest = load_manifest(self.backup_dir)
+            if self.can_backup_delta(manifest):
+                return self.backup_delta(manifest)
+        return self.backup_base(backup_kv=backup_kv)
+
+    def can_backup_delta(self, manifest):
+        """是否可以基于binlog做增量备份"""
+        if manifest == None or not BinLog.is_enabled():
+            return False
+        if not os.path.exists(os.path.join(self.backup_dir, manifest.base_file)):
+            return False
+        base_expire_seconds = xconfig.FileConfig.db_backup_base_interval_days * 3600 * 24
+        if time.time() - manifest.base_time >= base_expire_seconds:
+            # 定期重新做全量备份
+            return False
+        binlog = BinLog.get_instance()
+        if manifest.last_seq > binlog.last_seq:
+            # binlog被重置过
+            return False
+        # 需要的binlog已经被清理了
+        return binlog.find_start_seq() <= manifest.last_seq + 1
+
+    def backup_base(self, backup_kv=True):
+        """全量备份"""
         # 先做清理工作
         self.clean()
 
         start_time = time.time()
+        # 先记录binlog位点, 备份过程中的写入通过增量备份补齐
+        base_seq = BinLog.get_instance().last_seq
         # 执行备份
         count = self.dump_db(backup_kv=backup_kv)
 
@@ -244,10 +419,11 @@ class DBBackup:
         logging.info("数据库记录总数:%s", count)
 
         # 保存为压缩文件
-        dirname = os.path.join(xconfig.BACKUP_DIR, "db")
+        dirname = self.backup_dir
         xutils.makedirs(dirname)
         
-        destfile = os.path.join(dirname, time.strftime("%Y-%m-%d.db"))
+        base_file = time.strftime("%Y-%m-%d.db")
+        destfile = os.path.join(dirname, base_file)
 
         if os.path.exists(destfile):
             fsutil.rmfile(destfile)
@@ -257,8 +433,158 @@ class DBBackup:
         # 再次清理
         self.clean()
 
+        manifest = None
+        if backup_kv and BinLog.is_enabled():
+            manifest = Storage(base_file=base_file, base_seq=base_seq, base_time=int(start_time),
+                               last_seq=base_seq, deltas=[])
+            save_manifest(dirname, manifest)
+        else:
+            # 之前的清单指向旧的全量备份, 已经失效了
+            remove_manifest(dirname)
+        self.clean_delta_files(manifest)
+
         return dict(count = count, cost_time = "%sms" % cost_time)
 
+    def collect_changed_keys(self, last_seq=0):
+        """收集last_seq之后变更的key, 同一个key只保留一次"""
+        kv_keys = set()
+        sql_keys = dict() # type: dict[str, set]
+        end_seq = last_seq
+        for seq, log in BinLog.get_instance().iter_logs(last_seq + 1):
+            end_seq = seq
+            optype = log.get("optype")
+            key = log.get("key")
+            if optype in (BinLogOpType.put, BinLogOpType.delete):
+                if not key.startswith(("_index$", "_binlog")):
+                    kv_keys.add(key)
+            elif optype in (BinLogOpType.sql_upsert, BinLogOpType.sql_delete):
+                sql_keys.setdefault(log.get("table_name"), set()).add(key)
+        return end_seq, sorted(kv_keys), sql_keys
+
+    def get_full_copy_tables(self):
+        """没有开启binlog的KV表, 增量备份的时候全量复制"""
+        result = []
+        for table_name in dbutil.get_table_names():
+            table_info = dbutil.get_table_info(table_name)
+            if table_info.binlog or table_info.is_deleted or table_info.type == "index":
+                continue
+            if table_name in _delta_skip_tables:
+                continue
+            result.append(table_name)
+        return result
+
+    def iter_delta_records(self, kv_keys, sql_keys, full_copy_tables=[]):
+        """读取变更key的当前值, 值为空表示删除"""
+        batch_size = 200
+        db = dbutil.get_instance()
+        full_copy_prefixes = tuple(table_name + ":" for table_name in full_copy_tables)
+        kv_keys = [key for key in kv_keys if not key.startswith(full_copy_prefixes)]
+        for i in range(0, len(kv_keys), batch_size):
+            keys = kv_keys[i:i+batch_size]
+            values = db.BatchGet([key.encode("utf-8") for key in keys])
+            for key in keys:
+                value = values.get(key.encode("utf-8"))
+                if value != None:
+                    value = bytes(value).decode("utf-8")
+                yield dict(t="kv", k=key, v=value)
+
+        with dbutil.DBSnapshot() as snapshot:
+            for table_name in full_copy_tables:
+                # 恢复的时候先清空整个表, 然后写入下面的记录
+                yield dict(t="kv_table", table=table_name)
+                for key, value in dbutil.prefix_iter(table_name, include_key=True, parse_json=False, snapshot=snapshot):
+                    yield dict(t="kv", k=key, v=value)
+
+        for table_name in sorted(sql_keys.keys()):
+            if not xtables.is_table_exists(table_name):
+                continue
+            table = xtables.get_table_by_name(table_name)
+            pk_name = table.table_info.pk_name
+            pk_list = list(sql_keys[table_name])
+            for i in range(0, len(pk_list), batch_size):
+                batch_keys = pk_list[i:i+batch_size]
+                rows = table.select(where="%s IN $batch_keys" % pk_name, vars=dict(batch_keys=batch_keys))
+                row_dict = dict()
+                for row in rows:
+                    row_dict[str(row.get(pk_name))] = row
+                for pk in batch_keys:
+                    row = row_dict.get(str(pk))
+                    if row != None:
+                        row = dict(**row)
+                    yield dict(t="sql", table=table_name, pk=pk, row=row)
+
+    def backup_delta(self, manifest):
+        """增量备份: 备份上次备份以后binlog里面变更过的key, 不经过binlog写入的KV表全量复制"""
+        logger = self.get_backup_logger()
+        start_time = time.time()
+        end_seq, kv_keys, sql_keys = self.collect_changed_keys(manifest.last_seq)
+
+        delta_file = time.strftime("%Y-%m-%d_%H%M%S.delta.gz")
+        delta_path = os.path.join(self.backup_dir, delta_file)
+        count = 0
+        # 全量复制的表没有binlog, 通过摘要判断有没有变更
+        full_copy_digest = hashlib.md5()
+        full_copy = False
+        temp_path = delta_path + ".tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as fp:
+            header = dict(t="header", start_seq=manifest.last_seq+1, end_seq=end_seq)
+            fp.write(json.dumps(header) + "\n")
+            for record in self.iter_delta_records(kv_keys, sql_keys, self.get_full_copy_tables()):
+                line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+                fp.write(line)
+                if record["t"] == "kv_table":
+                    full_copy = True
+                elif record["t"] == "kv" and full_copy:
+                    full_copy_digest.update(line.encode("utf-8"))
+                else:
+                    full_copy = False
+                if record["t"] != "kv_table":
+                    count += 1
+            fp.write(json.dumps(dict(t="footer", count=count)) + "\n")
+
+        digest = full_copy_digest.hexdigest()
+        if end_seq == manifest.last_seq and digest == manifest.get("full_copy_digest"):
+            fsutil.rmfile(temp_path, hard = True)
+            logger.log("no changes since seq:(%s)", end_seq)
+            return dict(count = 0, cost_time = "0ms")
+
+        os.replace(temp_path, delta_path)
+
+        manifest.deltas.append(dict(file=delta_file, start_seq=manifest.last_seq+1,
+                                    end_seq=end_seq, count=count))
+        manifest.last_seq = end_seq
+        manifest.full_copy_digest = digest
+        save_manifest(self.backup_dir, manifest)
+
+        cost_time = (time.time() - start_time) * 1000.0
+        logger.log("delta backup done, seq:(%s-%s), count:(%d), cost_time:(%.2fms)",
+                   header["start_seq"], end_seq, count, cost_time)
+        return dict(count = count, cost_time = "%sms" % cost_time)
+
+def load_manifest(dirname):
+    # type: (str) -> Storage|None
+    path = os.path.join(dirname, _manifest_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as fp:
+            return Storage(**json.load(fp))
+    except:
+        xutils.print_exc()
+        return None
+
+def save_manifest(dirname, manifest):
+    path = os.path.join(dirname, _manifest_name)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp, indent=2)
+    os.replace(temp_path, path)
+
+def remove_manifest(dirname):
+    path = os.path.join(dirname, _manifest_name)
+    if os.path.exists(path):
+        fsutil.rmfile(path, hard = True)
+
 def chk_db_backup():
     if not xconfig.get_system_config("db_backup"):
         return
@@ -291,6 +617,12 @@ def calc_qps(count, cost_time):
 
 class DBImporter:
 
+    sql_batch_size = 1000
+    kv_batch_size = 5000
+
+    def __init__(self):
+        self.count_errors = [] # type: list[str]
+
     def import_db(self, db_file):
         self.db_backup_file = db_file
         got_lock = False
@@ -315,38 +647,52 @@ class DBImporter:
     def import_sql(self, db_file):
         logger = self.get_logger()
         backup_db = xtables.MySqliteDB(db = db_file)
-        batch_size = 100
+        batch_size = self.sql_batch_size
 
         try:
             for table in xtables.get_all_tables():
+                if table.tablename == "kv_store":
+                    # kv_store在import_kv里面导入
+                    continue
                 backup_table = xtables.init_backup_table(table.tablename, backup_db)
                 total_count = backup_table.count()
                 logger.info("import table:(%s) count:(%d)", table.tablename, total_count)
                 start_time = time.time()
                 count = 0
                 assert isinstance(table, xtables.TableProxy)
+                pk_name = table.table_info.pk_name
                 for records in backup_table.iter_batch(batch_size=batch_size):
+                    # 一次查询整批记录是否存在, 不再逐条查询
+                    pk_list = [record.get(pk_name) for record in records]
+                    exists = set()
+                    for row in table.select(what=pk_name, where="%s IN $pk_list" % pk_name, vars=dict(pk_list=pk_list)):
+                        exists.add(row.get(pk_name))
                     with table.transaction():
                         for record in records:
                             new_record = table.filter_record(record)
-                            where_dict = dict(id = record.id)
-                            old_record = table.select_first(where=where_dict)
-                            if old_record == None:
-                                table.insert(**new_record)
+                            pk_value = record.get(pk_name)
+                            if pk_value in exists:
+                                table.update(where={pk_name: pk_value}, **new_record)
                             else:
-                                table.update(where=where_dict, **new_record)
+                                table.insert(**new_record)
                             count+=1
-                            cost_time = time.time() - start_time
-                            qps = calc_qps(count, cost_time)
-                        logger.log("table:(%s), proceed:(%d/%d), qps:(%.2f)" % (backup_table.tablename, count, total_count, qps))
+                    qps = calc_qps(count, time.time() - start_time)
+                    logger.log("table:(%s), proceed:(%d/%d), qps:(%.2f)" % (backup_table.tablename, count, total_count, qps))
                 cost_time = time.time() - start_time
+                self.check_count("sql:" + table.tablename, count, total_count)
                 logger.info("import table:(%s) done! cost_time:(%.2fs)", table.tablename, cost_time)
         except Exception as e:
             err_info = xutils.print_exc()
             logger.info("import failed: (%s)" % err_info)
             raise e
 
+    def is_index_key(self, key):
+        # type: (bytes) -> bool
+        table_name = key.split(b":", 1)[0]
+        return key.startswith(b"_index$") or table_name.find(b"$") >= 0
+
     def import_kv(self, db_file):
+        """批量导入主数据, 导入过程中不维护索引, 导入完成后统一重建"""
         count = 0
         logger = _import_logger
         db = sqlite3.connect(db_file)
@@ -359,34 +705,158 @@ class DBImporter:
         sql = "SELECT key, value FROM kv_store ORDER BY key"
 
         start_time = time.time()
-        batch_size = 100
+        batch_size = self.kv_batch_size
+        # 每个表导入的记录数, 用于校验
+        table_counts = dict() # type: dict[bytes, int]
+        skip_count = 0
 
         write_batch = dbutil.create_write_batch()
         for key, value in db.execute(sql):
-            write_batch.put_bytes(key, value)
+            key = bytes(key)
+            if self.is_index_key(key):
+                # 索引在导入完成以后重建
+                skip_count += 1
+                continue
+            write_batch.put_bytes(key, bytes(value))
             count += 1
+            if key.find(b":") > 0:
+                table_name = key.split(b":", 1)[0]
+                table_counts[table_name] = table_counts.get(table_name, 0) + 1
             if count % batch_size == 0:
                 write_batch.commit(retries=5)
                 write_batch = dbutil.create_write_batch()
                 cost_time = time.time() - start_time
-                progress = count/total_count*100.0
+                progress = (count+skip_count)/total_count*100.0
                 qps = calc_qps(count, cost_time)
                 logger.log("proceed:(%d), progress:(%.2f%%), qps:(%.2f)" % (count, progress, qps))
 
         write_batch.commit(retries=5)
+        db.close()
 
-        logger.log("import record done records:%s", count)
-        for table_name in dbutil.get_table_names():
-            logger.log("repair index for (%s)", table_name)
+        logger.log("import record done records:%s, skipped index:%s", count, skip_count)
+        self.check_count("kv", count + skip_count, total_count)
+        for table_name in table_counts:
+            name = table_name.decode("utf-8")
+            self.check_count("kv:" + name, dbutil.count_table(name), table_counts[table_name])
+
+        self.repair_index()
+
+        logger.log("import done!")
+        return "records:%s, errors:%s" % (count, len(self.count_errors))
+
+    def check_count(self, name, actual_count, expect_count):
+        """校验导入的数量, 目标库可能有备份之外的数据, 所以只检查是否缺少"""
+        if actual_count < expect_count:
+            err_msg = "count check failed, name:(%s), expect:(%d), actual:(%d)" % (name, expect_count, actual_count)
+            self.get_logger().log(err_msg)
+            self.count_errors.append(err_msg)
+
+    def repair_index(self):
+        """重建所有表的索引
+        批量重建会先删除旧的索引, 导入和恢复的时候应用还在运行, 所以重建期间持有全局写锁阻塞其他写入,
+        sqlite驱动写入的时候也会获取这个锁, 所以只能在当前线程里面按表依次重建
+        """
+        logger = self.get_logger()
+        start_time = time.time()
+
+        def rebuild(table_name):
             try:
-                dbutil.get_table(table_name).repair_index()
+                dbutil.get_table(table_name).bulk_rebuild_index()
                 logger.log("repair index done for (%s)", table_name)
             except:
                 xutils.print_exc()
                 logger.log("repair index failed for (%s)", table_name)
 
-        logger.log("import done!")
-        return "records:%s" % count
+        with dbutil.get_write_lock():
+            for table_name in dbutil.get_table_names():
+                rebuild(table_name)
+        logger.log("repair index done, cost_time:(%.2fs)", time.time() - start_time)
+
+    def restore_backup(self, backup_dir=""):
+        """恢复备份: 导入全量备份, 然后按照顺序重放增量备份"""
+        if backup_dir == "":
+            backup_dir = os.path.join(xconfig.BACKUP_DIR, "db")
+        manifest = load_manifest(backup_dir)
+        if manifest == None:
+            return "backup manifest not found"
+
+        with _backup_lock:
+            base_path = os.path.join(backup_dir, manifest.base_file)
+            self.import_sql(base_path)
+            self.import_kv(base_path)
+            count = 0
+            for delta in manifest.deltas:
+                count += self.apply_delta(os.path.join(backup_dir, delta["file"]))
+            if len(manifest.deltas) > 0:
+                self.repair_index()
+            # 全量备份里面包含binlog, 分段索引需要重新加载
+            BinLog.get_instance().reset_segment_index()
+        return "base:%s, deltas:%s, records:%s" % (manifest.base_file, len(manifest.deltas), count)
+
+    def apply_delta(self, delta_path):
+        logger = self.get_logger()
+        count = 0
+        footer = None
+        batch = dbutil.create_write_batch()
+        with gzip.open(delta_path, "rt", encoding="utf-8") as fp:
+            for line in fp:
+                record = json.loads(line)
+                record_type = record.get("t")
+                if record_type == "kv":
+                    key = record["k"]
+                    value = record.get("v")
+                    if value == None:
+                        batch.delete(key)
+                    else:
+                        batch.put_bytes(key.encode("utf-8"), value.encode("utf-8"))
+                    if batch.size() >= 1000:
+                        batch.commit(retries=5)
+                        batch = dbutil.create_write_batch()
+                elif record_type == "kv_table":
+                    # 全量复制的表, 先提交前面的写入再清空整个表
+                    batch.commit(retries=5)
+                    batch = dbutil.create_write_batch()
+                    self.clear_kv_table(record["table"])
+                    continue
+                elif record_type == "sql":
+                    self.apply_sql_record(record)
+                elif record_type == "footer":
+                    footer = record
+                    continue
+                else:
+                    continue
+                count += 1
+        batch.commit(retries=5)
+        if footer == None:
+            raise Exception("增量备份文件不完整:%s" % delta_path)
+        logger.log("apply delta done, file:(%s), records:(%d)", delta_path, count)
+        return count
+
+    def clear_kv_table(self, table_name):
+        keys = []
+        for key, value in dbutil.prefix_iter(table_name + ":", include_key=True):
+            keys.append(key)
+            if len(keys) >= 1000:
+                dbutil.db_batch_delete(keys)
+                keys = []
+        dbutil.db_batch_delete(keys)
+
+    def apply_sql_record(self, record):
+        table_name = record.get("table")
+        if not xtables.is_table_exists(table_name):
+            return
+        table = xtables.get_table_by_name(table_name)
+        pk_name = table.table_info.pk_name
+        where_dict = {pk_name: record.get("pk")}
+        row = record.get("row")
+        if row == None:
+            table.delete(where=where_dict)
+            return
+        new_record = table.filter_record(row)
+        if table.select_first(where=where_dict) == None:
+            table.insert(**new_record)
+        else:
+            table.update(where=where_dict, **new_record)
 
 
 
@@ -418,6 +888,10 @@ class BackupHandler:
             path = xutils.get_argument("path", "")
             return import_db(path)
 
+        if p == "restore_db":
+            importer = DBImporter()
+            return importer.restore_backup()
+
         if p == "backup_sql":
             backup = DBBackup()
             backup.execute(backup_kv=False)
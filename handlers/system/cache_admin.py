@@ -67,6 +67,15 @@ class CacheHandler:
         kw.page_size = limit
         kw.page_url = "?type=%s&page=" % type
 
+        kw.object_cache_stats = None
+        object_cache = dbutil.get_object_cache()
+        if object_cache != None:
+            stats = object_cache.stats()
+            stats.size = xutils.format_size(stats.size)
+            stats.max_size = xutils.format_size(stats.max_size)
+            stats.hit_rate = "%.2f%%" % (stats.hit_rate * 100)
+            kw.object_cache_stats = stats
+
         return xtemplate.render("system/page/cache_admin.html", **kw)
 
     @xauth.login_required("admin")
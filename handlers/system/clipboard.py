@@ -82,7 +82,7 @@ ASIDE_HTML = """
 """
 
 
-dbutil.register_table("clip_log", "剪切板历史")
+dbutil.register_table("clip_log", "剪切板历史", binlog=True)
 
 class ClipLogDO(xutils.Storage):
 
@@ -430,6 +430,7 @@ class DatabaseDriverInfoHandler:
         if xconfig.DatabaseConfig.db_driver == "sqlite":
             db = xtables.get_db_instance(xconfig.FileConfig.kv_db_file)
             info += self.get_sqlite_info(db)
+            info += self.get_key_filter_info(instance)
         if xconfig.DatabaseConfig.db_driver == "leveldb":
             from xutils.db.driver_leveldb import LevelDBImpl
             assert isinstance(instance, LevelDBImpl)
@@ -437,6 +438,21 @@ class DatabaseDriverInfoHandler:
 
         return info
 
+    def get_key_filter_info(self, instance):
+        from xutils.db.driver_sqlite import SqliteKV
+        if not isinstance(instance, SqliteKV):
+            return ""
+        stats = instance.GetKeyFilterStats()
+        if stats == None:
+            return "\n\nkey_filter: off"
+        info = "\n\nkey_filter: memory=%s, recent_count=%s, recent_hits=%s" % (
+            xutils.format_size(stats.memory), stats.recent_count, stats.recent_hits)
+        for item in stats.tables:
+            info += "\n  %s: keys=%s/%s, memory=%s, checks=%s, skipped=%s, false_positives=%s, estimate_error_rate=%.4f%%" % (
+                item.table_name, item.key_count, item.capacity, xutils.format_size(item.memory),
+                item.checks, item.skipped, item.false_positives, item.estimate_error_rate * 100)
+        return info
+
 class TableData:
     def __init__(self, head=[], items=[]):
         self.head = head
@@ -9,12 +9,18 @@
 @Description  : 数据库索引管理
 """
 
+import threading
 from web.utils import Storage
 import xauth
+import xconfig
+import xmanager
 import xtemplate
 from xutils import dbutil
 import xutils
 
+# 同一时间只执行一个修复任务
+_repair_lock = threading.Lock()
+
 class TableIndex:
 
     def __init__(self, table_name, index_names):
@@ -28,6 +34,12 @@ def count_index(table_name, index_name):
 def count_table(table_name):
     return dbutil.count_table(table_name, use_cache=True)
 
+def get_repair_state_dict():
+    result = dict()
+    for state in dbutil.list_index_repair_states():
+        result[state.table_name] = state
+    return result
+
 class IndexHandler:
 
     @xauth.login_required("admin")
@@ -48,6 +60,7 @@ class IndexHandler:
         kw.count_index = count_index
         kw.count_table = count_table
         kw.get_index_table_name = dbutil.get_index_table_name
+        kw.repair_state_dict = get_repair_state_dict()
 
         return xtemplate.render("system/page/db/db_index.html", **kw)
     
@@ -59,15 +72,28 @@ class IndexHandler:
         return dict(code = "404", message = "未知操作")
     
     def rebuild_index(self):
+        """提交后台任务, 由定时任务分批执行"""
         table_name = xutils.get_argument("table_name", "")
 
-        db = dbutil.get_table(table_name)
         try:
-            db.repair_index()
+            dbutil.start_index_repair(table_name)
         except:
+            xutils.print_exc()
             return dict(code = "fail", message = "重建索引异常")
             
-        return dict(code = "success")
+        return dict(code = "success", message = "已提交后台任务")
+
+
+# 修复任务可能执行较长时间, 不能占用事件通道的线程
+@xmanager.listen("cron.minute", lane=xmanager.DEFAULT_LANE)
+def run_index_repair(ctx=None):
+    if not _repair_lock.acquire(blocking=False):
+        return
+    try:
+        dbutil.run_index_repair_jobs(max_seconds=xconfig.DatabaseConfig.db_index_repair_tick_seconds,
+                                     ops_per_second=xconfig.DatabaseConfig.db_index_repair_ops)
+    finally:
+        _repair_lock.release()
 
 
 xurls = (
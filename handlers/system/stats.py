@@ -9,7 +9,7 @@ import xutils
 import xconfig
 from xutils import dbutil
 
-dbutil.register_table("record", "系统日志表")
+dbutil.register_table("record", "系统日志表", binlog=True)
 _db = dbutil.get_table("record")
 
 def save_ip(real_ip):
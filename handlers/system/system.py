@@ -99,6 +99,7 @@ SYS_TOOLS = [
     admin_link("文件",       "/fs_list", "file-text-o"),
     admin_link("定时任务",   "/system/crontab", "clock-o"),
     admin_link("事件注册", "/system/event"),
+    admin_link("事件耗时", "/system/event_stats"),
     admin_link("线程管理", "/system/thread_info"),
     admin_link("Menu_User",   "/system/user/list", "users"),
     admin_link("Menu_Log",    "/system/log"),
@@ -3,7 +3,10 @@
 # @since 2019/05/18 09:44:13
 # @modified 2022/03/12 11:07:34
 
+import xauth
+import xutils
 import xmanager
+import xtemplate
 from xtemplate import BasePlugin
 from xutils import Storage
 
@@ -88,6 +91,37 @@ class EventHandler(BasePlugin):
         self.writehtml(HTML, **kw)
         self.write_aside(ASIDE_HTML)
     
+class EventStatsHandler:
+    """事件处理器的耗时分布, 用于定位慢的处理器"""
+
+    @xauth.login_required("admin")
+    def GET(self):
+        event_type = xutils.get_argument_str("event_type")
+        orderby = xutils.get_argument_str("orderby", "p99")
+        if event_type == "":
+            stat_list = xmanager.EventStat.list_stats()
+        else:
+            stat_list = xmanager.EventStat.list_stats(event_type)
+
+        if orderby == "count":
+            stat_list.sort(key=lambda x: x.count, reverse=True)
+        elif orderby == "total":
+            stat_list.sort(key=lambda x: x.avg_ms * x.count, reverse=True)
+        else:
+            stat_list.sort(key=lambda x: (x.p99_ms, x.max_ms), reverse=True)
+
+        kw = Storage()
+        kw.stat_list = stat_list
+        kw.event_type = event_type
+        kw.orderby = orderby
+        return xtemplate.render("system/page/event_stats.html", **kw)
+
+    @xauth.login_required("admin")
+    def POST(self):
+        xmanager.EventStat.reset_all()
+        return dict(code="success")
+
 xurls = (
-    r"/system/event", EventHandler
+    r"/system/event", EventHandler,
+    r"/system/event_stats", EventStatsHandler,
 )
\ No newline at end of file
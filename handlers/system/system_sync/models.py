@@ -13,6 +13,8 @@ class FileIndexInfo(Storage):
         self.fsize = kw.get("fsize", 0)
         self.ftype = kw.get("ftype", "")
         self.last_try_time = kw.get("last_try_time", 0.0)
+        # 文件内容的hash, 老版本的主节点没有
+        self.fhash = kw.get("fhash", "")
 
 class LeaderStat(Storage):
     """主节点信息"""
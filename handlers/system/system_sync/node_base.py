@@ -11,7 +11,7 @@ import xconfig
 
 """节点管理的基类"""
 
-dbutil.register_table("cluster_config", "集群配置")
+dbutil.register_table("cluster_config", "集群配置", binlog=True)
 CONFIG = dbutil.get_hash_table("cluster_config")
 
 def get_system_port():
@@ -9,6 +9,8 @@
 @Description  : 从节点管理
 """
 
+import os
+import gzip
 import time
 import logging
 import xconfig
@@ -22,9 +24,11 @@ from xutils.db.binlog import BinLog, FileLog, BinLogOpType
 from .node_base import NodeManagerBase
 from .node_base import convert_follower_dict_to_list
 from .node_base import CONFIG
-from .system_sync_proxy import HttpClient, empty_http_client
+from .system_sync_proxy import HttpClient, empty_http_client, download_stat
 from .models import FileIndexInfo, LeaderStat
+from .system_sync_snapshot import SnapshotReader, SnapshotType
 from xutils.mem_util import log_mem_info_deco
+from concurrent.futures import ThreadPoolExecutor
 
 fs_sync_index_db = dbutil.get_hash_table("fs_sync_index")
 
@@ -226,7 +230,10 @@ class Follower(NodeManagerBase):
         count = self.count_sync_done()
         if count == 0:
             return "0%"
-        return "%.2f%%" % (count / self.fs_index_count * 100.0)
+        process = "%.2f%%" % (count / self.fs_index_count * 100.0)
+        if download_stat.busy_time > 0:
+            process += " (%s)" % download_stat.format_throughput()
+        return process
 
     def sync_for_home_page(self):
         return self.ping_leader() != None
@@ -268,7 +275,9 @@ class Follower(NodeManagerBase):
             logging.debug("leader_token为空")
             raise Exception("leader_token为空")
         
-        self.db_syncer.sync_db(self.get_client())
+        leader_info = self.get_leader_info() or {}
+        use_snapshot = leader_info.get("snapshot_version", 0) >= 1
+        self.db_syncer.sync_db(self.get_client(), use_snapshot=use_snapshot)
     
     def is_at_full_sync(self):
         return self.db_syncer.get_db_sync_state() == "full"
@@ -295,11 +304,17 @@ class DBSyncer:
 
     MAX_LOOPS = 1000 # 最大循环次数
     FULL_SYNC_MAX_LOOPS = 10000 # 全量同步最大循环次数
+    SNAPSHOT_BATCH_SIZE = 500 # 导入快照的时候每个批量操作的记录数
 
     def __init__(self, *, debug = True, file_syncer = empty_file_syncer):
         self._binlog = BinLog.get_instance()
         self.debug = debug
         self.file_syncer = file_syncer
+        # 主节点是否支持快照导出
+        self.use_snapshot = False
+        # 同步延迟, -1表示未知
+        self.lag_stat = Storage(lag_seq=-1, lag_seconds=-1, leader_last_seq=-1,
+                                applied_ts=0, pages=0, records=0, sync_time=0)
     
     def get_table_by_key(self, key):
         table_name = key.split(":")[0]
@@ -316,8 +331,8 @@ class DBSyncer:
             return value
         return 0
 
-    def put_binlog_last_seq(self, last_seq):
-        return CONFIG.put("follower_binlog_last_seq", last_seq)
+    def put_binlog_last_seq(self, last_seq, batch=None):
+        return CONFIG.put("follower_binlog_last_seq", last_seq, batch=batch)
 
     def get_db_sync_state(self):
         return CONFIG.get("follower_db_sync_state", "full")
@@ -382,15 +397,88 @@ class DBSyncer:
             batch.commit()
     
     @log_mem_info_deco("follower.sync_db")
-    def sync_db(self, proxy):
+    def sync_db(self, proxy, use_snapshot=False):
+        self.use_snapshot = use_snapshot
         sync_state = self.get_db_sync_state()
         if sync_state == "binlog":
             # 增量同步
             self.sync_by_binlog(proxy)
         else:
             # 全量同步
+            self.sync_db_full_by_mode(proxy)
+
+    def sync_db_full_by_mode(self, proxy):
+        if self.use_snapshot:
+            self.sync_db_by_snapshot(proxy)
+        else:
             self.sync_db_full(proxy)
 
+    def get_snapshot_path(self):
+        return os.path.join(xconfig.get_system_dir("tmp"), "sync_snapshot.jsonl.gz")
+
+    @log_mem_info_deco("sync_db_by_snapshot")
+    def sync_db_by_snapshot(self, proxy):
+        """通过快照全量同步, 导入完成后从快照的binlog位点开始增量同步"""
+        snapshot_path = self.get_snapshot_path()
+        proxy.download_snapshot(snapshot_path)
+        try:
+            with gzip.open(snapshot_path, "rt", encoding="utf-8") as fp:
+                header = self.load_snapshot(fp)
+        finally:
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+
+        self.put_binlog_last_seq(header.binlog_seq)
+        self.put_db_last_key("")
+        self.put_db_sync_state("binlog")
+        return header
+
+    def load_snapshot(self, fp):
+        reader = SnapshotReader(fp)
+        batch = dbutil.create_write_batch()
+        pending = dict()
+        for record in reader:
+            record_type = record.get("t")
+            if record_type == SnapshotType.kv:
+                self.write_kv_to_batch(batch, pending, record.get("k"), record.get("v"))
+                if len(pending) >= self.SNAPSHOT_BATCH_SIZE:
+                    batch.commit()
+                    batch = dbutil.create_write_batch()
+                    pending = dict()
+            elif record_type == SnapshotType.sql:
+                self.upsert_sql_rows(record.get("table"), record.get("rows"))
+            else:
+                logging.error("未知的快照类型:%s", record_type)
+        batch.commit()
+
+        if reader.footer == None:
+            raise Exception("快照不完整, 缺少footer")
+        logging.info("load snapshot done, header=%s, footer=%s", reader.header, reader.footer)
+        return reader.header
+
+    def upsert_sql_rows(self, table_name, rows):
+        if not xtables.is_table_exists(table_name):
+            logging.info("表不存在, table_name=%s", table_name)
+            return
+        table = xtables.get_table_by_name(table_name)
+        pk_name = table.table_info.pk_name
+        pk_list = [row.get(pk_name) for row in rows]
+        exists = set()
+        for row in table.select(what=pk_name, where="%s IN $pk_list" % pk_name, vars=dict(pk_list=pk_list)):
+            exists.add(row.get(pk_name))
+
+        with table.transaction():
+            for row in rows:
+                pk_value = row.get(pk_name)
+                try:
+                    if pk_value in exists:
+                        table.update(where={pk_name: pk_value}, **row)
+                    else:
+                        table.insert(**row)
+                except Exception as err:
+                    xutils.print_exc()
+                    self.ignore_or_raise(err)
+
     def sync_db_full(self, proxy):
         steps = 0
         while steps < self.FULL_SYNC_MAX_LOOPS:
@@ -412,49 +500,89 @@ class DBSyncer:
         count = self.sync_db_by_result(result_obj, last_key)
         return count
 
+    def get_page_next_seq(self, result_obj, last_seq=0):
+        """计算处理完当前页之后的位点"""
+        max_seq = last_seq
+        for data in result_obj.get("data") or []:
+            seq = data.get("seq")
+            if isinstance(seq, int):
+                max_seq = max(max_seq, seq)
+        # 新版协议返回扫描的位点, 包括被主节点过滤的binlog
+        scan_seq = result_obj.get("scan_seq")
+        if isinstance(scan_seq, int):
+            max_seq = max(max_seq, scan_seq)
+        return max_seq
+
+    def has_next_page(self, result_obj):
+        has_next = result_obj.get("has_next")
+        if isinstance(has_next, bool):
+            return has_next
+        # 旧版协议, 包含请求的seq
+        data = result_obj.get("data")
+        return data != None and len(data) > 1
+
     @log_mem_info_deco("sync_by_binlog")
     def sync_by_binlog(self, proxy): # type: (HttpClient) -> object
-        has_next = True
+        """增量同步, 处理当前页的同时预读下一页"""
         loops = 0
-        last_seq = ""
-
-        while has_next:
-            loops += 1
-            if loops > self.MAX_LOOPS:
-                logging.error("too deep loops, last_seq=%s", last_seq)
-                raise Exception("too deep loops")
+        last_seq = self.get_binlog_last_seq()
+        result_obj = proxy.list_binlog(last_seq)
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="BinlogPrefetch") as prefetcher:
+            while True:
+                loops += 1
+                if loops > self.MAX_LOOPS:
+                    logging.error("too deep loops, last_seq=%s", last_seq)
+                    raise Exception("too deep loops")
+                
+                if self.debug:
+                    logging.debug("list binlog result=%s" % result_obj)
+
+                code = result_obj.get("code")
+                if code == "sync_broken":
+                    logging.error("同步binlog异常, 重新全量同步...")
+                    self.put_binlog_last_seq(0)
+                    self.put_db_sync_state("full")
+                    self.put_db_last_key("")
+                    self.sync_db_full(proxy)
+                    return "sync_by_full"
+                if code != "success":
+                    raise Exception("未知的code:%s" % code)
+
+                has_next = self.has_next_page(result_obj)
+                logging.info("code=%s, has_next=%s", code, has_next)
+
+                next_seq = self.get_page_next_seq(result_obj, last_seq)
+                next_future = None
+                if has_next:
+                    next_future = prefetcher.submit(proxy.list_binlog, next_seq)
 
-            last_seq = self.get_binlog_last_seq()
-            result_obj = proxy.list_binlog(last_seq)
-            
-            if self.debug:
-                logging.debug("list binlog result=%s" % result_obj)
+                self.sync_by_binlog_step(result_obj)
 
-            code = result_obj.get("code")
-            data = result_obj.get("data")
-            # TODO 优化has_next判断
-            has_next = (data != None and len(data) > 1)
-            logging.info("code=%s, has_next=%s", code, has_next)
+                if next_future == None:
+                    break
 
-            if code == "success":
-                self.sync_by_binlog_step(result_obj)
-            elif code == "sync_broken":
-                logging.error("同步binlog异常, 重新全量同步...")
-                self.put_binlog_last_seq(0)
-                self.put_db_sync_state("full")
-                self.put_db_last_key("")
-                self.sync_db_full(proxy)
-                return "sync_by_full"
-            else:
-                raise Exception("未知的code:%s" % code)
+                last_seq = self.get_binlog_last_seq()
+                if last_seq == next_seq:
+                    result_obj = next_future.result()
+                else:
+                    # 位点和预读的不一致, 丢弃预读的结果
+                    logging.warning("prefetch seq mismatch, next_seq=%s, last_seq=%s", next_seq, last_seq)
+                    next_future.cancel()
+                    result_obj = proxy.list_binlog(last_seq)
         
         return None
 
     @log_mem_info_deco("sync_by_binlog_step")
     def sync_by_binlog_step(self, result_obj):
+        """处理一页binlog, KV数据和同步位点在同一个批量操作中提交"""
         last_seq = self.get_binlog_last_seq()
-        max_seq = last_seq
         data_list = result_obj.get("data")
+        batch = dbutil.create_write_batch()
+        # 当前页已经写入batch的KV数据, 用于计算索引的旧值
+        pending = dict()
+        applied_ts = 0
+
         for data in data_list:
             seq = data.get("seq")
             assert isinstance(seq, int)
@@ -467,7 +595,7 @@ class DBSyncer:
             value = data.get("value")
 
             if optype in (BinLogOpType.put, BinLogOpType.delete):
-                self.handle_kv_binlog(data)
+                self.handle_kv_binlog(data, batch=batch, pending=pending)
             elif optype == "file_upload":
                 self.file_syncer.handle_file_binlog(key, value)
             elif optype == "file_rename":
@@ -480,22 +608,91 @@ class DBSyncer:
                 self.handle_sql_binlog(data)
             else:
                 logging.error("未知的optype:%s", optype)
+            
+            applied_ts = max(applied_ts, data.get("ts", 0))
 
-            max_seq = max(max_seq, seq)
+        max_seq = self.get_page_next_seq(result_obj, last_seq)
         if max_seq != last_seq:
-            self.put_binlog_last_seq(max_seq)
+            self.put_binlog_last_seq(max_seq, batch=batch)
         else:
             logging.info("db已经保持同步")
+        batch.commit()
+
+        self.update_lag_stat(result_obj, max_seq, applied_ts)
     
-    def handle_kv_binlog(self, data):
+    def update_lag_stat(self, result_obj, applied_seq=0, applied_ts=0):
+        stat = self.lag_stat
+        stat.pages += 1
+        stat.records += len(result_obj.get("data"))
+        stat.sync_time = time.time()
+        leader_last_seq = result_obj.get("leader_last_seq")
+        if not isinstance(leader_last_seq, int):
+            # 旧版协议没有主节点的位点信息
+            return
+        stat.leader_last_seq = leader_last_seq
+        stat.lag_seq = max(0, leader_last_seq - applied_seq)
+        if applied_ts > 0:
+            stat.applied_ts = applied_ts
+        last_log_ts = result_obj.get("last_log_ts", 0)
+        if stat.lag_seq == 0:
+            stat.lag_seconds = 0
+        elif last_log_ts > 0 and stat.applied_ts > 0:
+            stat.lag_seconds = max(0, last_log_ts - stat.applied_ts)
+        else:
+            stat.lag_seconds = -1
+
+    def handle_kv_binlog(self, data, batch=None, pending=None):
         key = data.get("key")
         value = data.get("value")
         assert key != None
-        if value == None:
+        if batch != None:
+            assert pending != None
+            self.write_kv_to_batch(batch, pending, key, value)
+        elif value == None:
             self.delete_and_log(key)
         else:
             self.put_and_log(key, value)
 
+    def write_kv_to_batch(self, batch, pending, key, value):
+        # type: (dbutil.WriteBatchProxy, dict, str, object) -> None
+        table_name = self.get_table_name_by_key(key)
+        table_info = dbutil.get_table_info(table_name)
+        if table_info == None and value != None:
+            logging.warning("table not exists: %s", table_name)
+            return
+        
+        if key in pending:
+            old_value = pending[key]
+        else:
+            old_value = dbutil.get(key)
+        
+        done = False
+        try:
+            if table_info == None or table_info.type == "hash":
+                if value == None:
+                    batch.delete(key)
+                else:
+                    batch.put(key, value)
+            else:
+                table = dbutil.get_table(table_name)
+                if value == None:
+                    table.delete_by_key_in_batch(key, batch, old_obj=old_value)
+                else:
+                    table.update_by_key_in_batch(key, value, batch, old_obj=old_value)
+            done = True
+        except:
+            logging.error("key=%s", key)
+            xutils.print_exc()
+        
+        if not done:
+            if value == None:
+                batch.delete(key)
+                self._binlog.add_log("delete", key, None, batch = batch)
+            else:
+                batch.put(key, value, check_table=False)
+                self._binlog.add_log("put", key, value, batch = batch)
+        pending[key] = value
+
     def handle_sql_binlog(self, data):
         optype = data.get("optype")
         table_name = data.get("table_name")
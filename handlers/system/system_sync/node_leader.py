@@ -31,9 +31,14 @@ from .node_base import NodeManagerBase, convert_follower_dict_to_list
 from .node_base import CONFIG
 from .node_base import get_system_port
 from .models import LeaderStat
+from .system_sync_snapshot import SnapshotExporter, SNAPSHOT_VERSION
 
 MAX_FOLLOWER_SIZE = 100
 EXPIRE_TIME = 60 * 60
+# 单次拉取binlog的最大数量
+MAX_BINLOG_LIMIT = 1000
+# SQL批量查询的IN列表大小
+SQL_BATCH_SIZE = 200
 
 
 class FollwerInfo(Storage):
@@ -126,7 +131,8 @@ class Leader(NodeManagerBase):
                     node_id=self.get_node_id(),
                     fs_index_count=self.get_fs_index_count(),
                     system_version=self.get_system_version(),
-                    binlog_last_seq=self.binlog.last_seq)
+                    binlog_last_seq=self.binlog.last_seq,
+                    snapshot_version=SNAPSHOT_VERSION)
 
     def get_stat(self, port):
         admin_info = xauth.get_user_by_name("admin")
@@ -173,16 +179,17 @@ class Leader(NodeManagerBase):
         # type: (str|int) -> bool
         if isinstance(key, int):
             return False
-        skipped_prefix_tuple = ("_binlog:", "_index$", "cluster_config:",
+        skipped_prefix_tuple = ("_binlog:", "_binlog_seg:", "_max_id:_binlog", "_index$", "cluster_config:",
                                 "fs_index:", "fs_sync_index:", "fs_sync_index_copy:")
         table_name = key.split(":", 1)[0]
         if table_name.find("$")>=0:
             return True
         return key.startswith(skipped_prefix_tuple)
 
-    def list_binlog(self, last_seq=0, limit=20, include_req_seq=True):
+    def list_binlog(self, last_seq=0, limit=20, include_req_seq=True, version=1):
         """列出指定条件的binlog
         include_req_seq: 是否包含请求的seq对应的binlog
+        version: 协议版本, version>=2 时返回扫描位点、是否有下一页以及主节点的位点信息
         """
         sync_diff = self.binlog.last_seq - last_seq
         binlog_size = self.binlog.count_size()
@@ -203,31 +210,57 @@ class Leader(NodeManagerBase):
         if is_broken:
             return webutil.FailedResult(code="sync_broken", message="同步中断，请重新同步: %s" % broken_reason)
 
+        limit = min(limit, MAX_BINLOG_LIMIT)
+        # 扫描过的最大seq, 包括被过滤掉的binlog
+        scan_info = Storage(max_seq=last_seq)
+
         def map_func(key, value):
+            table_name, seq = key.split(":")
+            seq = self.binlog._unpack_id(seq)
+            scan_info.max_seq = max(scan_info.max_seq, seq)
             record_key = value.get("key")
             if self.skip_db_sync(record_key):
                 return None
-            table_name, seq = key.split(":")
-            value["seq"] = self.binlog._unpack_id(seq)
+            value["seq"] = seq
             return value
 
-        data_list = []
-        # 预读一位 用于获取下一个key
-        binlogs = self.binlog.list(last_seq, limit + 1, map_func=map_func)
+        if version >= 2:
+            scan_limit = limit
+        else:
+            # 预读一位 用于获取下一个key
+            scan_limit = limit + 1
+        
+        binlogs = self.binlog.list(last_seq, scan_limit, map_func=map_func)
         if self.log_debug:
             logging.debug("binlogs:%s", binlogs)
 
+        logs = []
         for log in binlogs:
             assert isinstance(log, Storage)
             if not include_req_seq and log.seq == last_seq:
                 continue
-            
-            log = self.process_log(log)
-            if log != None:
-                data_list.append(log)
+            logs.append(log)
 
-        return webutil.SuccessResult(data_list[:limit])
+        data_list = self.process_logs(logs)
+
+        if version < 2:
+            return webutil.SuccessResult(data_list[:limit])
+
+        leader_last_seq = self.binlog.last_seq
+        result = webutil.SuccessResult(data_list)
+        result.version = 2
+        result.scan_seq = scan_info.max_seq
+        result.has_next = scan_info.max_seq < leader_last_seq
+        result.leader_last_seq = leader_last_seq
+        result.last_log_ts = self.get_last_log_ts()
+        return result
     
+    def get_last_log_ts(self):
+        last_log = self.binlog.get_last_log()
+        if isinstance(last_log, dict):
+            return last_log.get("ts", 0)
+        return 0
+
     def process_file_log(self, log):
         value = log.value
         fpath = value.get("fpath", "")
@@ -238,31 +271,65 @@ class Leader(NodeManagerBase):
 
         return log
     
-    def process_log(self, log):
-        # TODO 补充单元测试
-        optype = log.optype
-        if optype in (BinLogOpType.sql_upsert, BinLogOpType.sql_delete):
-            table_name = log.table_name
+    def process_logs(self, logs):
+        """批量处理binlog, KV和SQL的值都是一次批量查询, 不再每条记录查询一次"""
+        kv_keys = [log.key for log in logs if log.optype == BinLogOpType.put]
+        kv_values = dict()
+        if len(kv_keys) > 0:
+            kv_values = dbutil.db_batch_get(kv_keys)
+        sql_values = self.batch_get_sql_records(logs)
+
+        result = []
+        for log in logs:
+            optype = log.optype
+            if optype == BinLogOpType.put:
+                log.value = kv_values.get(log.key)
+                if log.value == None:
+                    log.optype = "delete"
+            elif optype in (BinLogOpType.sql_upsert, BinLogOpType.sql_delete):
+                records = sql_values.get(log.table_name)
+                if records == None:
+                    # 无效的binlog
+                    continue
+                log.value = records.get(str(log.key))
+                if log.value == None:
+                    log.optype = BinLogOpType.sql_delete
+            elif optype in (BinLogOpType.file_upload, BinLogOpType.file_rename, BinLogOpType.file_delete):
+                log = self.process_file_log(log)
+            result.append(log)
+        return result
+
+    def batch_get_sql_records(self, logs):
+        """按照表分组批量查询SQL记录
+        @return dict[table_name, dict[str(pk_value), record]]
+        """
+        table_keys = dict() # type: dict[str, list]
+        for log in logs:
+            if log.optype in (BinLogOpType.sql_upsert, BinLogOpType.sql_delete):
+                keys = table_keys.setdefault(log.table_name, [])
+                keys.append(log.key)
+
+        result = dict()
+        for table_name in table_keys:
             table_info = xtables.TableManager.get_table_info(table_name)
             if table_info == None:
-                # 无效的binlog
-                return None
+                continue
             table = xtables.get_table_by_name(table_name)
             pk_name = table_info.pk_name
-            pk_value = log.key
-            db_record = table.select_first(where={pk_name: pk_value})
-            log.value = db_record
-            if db_record == None:
-                log.optype = BinLogOpType.sql_delete
-        elif optype in (BinLogOpType.file_upload, BinLogOpType.file_rename, BinLogOpType.file_delete):
-            return self.process_file_log(log)
-        elif optype == BinLogOpType.put:
-            key = log.key
-            log.value = dbutil.get(key)
-            if log.value == None:
-                log.optype = "delete"
-        
-        return log
+            keys = list(set(table_keys[table_name]))
+            records = dict()
+            for start in range(0, len(keys), SQL_BATCH_SIZE):
+                batch_keys = keys[start:start+SQL_BATCH_SIZE]
+                where = "%s IN $batch_keys" % pk_name
+                for record in table.select(where=where, vars=dict(batch_keys=batch_keys)):
+                    records[str(record.get(pk_name))] = record
+            result[table_name] = records
+        return result
+
+    def export_snapshot(self):
+        """导出全量快照, 返回压缩块的迭代器"""
+        exporter = SnapshotExporter(binlog_seq=self.binlog.last_seq, skip_func=self.skip_db_sync)
+        return exporter.iter_chunks()
 
     def list_db(self, last_key, limit=20):
         def filter_func(key, value):
@@ -271,11 +338,15 @@ class Leader(NodeManagerBase):
             return True
 
         result = []
-        for key, value in dbutil.prefix_list("", key_from=last_key,
-                                             limit=limit,
-                                             include_key=True,
-                                             scan_db=True,
-                                             filter_func=filter_func):
-            record = dict(key=key, value=value)
-            result.append(record)
-        return dict(binlog_last_seq=self.binlog.last_seq, rows=result)
+        # 先记录binlog位点再创建快照, 快照之后的写入通过binlog同步
+        binlog_last_seq = self.binlog.last_seq
+        with dbutil.DBSnapshot() as snapshot:
+            for key, value in dbutil.prefix_iter("", key_from=last_key,
+                                                 limit=limit,
+                                                 include_key=True,
+                                                 scan_db=True,
+                                                 filter_func=filter_func,
+                                                 snapshot=snapshot):
+                record = dict(key=key, value=value)
+                result.append(record)
+        return dict(binlog_last_seq=binlog_last_seq, rows=result)
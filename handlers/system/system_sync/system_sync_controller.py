@@ -38,7 +38,7 @@ from .node_follower import Follower
 from .node_leader import Leader
 from . import system_sync_indexer
 
-dbutil.register_table("cluster_config", "集群配置")
+dbutil.register_table("cluster_config", "集群配置", binlog=True)
 CONFIG = dbutil.get_hash_table("cluster_config")
 
 
@@ -223,6 +223,7 @@ class SyncHandler:
         kw.follower_binlog_seq = FOLLOWER.db_syncer.get_binlog_last_seq()
         kw.follower_db_sync_state = FOLLOWER.db_syncer.get_db_sync_state()
         kw.follower_db_last_key = FOLLOWER.db_syncer.get_db_last_key()
+        kw.follower_lag_stat = FOLLOWER.db_syncer.lag_stat
         kw.sync_status = SyncConfig.need_sync_db()
 
         return xtemplate.render("system/page/system_sync.html", **kw)
@@ -321,7 +322,8 @@ class LeaderHandler(SyncHandler):
             binlog_last_seq = xutils.get_argument_int("last_seq")
             limit = xutils.get_argument_int("limit", 20)
             include_req_seq = xutils.get_argument_bool("include_req_seq", True)
-            return LEADER.list_binlog(binlog_last_seq, limit, include_req_seq=include_req_seq)
+            version = xutils.get_argument_int("version", 1)
+            return LEADER.list_binlog(binlog_last_seq, limit, include_req_seq=include_req_seq, version=version)
 
         if p == "list_db":
             last_key = xutils.get_argument("last_key", "")
@@ -329,6 +331,10 @@ class LeaderHandler(SyncHandler):
             data = LEADER.list_db(last_key, limit)
             return dict(code="success", data=data)
 
+        if p == "export_snapshot":
+            web.header("Content-Type", "application/octet-stream")
+            return LEADER.export_snapshot()
+
         if p == "list_recent":
             return self.list_recent()
 
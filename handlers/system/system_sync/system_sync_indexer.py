@@ -43,6 +43,12 @@ def convert_time_to_str(mtime):
 def is_temp_file(fname):
     return fname in TEMP_FNAME_SET
 
+def get_file_hash_with_index(fpath, fsize=0, mtime="", old_info=None):
+    """文件没有变化的时候直接使用索引中的hash值"""
+    if old_info != None and old_info.get("fhash") and old_info.fsize == fsize and str(old_info.mtime) == mtime:
+        return old_info.fhash
+    return fsutil.get_file_hash(fpath)
+
 def build_index_by_fpath(fpath, user_id=0):
     # TODO 如果 user_id=0 尝试根据路径推测用户
     from handlers.fs.fs_helper import FileInfo, FileInfoDao
@@ -56,8 +62,11 @@ def build_index_by_fpath(fpath, user_id=0):
         file_info.ftype = "dir"
     else:
         file_info.ftype = fsutil.get_file_ext(fpath)
+        old_info = FileInfoDao.get_by_fpath(fpath)
+        file_info.fhash = get_file_hash_with_index(fpath, file_info.fsize, file_info.mtime, old_info)
     FileInfoDao.upsert(file_info)
     logging.debug("更新文件索引:%s", file_info)
+    return file_info
 
 class FileSyncIndexManager:
 
@@ -174,10 +183,11 @@ def on_fs_upload(ctx: xnote_event.FileUploadEvent):
     if filepath == None:
         return
     user_id = ctx.user_id
-    build_index_by_fpath(filepath, user_id)
+    file_info = build_index_by_fpath(filepath, user_id)
 
     log_data = FileLog()
     log_data.fpath = filepath
+    log_data.fhash = file_info.fhash
     log_data.user_name = ctx.user_name
     log_data.webpath = fsutil.get_webpath(filepath)
     stat = os.stat(filepath)
@@ -203,11 +213,12 @@ def on_fs_rename(ctx: xnote_event.FileRenameEvent):
     logging.debug("检测到文件重命名事件: %s", ctx)
     from handlers.fs.fs_helper import FileInfoDao
 
-    build_index_by_fpath(ctx.fpath, ctx.user_id)
+    file_info = build_index_by_fpath(ctx.fpath, ctx.user_id)
     FileInfoDao.delete_by_fpath(ctx.old_fpath)
 
     log_data = FileLog()
     log_data.fpath = ctx.fpath
+    log_data.fhash = file_info.fhash
     log_data.user_name = ctx.user_name
     log_data.webpath = fsutil.get_webpath(ctx.fpath)
     log_data.old_webpath = fsutil.get_webpath(ctx.old_fpath)
@@ -11,7 +11,9 @@
 
 import os
 import time
+import shutil
 import logging
+import threading
 
 import xutils
 import xconfig
@@ -26,18 +28,89 @@ from xutils.six.moves.urllib.parse import quote
 from xutils.mem_util import log_mem_info_deco
 from .models import FileIndexInfo
 from .system_sync_indexer import build_index_by_fpath
+from concurrent.futures import ThreadPoolExecutor
 
 RETRY_INTERVAL = 60
 MAX_KEY_SIZE = 511
 
-dbutil.register_table("fs_sync_index_copy", "文件索引拷贝")
-dbutil.register_table("fs_sync_index_failed", "文件索引拷贝失败")
+dbutil.register_table("fs_sync_index_copy", "文件索引拷贝", binlog=True)
+dbutil.register_table("fs_sync_index_failed", "文件索引拷贝失败", binlog=True)
 
 def print_debug_info(*args):
     new_args = [dateutil.format_time(), "[system_sync_http]"]
     new_args += args
     print(*new_args)
 
+
+class DownloadStat:
+    """文件同步的吞吐统计"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.copied = 0
+        self.failed = 0
+        # 下载任务的累计执行时间(墙上时间)
+        self.busy_time = 0.0
+
+    def add(self, name="files", count=1, size=0):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + count)
+            self.bytes += size
+
+    def add_busy_time(self, cost_time=0.0):
+        with self.lock:
+            self.busy_time += cost_time
+
+    def files_per_second(self):
+        if self.busy_time <= 0:
+            return 0.0
+        return (self.files + self.copied) / self.busy_time
+
+    def mb_per_second(self):
+        if self.busy_time <= 0:
+            return 0.0
+        return self.bytes / 1024.0 / 1024.0 / self.busy_time
+
+    def format_throughput(self):
+        return "%.1f files/s, %.2f MB/s" % (self.files_per_second(), self.mb_per_second())
+
+
+class DownloadScheduler:
+    """并发下载文件, 同时执行的下载数量不超过 worker_count"""
+
+    def __init__(self, worker_count=4):
+        self.worker_count = max(1, worker_count)
+
+    def run(self, items, func):
+        start_time = time.time()
+        errors = []
+        try:
+            if self.worker_count == 1 or len(items) <= 1:
+                for item in items:
+                    func(item)
+                return
+            with ThreadPoolExecutor(max_workers=self.worker_count, thread_name_prefix="FileSyncWorker") as pool:
+                futures = [pool.submit(func, item) for item in items]
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(e)
+        finally:
+            download_stat.add_busy_time(time.time() - start_time)
+        if len(errors) > 0:
+            # 和串行执行保持一致, 有异常的时候不更新同步位点
+            raise errors[0]
+
+
+download_stat = DownloadStat()
+
 class HttpClient:
 
     def __init__(self, host, token, admin_token):
@@ -45,6 +118,8 @@ class HttpClient:
         self.token = token
         self.admin_token = admin_token
         self.debug = True
+        # binlog单页的数量
+        self.binlog_page_size = 500
 
     def get_table(self):
         return dbutil.get_hash_table("fs_sync_index_copy")
@@ -125,6 +200,9 @@ class HttpClient:
         remote_mtime = item.mtime
         local_mtime = xutils.format_datetime(stat.st_mtime)
         is_same_file = (item.fsize == stat.st_size and remote_mtime == local_mtime)
+        if not is_same_file and item.fhash != "" and item.fsize == stat.st_size:
+            # 修改时间不同, 但是内容相同
+            is_same_file = (self.get_local_hash(dest_path) == item.fhash)
         logging.debug("远程文件: %s, 本地文件: %s, is_same_file: %s", (remote_mtime, item.fsize), 
                       (local_mtime, stat.st_size), is_same_file)
         return is_same_file
@@ -214,26 +292,78 @@ class HttpClient:
         if self.is_same_file(dest_path, item):
             logging.debug("文件没有变化，跳过:%s", webpath)
             self.delete_retry_task(item)
+            download_stat.add("skipped")
             return
 
         fsutil.makedirs(dirname)
 
+        local_copy = self.find_local_copy(item, dest_path)
+        if local_copy != None:
+            # 内容相同的文件已经存在(比如重命名), 直接复制
+            logging.debug("复制本地文件:%s -> %s", local_copy, dest_path)
+            self.save_file(item, local_copy, dest_path, mtime, copy=True)
+            download_stat.add("copied", size=item.fsize)
+            return
+
         logging.debug("原始文件:%s", url)
         logging.debug("目标文件:%s", dest_path)
 
+        # 先下载到临时文件, 中断后可以从临时文件断点续传
+        part_path = dest_path + ".part"
+        # 远程文件变化以后不能在旧的临时文件上续传
+        validator = "%s:%s:%s" % (item.fsize, item.mtime, item.fhash)
         try:
-            netutil.http_download(url, dest_path)
-            os.utime(dest_path, times=(mtime, mtime))
-            self.delete_retry_task(item)
-            build_index_by_fpath(dest_path)
+            readsize = netutil.http_download_resume(url, part_path, total_size=item.fsize, validator=validator)
+            if item.fhash != "" and fsutil.get_file_hash(part_path) != item.fhash:
+                os.remove(part_path)
+                raise Exception("文件hash校验失败")
+            self.save_file(item, part_path, dest_path, mtime)
+            fsutil.rmfile(part_path + ".validator", hard = True)
+            download_stat.add("files", size=readsize)
         except:
             item.err_msg = xutils.print_exc()
             self.upsert_retry_task(item)
+            download_stat.add("failed")
             logging.error("下载文件失败:%s", dest_path)
 
+    def save_file(self, item, src_path, dest_path, mtime, copy=False):
+        if copy:
+            shutil.copyfile(src_path, dest_path)
+        else:
+            os.replace(src_path, dest_path)
+        os.utime(dest_path, times=(mtime, mtime))
+        self.delete_retry_task(item)
+        build_index_by_fpath(dest_path)
+
+    def get_local_hash(self, fpath):
+        from handlers.fs.fs_helper import FileInfoDao
+        stat = os.stat(fpath)
+        info = FileInfoDao.get_by_fpath(fpath)
+        if info != None and info.get("fhash") and info.fsize == stat.st_size and str(info.mtime) == xutils.format_datetime(stat.st_mtime):
+            return info.fhash
+        return fsutil.get_file_hash(fpath)
+
+    def find_local_copy(self, item: FileIndexInfo, dest_path=""):
+        """根据hash查找本地内容相同的文件"""
+        from handlers.fs.fs_helper import FileInfoDao
+        if item.fhash == "":
+            return None
+        info = FileInfoDao.get_by_fhash(item.fhash)
+        if info == None or info.fpath == dest_path:
+            return None
+        if not os.path.isfile(info.fpath):
+            return None
+        if fsutil.get_file_size_int(info.fpath) != item.fsize:
+            return None
+        return info.fpath
+
+    def get_worker_count(self):
+        return xconfig.WebConfig.fs_sync_workers
+
     def download_files(self, result):
-        for item in result.data:
-            self.download_file(FileIndexInfo(**item))
+        items = [FileIndexInfo(**item) for item in result.data]
+        scheduler = DownloadScheduler(self.get_worker_count())
+        scheduler.run(items, self.download_file)
 
     def retry_failed(self):
         """TODO 这个应该是调度层的"""
@@ -269,7 +399,8 @@ class HttpClient:
     @log_mem_info_deco("proxy.list_binlog")
     def list_binlog(self, last_seq=0) -> dict:
         assert isinstance(last_seq, int)
-        params = dict(last_seq=str(last_seq), include_req_seq="false")
+        params = dict(last_seq=str(last_seq), include_req_seq="false",
+                      limit=str(self.binlog_page_size), version="2")
 
         leader_host = self.host
         leader_token = self.token
@@ -285,6 +416,13 @@ class HttpClient:
             logging.error("解析json失败, result=%s", result)
             raise Exception("解析JSON失败")
     
+    def download_snapshot(self, dest_path=""):
+        """下载全量快照到本地文件"""
+        params = dict(token=self.token)
+        url = "{host}/system/sync/leader?p=export_snapshot".format(host=self.host)
+        url = netutil._join_url_and_params(url, params)
+        netutil.http_download(url, dest_path)
+
     def list_db(self, last_key):
         # type: (str) -> str
         leader_token = self.token
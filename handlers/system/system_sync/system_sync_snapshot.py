@@ -0,0 +1,158 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 20:12:05
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 20:12:05
+@FilePath     : /xnote/handlers/system/system_sync/system_sync_snapshot.py
+@Description  : 全量同步的快照导出/导入
+
+快照是gzip压缩的JSON行格式, 分块输出
+- 第一行是header, 记录导出开始时的binlog位点
+- 然后是KV数据和SQL表的数据
+- 最后一行是footer, 没有footer说明快照不完整
+导出过程中的写入通过从header的位点开始重放binlog来补齐, binlog的重放是幂等的
+"""
+
+import json
+import time
+import zlib
+import logging
+
+import xtables
+from xutils import Storage
+from xutils import dbutil
+
+SNAPSHOT_VERSION = 1
+# 原始数据超过这个大小就输出一个压缩块
+CHUNK_SIZE = 256 * 1024
+SQL_PAGE_SIZE = 500
+
+
+class SnapshotType:
+    header = "header"
+    kv = "kv"
+    sql = "sql"
+    footer = "footer"
+
+
+class SnapshotExporter:
+    """导出快照"""
+
+    def __init__(self, binlog_seq=0, skip_func=None):
+        self.binlog_seq = binlog_seq
+        self.skip_func = skip_func
+        self.kv_count = 0
+        self.sql_count = 0
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._buffer = []
+        self._buffer_size = 0
+
+    def _add_line(self, line=""):
+        self._buffer.append(line)
+        self._buffer_size += len(line) + 1
+        if self._buffer_size >= CHUNK_SIZE:
+            return self._compress_buffer()
+        return b""
+
+    def _add_record(self, record):
+        return self._add_line(json.dumps(record, ensure_ascii=False, default=str))
+
+    def _compress_buffer(self):
+        data = ("\n".join(self._buffer) + "\n").encode("utf-8")
+        self._buffer = []
+        self._buffer_size = 0
+        return self._compressor.compress(data)
+
+    def iter_kv_lines(self):
+        with dbutil.DBSnapshot() as snapshot:
+            for key_bytes, value_bytes in snapshot.RangeIter(key_from=b"", key_to=b"\xff", include_value=True):
+                key = bytes(key_bytes).decode("utf-8")
+                if self.skip_func != None and self.skip_func(key):
+                    continue
+                self.kv_count += 1
+                # value已经是JSON格式, 直接拼接, 避免重复解析和序列化
+                yield '{"t":"kv","k":%s,"v":%s}' % (json.dumps(key, ensure_ascii=False), bytes(value_bytes).decode("utf-8"))
+
+    def get_sql_tables(self):
+        result = []
+        table_dict = xtables.TableManager.get_table_info_dict()
+        for table_name in sorted(table_dict.keys()):
+            table_info = table_dict[table_name]
+            # 只导出开启了binlog的表, 和增量同步的范围保持一致
+            if table_info.enable_binlog and not table_info.is_deleted:
+                result.append(table_info)
+        return result
+
+    def iter_sql_records(self):
+        for table_info in self.get_sql_tables():
+            table = xtables.get_table_by_name(table_info.tablename)
+            pk_name = table_info.pk_name
+            last_pk = None
+            while True:
+                if last_pk == None:
+                    rows = table.select(order=pk_name, limit=SQL_PAGE_SIZE)
+                else:
+                    rows = table.select(where="%s > $last_pk" % pk_name, vars=dict(last_pk=last_pk),
+                                        order=pk_name, limit=SQL_PAGE_SIZE)
+                if len(rows) == 0:
+                    break
+                self.sql_count += len(rows)
+                yield dict(t=SnapshotType.sql, table=table_info.tablename, rows=[dict(**row) for row in rows])
+                last_pk = rows[-1].get(pk_name)
+
+    def iter_chunks(self):
+        """按块输出压缩后的快照"""
+        start_time = time.time()
+        header = dict(t=SnapshotType.header, version=SNAPSHOT_VERSION,
+                      binlog_seq=self.binlog_seq, time=int(start_time))
+        self._add_record(header)
+
+        for line in self.iter_kv_lines():
+            chunk = self._add_line(line)
+            if chunk:
+                yield chunk
+
+        for record in self.iter_sql_records():
+            chunk = self._add_record(record)
+            if chunk:
+                yield chunk
+
+        footer = dict(t=SnapshotType.footer, kv_count=self.kv_count, sql_count=self.sql_count)
+        self._add_record(footer)
+        yield self._compress_buffer() + self._compressor.flush()
+        logging.info("export snapshot done, kv_count=%s, sql_count=%s, cost=%.2fs",
+                     self.kv_count, self.sql_count, time.time() - start_time)
+
+
+class SnapshotReader:
+    """读取快照文件(已经解压的文本流)"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.header = None # type: Storage|None
+        self.footer = None # type: Storage|None
+
+    def __iter__(self):
+        for line in self.fp:
+            line = line.strip()
+            if line == "":
+                continue
+            try:
+                record = json.loads(line)
+            except:
+                logging.error("invalid snapshot line: %s", line[:200])
+                continue
+            record_type = record.get("t")
+            if record_type == SnapshotType.header:
+                self.header = Storage(**record)
+                if self.header.version > SNAPSHOT_VERSION:
+                    raise Exception("不支持的快照版本:%s" % self.header.version)
+                continue
+            if record_type == SnapshotType.footer:
+                self.footer = Storage(**record)
+                continue
+            if self.header == None:
+                raise Exception("快照缺少header")
+            yield record
@@ -30,6 +30,25 @@ class ThreadInfoHandler:
         kw.get_handler_name = get_handler_name
         return xtemplate.render("system/page/thread_info.html", **kw)
 
+class ExecutorInfoHandler:
+    """异步任务队列的积压情况"""
+
+    @xauth.login_required("admin")
+    def GET(self):
+        orderby = xutils.get_argument_str("orderby", "run_time")
+        executor = xmanager.get_executor()
+        kw = xutils.Storage()
+        kw.lane_list = executor.lane_stats()
+        kw.task_stat_list = executor.stats(orderby=orderby)
+        kw.orderby = orderby
+        return xtemplate.render("system/page/executor_info.html", **kw)
+
+    @xauth.login_required("admin")
+    def POST(self):
+        xmanager.get_executor().reset_stats()
+        return dict(code="success")
+
 xurls = (
     r"/system/thread_info", ThreadInfoHandler,
+    r"/system/thread_info/executor", ExecutorInfoHandler,
 )
\ No newline at end of file
@@ -10,7 +10,7 @@ import random
 from xutils import Storage
 from xutils import dbutil
 
-dbutil.register_table("test", "测试数据库")
+dbutil.register_table("test", "测试数据库", binlog=True)
 dbutil.register_table_index("test", "age")
 
 def get_test_db():
@@ -293,6 +293,12 @@ class application:
                     raise web.nomethod()
 
                 result = self.handle_with_processors()
+                file_wrapper = env.get('wsgi.file_wrapper')
+                if isinstance(file_wrapper, type) and isinstance(result, file_wrapper):
+                    # the server sends the file by itself (e.g. with sendfile)
+                    start_resp(web.ctx.status, web.ctx.headers)
+                    self._cleanup()
+                    return result
                 if is_iter(result):
                     result = peep(result)
                 else:
@@ -1321,6 +1321,8 @@ class SqliteDB(DB):
         keywords["pooling"] = False
 
         DB.__init__(self, db, keywords)
+        # multi-row VALUES is supported since sqlite 3.7.11
+        self.supports_multiple_insert = getattr(db, "sqlite_version_info", (0,)) >= (3, 7, 11)
 
     def _process_insert_query(self, query, tablename, seqname):
         return query, SQLQuery("SELECT last_insert_rowid();")
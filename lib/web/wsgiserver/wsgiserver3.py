@@ -1977,6 +1977,32 @@ class CherryPyWSGIServer(HTTPServer):
     numthreads = property(_get_numthreads, _set_numthreads)
 
 
+class FileWrapper(object):
+
+    """The wsgi.file_wrapper of this server (PEP 3333, "Optional
+    Platform-Specific File Handling").
+
+    The file is sent from its current position. If the application declared
+    a Content-Length, only that many bytes are sent, so an application can
+    serve a byte range by seeking the file and setting Content-Length.
+    The gateway sends regular files with socket.sendfile; iterating the
+    wrapper reads the file in blocks instead.
+    """
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        while True:
+            data = self.filelike.read(self.blksize)
+            if not data:
+                break
+            yield data
+
+
 class WSGIGateway(Gateway):
 
     """A base class to interface HTTPServer with WSGI."""
@@ -1995,7 +2021,12 @@ class WSGIGateway(Gateway):
         """Process the current request."""
         response = self.req.server.wsgi_app(self.env, self.start_response)
         try:
-            for chunk in response:
+            chunks = response
+            if isinstance(response, FileWrapper):
+                if self.sendfile(response):
+                    return
+                chunks = self.iter_file(response)
+            for chunk in chunks:
                 # "The start_response callable must not actually transmit
                 # the response headers. Instead, it must store them for the
                 # server or gateway to transmit only after the first
@@ -2010,6 +2041,57 @@ class WSGIGateway(Gateway):
             if hasattr(response, "close"):
                 response.close()
 
+    def sendfile(self, response):
+        """Send a FileWrapper with socket.sendfile.
+
+        Return False if the file or the connection does not support it;
+        the caller then iterates the response as usual.
+        """
+        req = self.req
+        sock = req.conn.socket
+        count = self.remaining_bytes_out
+        if not self.started_response or count is None:
+            # without Content-Length the response is chunked
+            return False
+        if not hasattr(sock, 'sendfile'):
+            return False
+        filelike = response.filelike
+        try:
+            filelike.fileno()
+            offset = filelike.tell()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return False
+
+        if not req.sent_headers:
+            req.sent_headers = True
+            req.send_headers()
+        if req.chunked_write:
+            return False
+        if req.method == b'HEAD' or count == 0:
+            return True
+
+        # the headers are buffered in wfile
+        req.conn.wfile.flush()
+        sent = sock.sendfile(filelike, offset, count)
+        self.remaining_bytes_out = count - sent
+        if sent < count:
+            # the file was truncated after Content-Length was computed
+            req.close_connection = True
+            raise ValueError(
+                "Response body is shorter than the declared Content-Length.")
+        return True
+
+    def iter_file(self, response):
+        """Iterate a FileWrapper, bounded by the declared Content-Length."""
+        for chunk in response:
+            rbo = self.remaining_bytes_out
+            if rbo is None:
+                yield chunk
+                continue
+            if rbo <= 0:
+                break
+            yield chunk[:rbo]
+
     def start_response(self, status, headers, exc_info=None):
         """WSGI callable to begin the HTTP response."""
         # "The application may call start_response more than once,
@@ -2081,6 +2163,7 @@ class WSGIGateway(Gateway):
 
         if rbo is not None:
             rbo -= chunklen
+            self.remaining_bytes_out = max(rbo, 0)
             if rbo < 0:
                 raise ValueError(
                     "Response body exceeds the declared Content-Length.")
@@ -2110,6 +2193,7 @@ class WSGIGateway_10(WSGIGateway):
             'SERVER_PROTOCOL': req.request_protocol.decode('ISO-8859-1'),
             'SERVER_SOFTWARE': req.server.software,
             'wsgi.errors': sys.stderr,
+            'wsgi.file_wrapper': FileWrapper,
             'wsgi.input': req.rfile,
             'wsgi.multiprocess': False,
             'wsgi.multithread': True,
@@ -100,6 +100,31 @@ class TestMain(BaseTestCase):
         self.assertEqual("bytes", response.headers["Accept-Ranges"])
         self.assertEqual(True, "Content-Range" in response.headers)
 
+    def test_fs_range_content_length(self):
+        fpath = os.path.join(xconfig.DATA_DIR, "test_range.txt")
+        xutils.writefile(fpath, "0123456789")
+
+        response = app.request("/data/test_range.txt", headers=dict(RANGE="bytes=2-"))
+        self.assertEqual("206 Partial Content", response.status)
+        self.assertEqual("8", response.headers["Content-Length"])
+        self.assertEqual("bytes 2-9/10", response.headers["Content-Range"])
+        self.assertEqual(b"23456789", response.data)
+
+        response = app.request("/data/test_range.txt", headers=dict(RANGE="bytes=-3"))
+        self.assertEqual("3", response.headers["Content-Length"])
+        self.assertEqual(b"789", response.data)
+
+        response = app.request("/data/test_range.txt", headers=dict(RANGE="bytes=20-"))
+        self.assertEqual("416 Range Not Satisfiable", response.status)
+        self.assertEqual("bytes */10", response.headers["Content-Range"])
+
+        response = app.request("/data/test_range.txt", headers=dict(RANGE="bytes=0-1,5-6"))
+        self.assertEqual("206 Partial Content", response.status)
+        self.assertTrue(response.headers["Content-Type"].startswith("multipart/byteranges"))
+        self.assertEqual(str(len(response.data)), response.headers["Content-Length"])
+        self.assertTrue(b"Content-Range: bytes 0-1/10\r\n\r\n01\r\n" in response.data)
+        self.assertTrue(b"Content-Range: bytes 5-6/10\r\n\r\n56\r\n" in response.data)
+
     def test_fs_find(self):
         json_request("/fs_find", method="POST",
                      data=dict(path="./data", find_key="java"))
@@ -145,6 +170,15 @@ class TestMain(BaseTestCase):
     def test_system_cache_page(self):
         self.check_200("/system/cache")
 
+    def test_system_executor_page(self):
+        self.check_200("/system/thread_info")
+        self.check_200("/system/thread_info/executor")
+        self.check_200("/system/thread_info/executor?orderby=wait_time")
+
+    def test_system_event_stats(self):
+        self.check_200("/system/event_stats")
+        self.check_200("/system/event_stats?event_type=search&orderby=count")
+
     def test_sys_info(self):
         self.check_OK("/system/info")
 
@@ -354,6 +388,165 @@ class Main:
     def test_backup(self):
         self.check_OK("/system/backup")
 
+    def test_backup_sql_online(self):
+        import sqlite3
+        from handlers.system.backup import DBBackup
+
+        backup = DBBackup()
+        backup.clean()
+        backup.online_step_pages = 1
+        backup.online_small_file_size = 0
+        try:
+            self.assertTrue(backup.backup_sql_tables_online())
+            db = sqlite3.connect(backup.db_backup_file)
+            count = db.execute("SELECT COUNT(1) FROM user").fetchone()[0]
+            db.close()
+            self.assertEqual(xtables.get_table_by_name("user").count(), count)
+        finally:
+            backup.clean()
+
+    def test_backup_sql_online_fallback(self):
+        import sqlite3
+        from handlers.system.backup import DBBackup
+
+        def backup_sqlite_file(source_path, target_path):
+            raise Exception("disk I/O error")
+
+        backup = DBBackup()
+        backup.clean()
+        backup.is_online_backup = lambda: True
+        backup.backup_sqlite_file = backup_sqlite_file
+        try:
+            # 在线备份失败的时候降级为按行复制
+            backup.dump_db(backup_kv=False, backup_sql=True)
+            db = sqlite3.connect(backup.db_backup_file)
+            count = db.execute("SELECT COUNT(1) FROM user").fetchone()[0]
+            db.close()
+            self.assertEqual(xtables.get_table_by_name("user").count(), count)
+        finally:
+            backup.clean()
+
+    def test_import_db(self):
+        from xutils import dbutil
+        from handlers.system.backup import DBBackup, DBImporter
+
+        dbutil.put("test_import:1", dict(name="Ada"), check_table=False)
+        backup = DBBackup()
+        backup.clean()
+        try:
+            backup.dump_db(backup_kv=True, backup_sql=True)
+            dbutil.delete("test_import:1")
+            importer = DBImporter()
+            importer.import_sql(backup.db_backup_file)
+            result = importer.import_kv(backup.db_backup_file)
+            self.assertEqual([], importer.count_errors)
+            self.assertTrue(result.endswith("errors:0"))
+            self.assertEqual("Ada", dbutil.get("test_import:1")["name"])
+        finally:
+            backup.clean()
+
+    def test_import_repair_index_lock(self):
+        import threading
+        from xutils import dbutil
+        from xutils.db.dbutil_table import LdbTable
+        from handlers.system.backup import DBImporter
+
+        locked = []
+
+        def try_lock():
+            lock = dbutil.get_write_lock()
+            got_lock = lock.acquire(blocking=False)
+            if got_lock:
+                lock.release()
+            locked.append(not got_lock)
+
+        def bulk_rebuild_index(table):
+            # 重建索引期间其他线程不能写入
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+
+        old_func = LdbTable.bulk_rebuild_index
+        LdbTable.bulk_rebuild_index = bulk_rebuild_index
+        try:
+            DBImporter().repair_index()
+        finally:
+            LdbTable.bulk_rebuild_index = old_func
+        self.assertTrue(len(locked) > 0)
+        self.assertTrue(all(locked))
+
+    def test_backup_delta(self):
+        import shutil
+        import gzip
+        import json
+        from xutils import dbutil
+        from xutils.db.binlog import BinLog
+        from handlers.system.backup import DBBackup, DBImporter, load_manifest
+
+        backup_dir = os.path.join(xconfig.TMP_DIR, "test_backup_delta")
+        shutil.rmtree(backup_dir, ignore_errors=True)
+        binlog = BinLog.get_instance()
+        old_enabled = BinLog.is_enabled()
+        binlog.set_enabled(True)
+
+        dbutil.register_table("test_backup", "备份测试", binlog=True)
+        dbutil.register_table("test_backup_hash", "备份测试(hash表)", binlog=True)
+        table = dbutil.get_table("test_backup")
+        hash_table = dbutil.get_hash_table("test_backup_hash")
+        table.put_by_id("2", dict(name="Ada"))
+        hash_table.put("2", dict(name="Ada"))
+        try:
+            backup = DBBackup(backup_dir=backup_dir)
+            backup.execute()
+            manifest = load_manifest(backup_dir)
+            self.assertIsNotNone(manifest)
+            self.assertEqual(0, len(manifest.deltas))
+
+            table.put_by_id("1", dict(name="Ada"))
+            table.delete_by_id("2")
+            hash_table.put("1", dict(name="Ada"))
+            hash_table.delete("2")
+            backup.execute()
+
+            manifest = load_manifest(backup_dir)
+            self.assertEqual(1, len(manifest.deltas))
+            self.assertEqual(binlog.last_seq, manifest.last_seq)
+
+            # 记录了binlog的hash表只备份变更的key, 不会全量复制
+            delta_path = os.path.join(backup_dir, manifest.deltas[0]["file"])
+            with gzip.open(delta_path, "rt", encoding="utf-8") as fp:
+                records = [json.loads(line) for line in fp]
+            self.assertNotIn("test_backup_hash", [x.get("table") for x in records if x["t"] == "kv_table"])
+            hash_keys = [x["k"] for x in records if x["t"] == "kv" and x["k"].startswith("test_backup_hash:")]
+            self.assertEqual(["test_backup_hash:1", "test_backup_hash:2"], sorted(hash_keys))
+
+            # 没有变更不会生成新的增量备份
+            backup.execute()
+            self.assertEqual(1, len(load_manifest(backup_dir).deltas))
+
+            table.put_by_id("1", dict(name="Bob"))
+            table.put_by_id("2", dict(name="Bob"))
+            hash_table.put("1", dict(name="Bob"))
+            hash_table.put("2", dict(name="Bob"))
+            DBImporter().apply_delta(delta_path)
+            self.assertEqual("Ada", table.get_by_id("1")["name"])
+            self.assertIsNone(table.get_by_id("2"))
+            self.assertEqual("Ada", hash_table.get("1")["name"])
+            self.assertIsNone(hash_table.get("2"))
+
+            # 新的全量备份会删除之前的增量备份文件
+            self.assertTrue(os.path.exists(delta_path))
+            backup.backup_base()
+            self.assertFalse(os.path.exists(delta_path))
+            self.assertEqual(0, len(load_manifest(backup_dir).deltas))
+        finally:
+            binlog.set_enabled(old_enabled)
+            for key, value in dbutil.prefix_iter("test_backup", include_key=True):
+                dbutil.delete(key)
+            for key, value in dbutil.prefix_iter("test_backup_hash", include_key=True):
+                dbutil.delete(key)
+            shutil.rmtree(backup_dir, ignore_errors=True)
+
     def test_dbutil_test(self):
         self.check_OK("/test/test_dbutil")
         self.check_OK("/test/test_dbutil?p=clear")
@@ -62,6 +62,8 @@ def init():
 
     # 发送启动消息
     xmanager.fire("sys.reload")
+    # 等待启动事件处理完成, 避免工作线程和pytest的输出捕获同时读写stdout
+    xmanager.get_executor().wait_done()
 
     return APP
 
@@ -11,7 +11,7 @@ from .test_base import json_request, BaseTestCase
 from .test_base import init as init_app, get_test_file_path
 from handlers.fs.fs_index import build_fs_index
 
-init_app()
+app = init_app()
 
 
 class TestMain(BaseTestCase):
@@ -50,6 +50,35 @@ class TestMain(BaseTestCase):
     def test_build_fs_index(self):
         size = build_fs_index(xconfig.DATA_DIR, sync=True)
         self.assertTrue(size > 0)
+
+    def test_build_fs_index_incremental(self):
+        from handlers.fs.fs_index import IndexBuilder
+        from handlers.fs.fs_helper import FileInfoModel
+
+        root = os.path.abspath(get_test_file_path("./fs_index_test"))
+        xutils.makedirs(os.path.join(root, "sub"))
+        xutils.writefile(os.path.join(root, "a.txt"), "12345")
+        xutils.writefile(os.path.join(root, "sub", "b.txt"), "123")
+        xutils.writefile(os.path.join(root, "sub", "c.txt"), "1")
+
+        builder = IndexBuilder(workers=2)
+        self.assertEqual(9, builder.build(root))
+        self.assertEqual(4, FileInfoModel.get_by_fpath(os.path.join(root, "sub")).fsize)
+
+        # 没有变化的时候不写入
+        builder = IndexBuilder(workers=2)
+        self.assertEqual(9, builder.build(root))
+        self.assertEqual(0, builder.stats.inserted + builder.stats.updated + builder.stats.deleted)
+
+        xutils.writefile(os.path.join(root, "sub", "b.txt"), "123456")
+        os.remove(os.path.join(root, "sub", "c.txt"))
+        builder = IndexBuilder(workers=2)
+        self.assertEqual(11, builder.build(root))
+        # 修改的文件和上级目录
+        self.assertEqual(3, builder.stats.updated)
+        self.assertEqual(1, builder.stats.deleted)
+        self.assertEqual(None, FileInfoModel.get_by_fpath(os.path.join(root, "sub", "c.txt")))
+        self.assertEqual(6, FileInfoModel.get_by_fpath(os.path.join(root, "sub")).fsize)
     
     def test_fs_index_manage_page(self):
         path = xutils.quote("./testdata")
@@ -87,4 +116,125 @@ class TestMain(BaseTestCase):
         self.check_OK("/fs_find?key=test")
 
     def test_fs_upload_search(self):
-        self.check_OK("/fs_upload/search?key=" + xutils.quote("test"))
\ No newline at end of file
+        self.check_OK("/fs_upload/search?key=" + xutils.quote("test"))
+
+    def test_fs_thumbnail(self):
+        from PIL import Image
+        from handlers.fs import fs_image
+
+        img_path = os.path.abspath(get_test_file_path("./thumbnail_test.png"))
+        Image.new("RGB", (600, 400), (255, 0, 0)).save(img_path)
+
+        service = fs_image.get_thumbnail_service()
+        cache_path = service.get_thumbnail(img_path)
+        assert cache_path != None
+        self.assertEqual(cache_path, service.cache.get(img_path))
+        with Image.open(cache_path) as im:
+            self.assertEqual((200, 200), im.size)
+
+        # 命中缓存的时候不再提交任务
+        self.assertTrue(service.submit(img_path).result())
+        self.assertEqual(0, len(service.pending))
+
+        response = app.request("/fs/~{path}?mode=thumbnail".format(path=img_path))
+        self.assertEqual("200 OK", response.status)
+        self.assertEqual(os.path.getsize(cache_path), len(response.data))
+
+        # 原图修改以后缓存失效
+        Image.new("RGB", (300, 300), (0, 255, 0)).save(img_path)
+        self.assertEqual(None, service.cache.get(img_path))
+        self.assertEqual(None, service.cache.get(img_path + ".not_exists"))
+
+    def test_fs_thumbnail_timeout(self):
+        import sys
+        import subprocess
+        from handlers.fs import fs_image
+
+        # 模拟卡住的工作进程
+        worker = fs_image.ThumbnailWorker.__new__(fs_image.ThumbnailWorker)
+        worker.proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"],
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding="utf-8", bufsize=1)
+        worker.task_count = 0
+        try:
+            with self.assertRaises(Exception) as ctx:
+                worker.create_thumbnail("a.png", "b.png", timeout=0.5)
+            self.assertTrue("timeout" in str(ctx.exception))
+            self.assertNotEqual(None, worker.proc.wait(timeout=5))
+        finally:
+            worker.close()
+
+    def test_fs_range_upload_manifest(self):
+        from io import BytesIO
+        from handlers.fs.fs_upload import RangeUploadManifest
+
+        fpath = os.path.abspath(get_test_file_path("./range_upload_test.txt"))
+        xutils.remove(fpath, True)
+        data = b"0123456789abc"
+
+        manifest = RangeUploadManifest(fpath, chunks=4, size=len(data), chunk_size=4)
+        self.assertFalse(manifest.write_chunk(2, BytesIO(data[8:12])))
+        self.assertFalse(manifest.write_chunk(0, BytesIO(data[0:4])))
+        self.assertFalse(os.path.exists(fpath))
+
+        # 分片大小不对的不会记录
+        with self.assertRaises(Exception):
+            manifest.write_chunk(3, BytesIO(b"cd"))
+
+        # 中断以后续传
+        manifest = RangeUploadManifest(fpath, chunks=4, size=len(data), chunk_size=4)
+        self.assertTrue(manifest.load())
+        self.assertEqual({0, 2}, manifest.received)
+        self.assertFalse(manifest.write_chunk(3, BytesIO(data[12:])))
+        self.assertTrue(manifest.write_chunk(1, BytesIO(data[4:8])))
+
+        with open(fpath, "rb") as fp:
+            self.assertEqual(data, fp.read())
+        self.assertFalse(os.path.exists(manifest.part_path))
+        self.assertFalse(os.path.exists(manifest.manifest_path))
+        xutils.remove(fpath, True)
+
+        # 同名同大小的另一个文件不会复用之前的清单
+        manifest = RangeUploadManifest(fpath, chunks=4, size=len(data), chunk_size=4, upload_id="WU_FILE_0|1")
+        self.assertFalse(manifest.write_chunk(0, BytesIO(b"xxxx")))
+        manifest = RangeUploadManifest(fpath, chunks=4, size=len(data), chunk_size=4, upload_id="WU_FILE_1|2")
+        self.assertFalse(manifest.load())
+        self.assertFalse(manifest.write_chunk(1, BytesIO(data[4:8])))
+        self.assertEqual({1}, manifest.received)
+        xutils.remove(manifest.part_path, True)
+        xutils.remove(manifest.manifest_path, True)
+
+    def test_fs_find_by_name_index(self):
+        from handlers.fs.fs_index import IndexBuilder
+        from handlers.fs.fs_helper import FileNameIndexDao, FileInfoModel
+        from handlers.fs.fs_find import find_in_cache
+
+        root = os.path.abspath(get_test_file_path("./fs_name_index_test"))
+        xutils.makedirs(os.path.join(root, "sub"))
+        xutils.writefile(os.path.join(root, "Report_2026.txt"), "1")
+        xutils.writefile(os.path.join(root, "sub", "report_old.txt"), "1")
+        xutils.writefile(os.path.join(root, "sub", "notes.md"), "1")
+        IndexBuilder(workers=2).build(root)
+
+        self.assertEqual({"rep", "ort", ".tx", "txt"}, FileNameIndexDao.get_pattern_grams("*rep?ort*.txt"))
+
+        # 大小写不敏感, 浅的路径排在前面
+        plist = find_in_cache("*report*", root)
+        self.assertEqual([os.path.join(root, "Report_2026.txt"),
+                          os.path.join(root, "sub", "report_old.txt")], plist)
+
+        plist = find_in_cache("*.md", root)
+        self.assertEqual([os.path.join(root, "sub", "notes.md")], plist)
+
+        # 少于三个字符的查询扫描索引
+        plist = find_in_cache("*te*", root)
+        self.assertEqual([os.path.join(root, "sub", "notes.md")], plist)
+
+        # 删除文件以后同步删除文件名索引
+        fpath = os.path.join(root, "sub", "notes.md")
+        file_id = FileInfoModel.get_by_fpath(fpath).id
+        FileInfoModel.delete_by_fpath(fpath)
+        self.assertFalse(file_id in FileNameIndexDao.list_file_ids({"not"}))
+        self.assertEqual([], find_in_cache("*notes*", root))
+
+        FileNameIndexDao.rebuild()
+        self.assertEqual(2, len(find_in_cache("*report*", root)))
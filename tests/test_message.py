@@ -41,7 +41,13 @@ def del_msg_by_id(id):
 
 def delete_all_messages():
     for record in MSG_DB.iter(limit=-1):
-        MSG_DB.delete_by_key(record._key)
+        # 同时删除索引
+        msg_dao.delete_message_by_id(record._key)
+
+    # 其他测试直接清空KV的时候, 索引表会残留数据
+    for index in msg_dao.MsgIndexDao.db.select(what="id"):
+        msg_dao.MsgIndexDao.delete_by_id(index.id)
+        msg_dao.MsgSearchIndexDao.delete_index(index.id)
 
 
 class TextPage(xtemplate.BaseTextPlugin):
@@ -245,6 +251,50 @@ class TestMain(BaseTestCase):
         assert len(search_list) == 1
         assert search_list[0].id == new_msg_id
 
+    def test_message_search_by_index(self):
+        delete_all_messages()
+        user_name = xauth.current_name_str()
+
+        for content in ("index-search alpha", "index-search beta #topic#", "随手记索引测试"):
+            msg = msg_dao.MessageDO()
+            msg.user = user_name
+            msg.tag = "log"
+            msg.content = content
+            msg_dao.create_message(msg)
+
+        task = msg_dao.MessageDO()
+        task.user = user_name
+        task.tag = "task"
+        task.content = "index-search task"
+        msg_dao.create_message(task)
+
+        result, amount = msg_dao.search_message(user_name, "index", 0, 2)
+        self.assertEqual(3, amount)
+        self.assertEqual(2, len(result))
+
+        result, amount = msg_dao.search_message(user_name, "index", search_tags=["task"])
+        self.assertEqual(1, amount)
+        self.assertEqual("index-search task", result[0].content)
+
+        result, amount = msg_dao.search_message(user_name, "#topic#")
+        self.assertEqual(1, amount)
+
+        result, amount = msg_dao.search_message(user_name, "索引", count_only=True)
+        self.assertEqual(([], 1), (result, amount))
+
+        result, amount = msg_dao.search_message(user_name, "index", date="1970-01")
+        self.assertEqual(0, amount)
+
+        # 更新之后索引同步更新
+        task.content = "changed"
+        msg_dao.update_message(task)
+        result, amount = msg_dao.search_message(user_name, "index", search_tags=["task"])
+        self.assertEqual(0, amount)
+
+        msg_dao.delete_message_by_id(task.id)
+        result, amount = msg_dao.search_message(user_name, "changed")
+        self.assertEqual(0, amount)
+
     def test_message_search_page(self):
         self.check_OK("/message?tag=search&key=123")
 
@@ -515,6 +515,87 @@ class TestMain(BaseTestCase):
         assert_json_request_success(self, u"/note/api/timeline?type=search&key=xnote中文")
         self.check_OK(u"/search?key=test中文&category=content")
 
+    def test_note_search_content(self):
+        from handlers.note.dao_search import NoteSearchIndexDao
+        delete_note_for_test("search-content-test")
+        id = create_note_for_test("md", "search-content-test", content="全文索引测试 hello xnote")
+        # 索引是异步更新的, 这里同步执行一次
+        NoteSearchIndexDao.update_by_id(id)
+
+        user_name = xauth.current_name()
+        result = note_dao.search_content(textutil.split_words("索引测试 xno"), user_name)
+        self.assertEqual([int(id)], [x.id for x in result])
+
+        result = note_dao.search_content(textutil.split_words("测试 world"), user_name)
+        self.assertEqual([], result)
+
+        dao_delete.delete_note(id)
+        NoteSearchIndexDao.update_by_id(id)
+        result = note_dao.search_content(["hello"], user_name)
+        self.assertEqual([], result)
+
+    def test_note_rank_content(self):
+        from handlers.note.dao_search import NoteSearchIndexDao
+        delete_note_for_test("rank-test-a")
+        delete_note_for_test("rank-test-b")
+        delete_note_for_test("rank-test-c ranking")
+        id_a = create_note_for_test("md", "rank-test-a", content="ranking other words here")
+        id_b = create_note_for_test("md", "rank-test-b", content="ranking ranking ranking")
+        id_c = create_note_for_test("md", "rank-test-c ranking", content="ranking other")
+        for id in (id_a, id_b, id_c):
+            NoteSearchIndexDao.update_by_id(id)
+
+        user_name = xauth.current_name()
+        notes, total = note_dao.rank_content(["ranking"], user_name, top_k=2)
+        self.assertEqual(3, total)
+        # 标题命中的排在最前面, 然后是词频高的
+        self.assertEqual([int(id_c), int(id_b)], [x.id for x in notes])
+
+        # 增量维护的统计信息和重新计算的一致
+        user_id = xauth.current_user_id()
+        stat = NoteSearchIndexDao.service.get_corpus_stat(user_id)
+        NoteSearchIndexDao.service.rebuild_stat(user_id)
+        self.assertEqual(stat, NoteSearchIndexDao.service.get_corpus_stat(user_id))
+
+        delete_note_for_test("rank-test-a")
+        delete_note_for_test("rank-test-b")
+        delete_note_for_test("rank-test-c ranking")
+
+    def test_note_stat_incremental(self):
+        user_name = xauth.current_name()
+        delete_note_for_test("stat-test")
+        note_dao.refresh_note_stat(user_name)
+
+        def assert_stat_match():
+            stat = note_dao.get_note_stat(user_name)
+            self.assertEqual(note_dao.count_by_creator(user_name), stat.total)
+            self.assertEqual(note_dao.count_group(user_name), stat.group_count)
+            self.assertEqual(note_dao.count_by_type(user_name, "table"), stat.table_count)
+            self.assertEqual(note_dao.count_sticky(user_name), stat.sticky_count)
+            self.assertEqual(note_dao.count_removed(user_name), stat.removed_count)
+            self.assertEqual(NoteDao.count_comment(user_name), stat.comment_count)
+            self.assertEqual(NoteDao.count_tag(user_name), stat.tag_count)
+
+        id = create_note_for_test("csv", "stat-test")
+        assert_stat_match()
+
+        self.check_OK("/note/unstick?id=%s" % id)
+        assert_stat_match()
+
+        json_request("/note/comment/save", method="POST",
+                     data = dict(note_id = id, content = "stat comment"))
+        assert_stat_match()
+
+        for comment in json_request("/note/comments?note_id=%s" % id):
+            delete_comment_for_test(comment["id"])
+        assert_stat_match()
+
+        dao_delete.delete_note(id)
+        assert_stat_match()
+
+        delete_note_for_test("stat-test")
+        assert_stat_match()
+
     def test_split_words(self):
         from xutils.textutil import split_words
         words = split_words(u"mac网络")
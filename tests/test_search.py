@@ -41,3 +41,94 @@ class TestMain(BaseTestCase):
         dao.add_search_history(None, "test")
         dao.expire_search_history("user")
         dao.list_search_history("user")
+
+    def test_search_engine_parallel(self):
+        import time
+        import xconfig
+        import xmanager
+        from xutils import Storage
+        from handlers.search.search import SearchContext
+        from handlers.search.search_engine import SearchEngine
+
+        event_type = "search.test_parallel"
+        xmanager.remove_event_handlers(event_type)
+
+        @xmanager.searchable(event_type=event_type, description="fast")
+        def fast_handler(ctx):
+            ctx.tools.append(Storage(name="fast"))
+
+        @xmanager.searchable(event_type=event_type, description="slow")
+        def slow_handler(ctx):
+            for i in range(50):
+                if ctx.cancelled:
+                    return
+                time.sleep(0.01)
+            ctx.tools.append(Storage(name="slow"))
+
+        @xmanager.searchable(event_type=event_type, description="category")
+        def category_handler(ctx):
+            ctx.category = "note"
+            ctx.skipped_count += 1
+
+        old_timeout = xconfig.WebConfig.search_handler_timeout_ms
+        xconfig.WebConfig.search_handler_timeout_ms = 100
+        try:
+            ctx = SearchContext()
+            ctx.key = "test"
+            SearchEngine.fire(event_type, ctx)
+            self.assertEqual(["fast"], [x.name for x in ctx.tools])
+            self.assertEqual(1, len(ctx.dropped_handlers))
+            # 处理器修改的其他字段也要合并回来
+            self.assertEqual("note", ctx.category)
+            self.assertEqual(1, ctx.skipped_count)
+            self.assertEqual("test", ctx.key)
+            self.assertFalse(ctx.cancelled)
+
+            # 超时的处理器收到取消标记以后结束
+            for i in range(100):
+                if len(SearchEngine._stale_tasks) == 0:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(0, len(SearchEngine._stale_tasks))
+        finally:
+            xconfig.WebConfig.search_handler_timeout_ms = old_timeout
+            xmanager.remove_event_handlers(event_type)
+
+    def test_search_engine_stale_handler(self):
+        import time
+        import threading
+        import xconfig
+        import xmanager
+        from handlers.search.search import SearchContext
+        from handlers.search.search_engine import SearchEngine
+
+        event_type = "search.test_stale"
+        xmanager.remove_event_handlers(event_type)
+        release = threading.Event()
+
+        @xmanager.searchable(event_type=event_type, description="fast")
+        def fast_handler(ctx):
+            pass
+
+        @xmanager.searchable(event_type=event_type, description="blocked")
+        def blocked_handler(ctx):
+            # 不检查取消标记的处理器
+            release.wait(5)
+
+        old_timeout = xconfig.WebConfig.search_handler_timeout_ms
+        xconfig.WebConfig.search_handler_timeout_ms = 50
+        try:
+            ctx = SearchContext()
+            SearchEngine.fire(event_type, ctx)
+            self.assertEqual(1, len(ctx.dropped_handlers))
+
+            # 上一次超时的调用还在运行, 不再提交新的任务
+            ctx = SearchContext()
+            start_time = time.time()
+            SearchEngine.fire(event_type, ctx)
+            self.assertEqual(1, len(ctx.dropped_handlers))
+            self.assertTrue(time.time() - start_time < 0.05)
+        finally:
+            release.set()
+            xconfig.WebConfig.search_handler_timeout_ms = old_timeout
+            xmanager.remove_event_handlers(event_type)
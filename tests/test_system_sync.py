@@ -22,6 +22,8 @@ import xnote_event
 
 from . import test_base
 from handlers.system.system_sync.node_follower import DBSyncer
+from handlers.system.system_sync.models import FileIndexInfo
+import xutils
 
 app = test_base.init()
 json_request = test_base.json_request
@@ -320,4 +322,178 @@ class TestSystemSync(BaseTestCase):
         assert result.data[0].value["ftype"] == "txt"
 
         check_manager = FileIndexCheckManager()
-        check_manager.run_step()
\ No newline at end of file
+        check_manager.run_step()
+
+    def test_leader_list_binlog_v2(self):
+        from handlers.system.system_sync.system_sync_controller import LEADER
+        from xutils.db.binlog import BinLog, BinLogOpType
+        binlog = BinLog.get_instance()
+        binlog.set_max_size(1000)
+        binlog.set_enabled(True)
+
+        dbutil.register_table("test_sync_v2", "同步测试")
+        last_seq = binlog.last_seq
+        for i in range(5):
+            key = "test_sync_v2:%d" % i
+            # dbutil.put会记录binlog
+            dbutil.put(key, dict(index=i))
+        binlog.add_log(BinLogOpType.put, "test_sync_v2:deleted")
+
+        result = LEADER.list_binlog(last_seq=last_seq, limit=4, include_req_seq=False, version=2)
+        assert result.success == True
+        assert result.version == 2
+        assert result.has_next == True
+        assert result.scan_seq == last_seq + 3
+        self.assertEqual([0, 1, 2], [x.value["index"] for x in result.data])
+
+        result = LEADER.list_binlog(last_seq=result.scan_seq, limit=10, include_req_seq=False, version=2)
+        assert result.has_next == False
+        assert result.leader_last_seq == binlog.last_seq
+        self.assertEqual(3, len(result.data))
+        self.assertEqual(BinLogOpType.delete, result.data[-1].optype)
+
+    def test_system_sync_db_binlog_pipeline(self):
+        from handlers.system.system_sync.system_sync_controller import FOLLOWER
+
+        dbutil.register_table("test_sync_pipe", "同步测试")
+        dbutil.put("test_sync_pipe:2", dict(name="old"))
+
+        pages = {
+            100: dict(code="success", version=2, has_next=True, scan_seq=105,
+                      leader_last_seq=110, last_log_ts=2000,
+                      data=[dict(optype="put", seq=101, key="test_sync_pipe:1", value=dict(name="Ada"), ts=1000),
+                            dict(optype="delete", seq=102, key="test_sync_pipe:2", ts=1000)]),
+            105: dict(code="success", version=2, has_next=False, scan_seq=110,
+                      leader_last_seq=110, last_log_ts=2000,
+                      data=[dict(optype="put", seq=108, key="test_sync_pipe:1", value=dict(name="Bob"), ts=2000)]),
+        }
+        requests = []
+
+        class MockedClient:
+            def list_binlog(self, last_seq):
+                requests.append(last_seq)
+                return pages[last_seq]
+
+        db_syncer = FOLLOWER.db_syncer
+        db_syncer.put_db_sync_state("binlog")
+        db_syncer.put_binlog_last_seq(100)
+        db_syncer.sync_by_binlog(MockedClient())
+
+        self.assertEqual([100, 105], requests)
+        self.assertEqual(110, db_syncer.get_binlog_last_seq())
+        self.assertEqual("Bob", dbutil.get("test_sync_pipe:1")["name"])
+        self.assertIsNone(dbutil.get("test_sync_pipe:2"))
+        self.assertEqual(0, db_syncer.lag_stat.lag_seq)
+        self.assertEqual(0, db_syncer.lag_stat.lag_seconds)
+
+    def test_system_sync_db_snapshot(self):
+        from handlers.system.system_sync.system_sync_controller import FOLLOWER, LEADER
+        from handlers.system.system_sync.system_sync_snapshot import SnapshotExporter
+
+        dbutil.register_table("test_sync_snap", "快照测试")
+        dbutil.put("test_sync_snap:1", dict(name="Ada"))
+        dbutil.put("test_sync_snap:2", dict(name="Bob"))
+
+        exporter = SnapshotExporter(binlog_seq=123, skip_func=LEADER.skip_db_sync)
+        snapshot_data = b"".join(exporter.iter_chunks())
+        self.assertTrue(exporter.kv_count >= 2)
+
+        dbutil.delete("test_sync_snap:2")
+
+        class MockedClient:
+            def download_snapshot(self, dest_path=""):
+                with open(dest_path, "wb") as fp:
+                    fp.write(snapshot_data)
+
+        db_syncer = FOLLOWER.db_syncer
+        db_syncer.put_db_sync_state("full")
+        try:
+            header = db_syncer.sync_db_by_snapshot(MockedClient())
+            self.assertEqual(123, header.binlog_seq)
+            self.assertEqual(123, db_syncer.get_binlog_last_seq())
+            self.assertEqual("binlog", db_syncer.get_db_sync_state())
+            self.assertEqual("Bob", dbutil.get("test_sync_snap:2")["name"])
+            self.assertFalse(os.path.exists(db_syncer.get_snapshot_path()))
+        finally:
+            db_syncer.put_db_sync_state("full")
+
+    def test_http_download_resume(self):
+        import threading
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+
+        content = b"0123456789" * 1000
+
+        class RangeHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                http_range = self.headers.get("Range")
+                data = content
+                if http_range != None:
+                    start, end = http_range.replace("bytes=", "").split("-")
+                    data = content[int(start):int(end)+1]
+                    self.send_response(206)
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), RangeHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = "http://127.0.0.1:%s/file" % server.server_port
+            dest_path = os.path.join(xconfig.TMP_DIR, "download_resume_test.part")
+            with open(dest_path, "wb") as fp:
+                fp.write(content[:3000])
+
+            readsize = netutil.http_download_resume(url, dest_path, total_size=len(content))
+            self.assertEqual(7000, readsize)
+            with open(dest_path, "rb") as fp:
+                self.assertEqual(content, fp.read())
+            # 已经下载完成
+            self.assertEqual(0, netutil.http_download_resume(url, dest_path, total_size=len(content)))
+
+            # 远程文件的版本变了, 已经下载的部分丢弃
+            with open(dest_path, "wb") as fp:
+                fp.write(b"x" * 3000)
+            netutil.http_download_resume(url, dest_path, total_size=len(content), validator="v1")
+            with open(dest_path, "wb") as fp:
+                fp.write(b"x" * 3000)
+            readsize = netutil.http_download_resume(url, dest_path, total_size=len(content), validator="v2")
+            self.assertEqual(len(content), readsize)
+            with open(dest_path, "rb") as fp:
+                self.assertEqual(content, fp.read())
+            fsutil.rmfile(dest_path + ".validator", hard = True)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_download_files_by_hash(self):
+        from handlers.system.system_sync.system_sync_indexer import build_index_by_fpath
+        from handlers.system.system_sync.system_sync_proxy import HttpClient, download_stat
+
+        src_path = os.path.join(xconfig.FileConfig.data_dir, "files", "sync_hash_src.txt")
+        fsutil.makedirs(os.path.dirname(src_path))
+        with open(src_path, "w") as fp:
+            fp.write("sync hash test")
+        file_info = build_index_by_fpath(src_path)
+        self.assertEqual(fsutil.get_file_hash(src_path), file_info.fhash)
+
+        item = dict(webpath="/data/files/sync_hash_dest/renamed.txt", fpath="/leader/renamed.txt",
+                    fsize=file_info.fsize, mtime=file_info.mtime, ftype="txt", fhash=file_info.fhash)
+        client = HttpClient("http://127.0.0.1:1", "token", "admin_token")
+        dest_path = client.get_dest_path(item["webpath"])
+        fsutil.rmfile(dest_path, hard=True)
+        copied = download_stat.copied
+        client.download_files(xutils.Storage(data=[item]))
+
+        self.assertEqual(copied + 1, download_stat.copied)
+        self.assertTrue(os.path.exists(dest_path))
+        self.assertTrue(client.is_same_file(dest_path, FileIndexInfo(**item)))
+
+        fsutil.rmfile(dest_path, hard=True)
+        fsutil.rmfile(src_path, hard=True)
@@ -43,3 +43,54 @@ class TestMain(unittest.TestCase):
         
         xmanager.fire('test', ctx)
         self.assertEqual(True, ctx.test)
+
+    def test_executor_lane(self):
+        from xutils.executor_util import TaskExecutor
+        executor = TaskExecutor()
+        executor.add_lane("test", worker_count=1, max_queue_size=1)
+        result = []
+
+        def my_task(value):
+            result.append(value)
+
+        # 工作线程未启动, 队列满了在当前线程执行
+        self.assertEqual(True, executor.submit(my_task, (1,), lane="test", key="my_task"))
+        self.assertEqual(False, executor.submit(my_task, (2,), lane="test", key="my_task"))
+        self.assertEqual([2], result)
+
+        executor.start("test")
+        executor.wait_done()
+        self.assertEqual([2, 1], result)
+
+        lane_stat = executor.lane_stats()[0]
+        self.assertEqual(1, lane_stat.rejected)
+        task_stat = executor.stats()[0]
+        self.assertEqual("my_task", task_stat.key)
+        self.assertEqual(2, task_stat.count)
+        self.assertEqual(1, task_stat.caller_runs)
+
+    def test_event_stat(self):
+        xmanager.remove_event_handlers('test_stat')
+
+        @xmanager.listen("test_stat", is_async = False)
+        def my_stat_handler(ctx):
+            if ctx.fail:
+                raise Exception("test")
+
+        xmanager.fire("test_stat", Storage(fail=False))
+        xmanager.fire("test_stat", Storage(fail=True))
+        stat_list = xmanager.EventStat.list_stats("test_stat")
+        self.assertEqual(1, len(stat_list))
+        self.assertEqual(2, stat_list[0].count)
+        self.assertEqual(1, stat_list[0].failed)
+
+    def test_latency_histogram(self):
+        from xutils.perf_util import LatencyHistogram
+        histogram = LatencyHistogram()
+        for i in range(100):
+            histogram.add(1)
+        histogram.add(300)
+        self.assertEqual(1, histogram.percentile(0.5))
+        self.assertEqual(1, histogram.percentile(0.95))
+        self.assertEqual(300, histogram.percentile(1.0))
+        self.assertEqual(300, histogram.max_ms)
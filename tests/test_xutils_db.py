@@ -276,6 +276,155 @@ class TestMain(BaseTestCase):
         db = SqliteKV(db_file)
         run_test_db_engine(self, db)
 
+    def test_dbutil_sqlite_stream(self):
+        from xutils.db.driver_sqlite import SqliteKV
+        db_file = os.path.join(xconfig.DB_DIR, "sqlite", "test_stream.db")
+        db = SqliteKV(db_file, config_dict=dict(sqlite_range_page_size=2))
+        db.range_stream = True
+        run_test_db_engine(self, db)
+
+        # 分页模式
+        db.range_stream = False
+        run_test_db_engine(self, db)
+
+    def test_dbutil_sqlite_write_batch(self):
+        from xutils.db.driver_sqlite import SqliteKV
+        db_file = os.path.join(xconfig.DB_DIR, "sqlite", "test_batch.db")
+        db = SqliteKV(db_file)
+
+        for upsert_supported in (True, False):
+            # 不支持UPSERT语法时使用 UPDATE + INSERT OR IGNORE
+            db.upsert_supported = upsert_supported
+            db.Put(b"batch:1", b"old")
+            db.Put(b"batch:3", b"to_delete")
+
+            batch = MockedWriteBatch()
+            for i in range(1000):
+                batch.put(b"batch:%04d" % i, b"value%d" % i)
+            batch.put(b"batch:1", b"new")
+            batch.put(b"batch:3", None)
+            db.Write(batch)
+
+            self.assertEqual(b"new", db.Get(b"batch:1"))
+            self.assertEqual(None, db.Get(b"batch:3"))
+            self.assertEqual(b"value999", db.Get(b"batch:0999"))
+            self.assertEqual(1001, db.Count(b"batch:", b"batch:\xff"))
+
+            batch = MockedWriteBatch()
+            for key in db.RangeIter(b"batch:", b"batch:\xff", include_value=False):
+                batch.delete(key)
+            db.Write(batch)
+            self.assertEqual(0, db.Count(b"batch:", b"batch:\xff"))
+
+    def test_dbutil_sqlite_key_filter(self):
+        from xutils.db.driver_sqlite import SqliteKV
+        db_file = os.path.join(xconfig.DB_DIR, "sqlite", "test_key_filter.db")
+        if os.path.exists(db_file):
+            os.remove(db_file)
+        db = SqliteKV(db_file)
+        db.Put(b"filter:1", b"1")
+
+        # 第一次检查的时候加载
+        self.assertTrue(db.MayExist(b"filter:1"))
+        self.assertFalse(db.MayExist(b"filter:2"))
+
+        for upsert_supported in (True, False):
+            db.upsert_supported = upsert_supported
+            batch = MockedWriteBatch()
+            for i in range(3000):
+                batch.put(b"filter:new%04d" % i, b"value")
+            db.Write(batch)
+            self.assertEqual(b"value", db.Get(b"filter:new2999"))
+            self.assertEqual(3001, db.Count(b"filter:", b"filter:\xff"))
+            self.assertTrue(db.MayExist(b"filter:new0000"))
+
+        # 写入超过容量以后重新加载
+        self.assertFalse(db.MayExist(b"filter:not_exists"))
+        stats = db.GetKeyFilterStats()
+        table_stats = stats.tables[0]
+        self.assertEqual("filter", table_stats.table_name)
+        self.assertEqual(3001, table_stats.key_count)
+        self.assertTrue(table_stats.loads >= 2)
+        self.assertTrue(stats.memory > 0)
+
+        # 一定不存在的key跳过查询
+        dbutil.register_table("filter", "key过滤器测试")
+        batch = dbutil.create_write_batch(db_instance=db)
+        batch.check_and_put("filter:x", 1)
+        batch.check_and_delete("filter:y")
+        self.assertEqual(table_stats.skipped + 2, db.GetKeyFilterStats().tables[0].skipped)
+
+    def test_dbutil_key_filter_load_without_lock(self):
+        import threading
+        from xutils.db.dbutil_key_filter import KeyExistsFilter
+        from xutils.db.driver_sqlite import SqliteKV
+
+        def load_keys(table_name):
+            yield b"t:1"
+            # 模拟加载期间其他线程提交的写入
+            key_filter.on_put(b"t:new")
+            # 加载期间的检查不会等待
+            self.assertTrue(key_filter.may_exist(b"t:other"))
+            yield b"t:2"
+
+        key_filter = KeyExistsFilter(load_keys, lambda table_name: 2, recent_size=0)
+        self.assertFalse(key_filter.may_exist(b"t:3"))
+        self.assertTrue(key_filter.may_exist(b"t:1"))
+        self.assertTrue(key_filter.may_exist(b"t:2"))
+        # 加载期间写入的key也在过滤器里面
+        self.assertTrue(key_filter.may_exist(b"t:new"))
+        self.assertEqual(1, key_filter.stats().tables[0].loads)
+
+        # 检查和加载过滤器不需要写锁
+        db_file = os.path.join(xconfig.DB_DIR, "sqlite", "test_key_filter_lock.db")
+        if os.path.exists(db_file):
+            os.remove(db_file)
+        db = SqliteKV(db_file)
+        db.Put(b"filter:1", b"1")
+        result = []
+        thread = threading.Thread(target=lambda: result.append(db.MayExist(b"filter:2")))
+        with SqliteKV._lock:
+            thread.start()
+            thread.join(timeout=5)
+            self.assertEqual([False], result)
+        thread.join()
+
+    def test_dbutil_sqlite_snapshot(self):
+        from xutils.db.driver_sqlite import SqliteKV, SqliteSnapshot
+        db_file = os.path.join(xconfig.DB_DIR, "sqlite", "test_snapshot.db")
+        for path in (db_file, db_file + "-wal", db_file + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        db = SqliteKV(db_file, config_dict=dict(sqlite_journal_mode="wal"))
+        for i in range(10):
+            db.Put(b"snapshot:%02d" % i, b"v1")
+
+        snapshot = db.CreateSnapshot()
+        assert isinstance(snapshot, SqliteSnapshot)
+        try:
+            # 快照期间的写入不会被阻塞, 也不会出现在快照里面
+            iterator = snapshot.RangeIter(b"snapshot:", b"snapshot:\xff")
+            self.assertEqual((b"snapshot:00", b"v1"), next(iterator))
+            db.Put(b"snapshot:00", b"v2")
+            db.Put(b"snapshot:99", b"v2")
+            db.Delete(b"snapshot:05")
+            rest = list(iterator)
+            self.assertEqual(9, len(rest))
+            self.assertTrue(all([value == b"v1" for key, value in rest]))
+
+            self.assertEqual(b"v1", snapshot.Get(b"snapshot:00"))
+            self.assertEqual(None, snapshot.Get(b"snapshot:99"))
+            self.assertEqual(10, snapshot.Count(b"snapshot:", b"snapshot:\xff"))
+            self.assertEqual(2, len(snapshot.BatchGet([b"snapshot:05", b"snapshot:09", b"snapshot:99"])))
+            self.assertEqual(b"v2", db.Get(b"snapshot:00"))
+        finally:
+            db.ReleaseSnapshot(snapshot)
+
+        # DELETE模式下读事务会阻塞写入, 不创建快照
+        db_file2 = os.path.join(xconfig.DB_DIR, "sqlite", "test_snapshot_delete.db")
+        db2 = SqliteKV(db_file2)
+        self.assertTrue(db2.CreateSnapshot() is db2)
+
     def test_dbutil_leveldbpy(self):
         if not xutils.is_windows():
             return
@@ -677,6 +826,72 @@ class TestMain(BaseTestCase):
         index_count = db.count_by_index("age")
         self.assertEqual(1, index_count)
 
+    def test_db_bulk_rebuild_index(self):
+        dbutil.register_table("index_bulk_test", "批量索引测试")
+        dbutil.register_table_index("index_bulk_test", "age")
+        dbutil.register_table_index("index_bulk_test", "name", index_type="copy")
+
+        db = dbutil.get_table("index_bulk_test")
+        for item in db.iter(limit=-1):
+            db.delete(item)
+
+        # 直接写入主数据, 不维护索引
+        batch = dbutil.create_write_batch()
+        for i in range(10):
+            batch.put("index_bulk_test:%020d" % (i+1), dict(name="user%d" % i, age=20+i%2))
+        batch.commit()
+        # 无效的旧索引
+        dbutil.put("index_bulk_test$age:invalid:1", "index_bulk_test:invalid", check_table=False)
+
+        builder = db.bulk_rebuild_index()
+        self.assertEqual(10, builder.record_count)
+        self.assertEqual(20, builder.index_count)
+        self.assertEqual(10, db.count_by_index("age"))
+        self.assertEqual(5, len(db.list_by_index("age", index_value=20, limit=20)))
+        result = db.list_by_index("name", index_value="user3")
+        self.assertEqual(21, result[0].age)
+
+    def test_db_index_repair_job(self):
+        dbutil.register_table("index_job_test", "增量修复索引测试")
+        dbutil.register_table_index("index_job_test", "age")
+        dbutil.register_table_index("index_job_test", "name", index_type="copy")
+
+        db = dbutil.get_table("index_job_test")
+        for item in db.iter(limit=-1):
+            db.delete(item)
+
+        # 直接写入主数据, 不维护索引
+        batch = dbutil.create_write_batch()
+        for i in range(25):
+            batch.put("index_job_test:%020d" % (i+1), dict(name="user%d" % i, age=20+i%2))
+        batch.commit()
+        dbutil.put("index_job_test$age:invalid:1", "index_job_test:invalid", check_table=False)
+
+        state = dbutil.start_index_repair("index_job_test")
+        self.assertFalse(state.done)
+
+        # 每次只处理一批, 进度保存在检查点里面
+        job = db.create_repair_job(chunk_size=10)
+        while job.state.phase == "index":
+            job.run_chunk()
+        job.save_checkpoint()
+        self.assertEqual(1, job.state.index_count)
+        self.assertEqual(None, dbutil.get("index_job_test$age:invalid:1"))
+        self.assertEqual(0, db.count_by_index("age"))
+
+        job = db.create_repair_job(chunk_size=10)
+        self.assertTrue(job.is_running())
+        self.assertEqual(1, job.state.index_count)
+        self.assertTrue(job.run(max_seconds=10))
+        self.assertEqual(25, job.state.record_count)
+        self.assertEqual(25, db.count_by_index("age"))
+        result = db.list_by_index("name", index_value="user3")
+        self.assertEqual(21, result[0].age)
+
+        states = [item for item in dbutil.list_index_repair_states() if item.table_name == "index_job_test"]
+        self.assertTrue(states[0].done)
+        self.assertEqual([], [item for item in dbutil.run_index_repair_jobs() if item.table_name == "index_job_test"])
+
     def test_record_lock(self):
         print("test_record_lock")
         from xutils.db.lock import RecordLock
@@ -781,6 +996,140 @@ class TestMain(BaseTestCase):
 
         self.assertEqual(10, len(binlog.list(0, limit=20)))
 
+    def test_binlog_segment(self):
+        binlog = BinLog.get_instance()
+        binlog.set_enabled(True)
+        old_segment_size = binlog._segment_size
+        old_seal_grace = binlog._seal_grace_seconds
+        BinLog.set_segment_size(10, seal_grace_seconds=0)
+        BinLog.set_max_size(25)
+        try:
+            binlog.delete_expired()
+            start_seq = binlog.last_seq + 1
+            for i in range(45):
+                binlog.add_log("put", "test_binlog_segment:%d" % i)
+            binlog.seal_segments()
+
+            segments = binlog.get_segments()
+            self.assertTrue(len(segments) >= 4)
+            self.assertTrue(binlog.count_tail_size() < 10)
+            
+            # 跨分段和尾部读取, 顺序保持不变
+            logs = binlog.list(start_seq + 5, limit=30)
+            self.assertEqual(["test_binlog_segment:%d" % i for i in range(5, 35)], [x.key for x in logs])
+            self.assertEqual("test_binlog_segment:44", binlog.get_last_log().key)
+
+            # 整个分段删除
+            binlog.delete_expired()
+            size = binlog.count_size()
+            self.assertTrue(25 <= size < 35)
+            self.assertEqual(binlog.get_segments()[0].start_seq, binlog.find_start_seq())
+            self.assertEqual(size, len(binlog.list(0, limit=100)))
+        finally:
+            BinLog.set_segment_size(old_segment_size, seal_grace_seconds=old_seal_grace)
+            BinLog.set_max_size(1000)
+            seg_keys = [key for key, value in dbutil.prefix_iter("_binlog_seg", include_key=True)]
+            dbutil.db_batch_delete(seg_keys)
+            binlog.reset_segment_index()
+
+    def test_binlog_segment_gap(self):
+        binlog = BinLog.get_instance()
+        binlog.set_enabled(True)
+        old_segment_size = binlog._segment_size
+        old_seal_grace = binlog._seal_grace_seconds
+        BinLog.set_segment_size(10, seal_grace_seconds=0)
+        BinLog.set_max_size(1000)
+        try:
+            for i in range(5):
+                binlog.add_log("put", "test_binlog_segment_gap:%d" % i)
+            binlog.seal_segments()
+            BinLog.set_segment_size(10, seal_grace_seconds=3600)
+
+            # 批量操作分配了ID但是还没有提交
+            batch = dbutil.create_write_batch()
+            binlog.add_log("put", "test_binlog_segment_gap:uncommitted", batch=batch)
+            for i in range(25):
+                binlog.add_log("put", "test_binlog_segment_gap:%d" % i)
+            segments_before = list(binlog.get_segments())
+            binlog.seal_segments()
+            self.assertEqual(segments_before, binlog.get_segments())
+
+            batch.commit()
+            binlog.seal_segments()
+            segments = binlog.get_segments()
+            self.assertTrue(len(segments) > len(segments_before))
+            keys = [x.key for x in binlog.list(segments[0].start_seq, limit=1000)]
+            self.assertTrue("test_binlog_segment_gap:uncommitted" in keys)
+            for prev, seg in zip(segments, segments[1:]):
+                self.assertEqual(prev.end_seq + 1, seg.start_seq)
+
+            # 超过等待时间才提交的binlog保留在尾部, 不会被删除
+            BinLog.set_segment_size(10, seal_grace_seconds=0)
+            late_batch = dbutil.create_write_batch()
+            binlog.add_log("put", "test_binlog_segment_gap:late", batch=late_batch)
+            for i in range(25):
+                binlog.add_log("put", "test_binlog_segment_gap:%d" % i)
+            binlog.seal_segments()
+            late_batch.commit()
+            binlog.seal_segments()
+            tail_keys = [binlog._unpack_record(x).key for x in dbutil.prefix_list("_binlog")]
+            self.assertTrue("test_binlog_segment_gap:late" in tail_keys)
+        finally:
+            BinLog.set_segment_size(old_segment_size, seal_grace_seconds=old_seal_grace)
+            seg_keys = [key for key, value in dbutil.prefix_iter("_binlog_seg", include_key=True)]
+            dbutil.db_batch_delete(seg_keys)
+            binlog.reset_segment_index()
+
+    def test_binlog_iter_while_sealing(self):
+        binlog = BinLog.get_instance()
+        binlog.set_enabled(True)
+        old_segment_size = binlog._segment_size
+        old_seal_grace = binlog._seal_grace_seconds
+        BinLog.set_segment_size(10, seal_grace_seconds=0)
+        # 写入的时候不自动封存, 在遍历的过程中手动封存
+        binlog.seal_segments_async = lambda: None
+        try:
+            binlog.seal_segments()
+            start_seq = binlog.last_seq + 1
+            for i in range(15):
+                binlog.add_log("put", "test_binlog_iter_while_sealing:%d" % i)
+            binlog.seal_segments()
+            segment_count = len(binlog.get_segments())
+            for i in range(15, 35):
+                binlog.add_log("put", "test_binlog_iter_while_sealing:%d" % i)
+
+            # 读取到分段中间的时候, 尾部被封存成新的分段
+            iterator = binlog.iter_logs(start_seq)
+            seq_list = [next(iterator)[0]]
+            binlog.seal_segments()
+            self.assertTrue(len(binlog.get_segments()) > segment_count)
+            for seq, log in iterator:
+                seq_list.append(seq)
+            self.assertEqual(list(range(start_seq, start_seq + 35)), seq_list)
+        finally:
+            del binlog.seal_segments_async
+            BinLog.set_segment_size(old_segment_size, seal_grace_seconds=old_seal_grace)
+            seg_keys = [key for key, value in dbutil.prefix_iter("_binlog_seg", include_key=True)]
+            dbutil.db_batch_delete(seg_keys)
+            binlog.reset_segment_index()
+
+    def test_binlog_seal_async_single_worker(self):
+        import threading
+        binlog = BinLog.get_instance()
+
+        def count_sealer():
+            return len([x for x in threading.enumerate() if x.name == "BinlogSealer"])
+
+        with binlog._delete_lock:
+            for i in range(20):
+                binlog.seal_segments_async()
+            # 一个线程在执行(等待锁), 最多再有一个在排队
+            self.assertTrue(count_sealer() <= 2)
+
+        for thread in threading.enumerate():
+            if thread.name == "BinlogSealer":
+                thread.join()
+
     def test_deque_1(self):
         dbutil.register_table("deque_test", "deque测试")
 
@@ -938,6 +1287,52 @@ class TestMain(BaseTestCase):
         count = cache.clear_expired()
         assert count > 0
 
+    def test_db_object_cache(self):
+        from xutils.db.dbutil_cache import KvObjectCache
+        from xutils.db.dbutil_base import KvDataBase
+        old_cache = KvDataBase.cache
+        object_cache = KvObjectCache(old_cache, max_bytes=200)
+        dbutil.set_db_cache(object_cache)
+        try:
+            dbutil.put("test:object_cache_1", dict(name="a", tags=["x"]))
+            self.assertEqual("a", dbutil.get("test:object_cache_1").name)
+            # 第二次读取命中缓存, 修改返回值不影响缓存
+            value = dbutil.get("test:object_cache_1")
+            value.tags.append("y")
+            self.assertEqual(["x"], dbutil.get("test:object_cache_1").tags)
+            self.assertEqual(2, object_cache.stats().hits)
+
+            # 写入后失效
+            dbutil.put("test:object_cache_1", dict(name="b"))
+            self.assertEqual("b", dbutil.get("test:object_cache_1").name)
+
+            batch = dbutil.create_write_batch()
+            batch.put("test:object_cache_1", dict(name="c"))
+            batch.commit()
+            result = dbutil.db_batch_get(["test:object_cache_1"])
+            self.assertEqual("c", result["test:object_cache_1"].name)
+
+            dbutil.delete("test:object_cache_1")
+            self.assertIsNone(dbutil.get("test:object_cache_1"))
+
+            # 超过容量后淘汰最久未访问的
+            for i in range(20):
+                dbutil.put("test:object_cache_%d" % i, dict(value="x" * 20))
+                dbutil.get("test:object_cache_%d" % i)
+            stats = object_cache.stats()
+            assert stats.size <= 200
+            assert stats.evictions > 0
+
+            # 读取期间发生写入不缓存
+            version = object_cache.get_version()
+            object_cache.delete_object("test:object_cache_99")
+            object_cache.put_object("test:object_cache_99", 1, version)
+            self.assertEqual((False, None), object_cache.get_object("test:object_cache_99"))
+        finally:
+            dbutil.set_db_cache(old_cache)
+            for i in range(20):
+                dbutil.delete("test:object_cache_%d" % i)
+
     def test_kv_set(self):
         from xutils.db.dbutil_set import KvSetTable
         dbutil.register_table("set_test", "set test")
@@ -0,0 +1,71 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 14:20:05
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 14:20:05
+@FilePath     : /xnote/tools/benchmark-sqlite-kv.py
+@Description  : sqlite KV批量写入的性能测试
+"""
+
+import sys
+import os
+import time
+import sqlite3
+import tempfile
+
+sys.path.append(".")
+sys.path.append("./lib")
+
+from xutils.db.driver_sqlite import SqliteKV
+from xutils.db.dbutil_base import WriteBatchProxy
+
+BATCH_SIZE_LIST = [1000, 10000, 100000]
+
+def build_batch(db, size, version=0):
+    batch = WriteBatchProxy(db_instance=db)
+    for i in range(size):
+        key = b"bench%d:%010d" % (size, i)
+        value = b'{"id":%d,"version":%d}' % (i, version)
+        batch.put_bytes(key, value)
+    return batch
+
+def bench_write(db, size, version=0):
+    batch = build_batch(db, size, version)
+    start_time = time.time()
+    batch.commit()
+    return time.time() - start_time
+
+def bench_put(db, size):
+    start_time = time.time()
+    for i in range(size):
+        db.Put(b"single:%010d" % i, b'{"id":%d}' % i)
+    return time.time() - start_time
+
+def format_qps(size, cost_time):
+    if cost_time <= 0:
+        return "-"
+    return "%.0f" % (size / cost_time)
+
+def main():
+    with tempfile.TemporaryDirectory() as dirname:
+        db_file = os.path.join(dirname, "bench.db")
+        db = SqliteKV(db_file, debug=False)
+        print("sqlite_version: %s, upsert_supported: %s" % (sqlite3.sqlite_version, SqliteKV.upsert_supported))
+        print("%-10s %-12s %-12s" % ("batch", "insert(/s)", "update(/s)"))
+
+        for size in BATCH_SIZE_LIST:
+            insert_cost = bench_write(db, size, version=0)
+            update_cost = bench_write(db, size, version=1)
+            print("%-10d %-12s %-12s" % (size, format_qps(size, insert_cost), format_qps(size, update_cost)))
+
+        single_size = 1000
+        put_cost = bench_put(db, single_size)
+        print("single Put x%d: %s/s" % (single_size, format_qps(single_size, put_cost)))
+        db.Close()
+
+if __name__ == "__main__":
+    main()
+
+# usage: python tools/benchmark-sqlite-kv.py
@@ -1,5 +1,11 @@
 # encoding=utf-8
+"""生成缩略图
+- image-thumbnail.py <path>  输出base64编码的缩略图
+- image-thumbnail.py --worker 常驻进程模式, 每行输入一个JSON任务 {"src":"源文件","dest":"缩略图文件"}, 每行输出 ok/fail
+"""
+import os
 import sys
+import json
 import logging
 import base64
 import traceback
@@ -37,7 +43,34 @@ def create_thumbnail(img_path):
         traceback.print_exc()
         return None
 
-if __name__ == "__main__":
+def save_thumbnail(src, dest):
+    data = create_thumbnail(src)
+    if data == None:
+        return False
+    # 先写临时文件再重命名, 其他进程不会读到写了一半的缩略图
+    tmp_path = "%s.%d.tmp" % (dest, os.getpid())
+    with open(tmp_path, "wb") as fp:
+        fp.write(data)
+    os.replace(tmp_path, dest)
+    return True
+
+def run_worker():
+    for line in sys.stdin:
+        line = line.strip()
+        if line == "":
+            continue
+        try:
+            task = json.loads(line)
+            ok = save_thumbnail(task["src"], task["dest"])
+        except:
+            traceback.print_exc()
+            ok = False
+        sys.stdout.write("ok\n" if ok else "fail\n")
+        sys.stdout.flush()
+
+if __name__ == "__main__" and sys.argv[1:] == ["--worker"]:
+    run_worker()
+elif __name__ == "__main__":
     path = sys.argv[1]
     data = create_thumbnail(path)
     if data != None:
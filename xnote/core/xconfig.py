@@ -229,6 +229,16 @@ class FileConfig:
     ext_handlers_dir = "./ext_handlers"
 
     db_backup_expire_days = 5
+    # 全量备份的间隔(天), 间隔内只做增量备份
+    db_backup_base_interval_days = 3
+    # sqlite使用在线备份接口按页复制
+    db_backup_online = True
+    # 生成缩略图的常驻进程数量, 0表示在当前进程生成
+    thumbnail_workers = 2
+    # 缩略图缓存的过期天数
+    thumbnail_cache_expire_days = 90
+    # 文件索引并发扫描目录的线程数
+    fs_index_workers = 4
 
     template_base_nav_left = "" # 左侧菜单自定义模板
     template_base_nav_top = ""
@@ -261,6 +271,11 @@ class FileConfig:
         cls.record_db_file = cls.get_db_path(cls.record_db_name)
         cls.kv_db_file = cls.get_db_path("kv_store")
         cls.db_backup_expire_days = SystemConfig.get_int("db_backup_expire_days", 5)
+        cls.db_backup_base_interval_days = SystemConfig.get_int("db_backup_base_interval_days", 3)
+        cls.db_backup_online = SystemConfig.get_bool("db_backup_online", True)
+        cls.thumbnail_workers = SystemConfig.get_int("thumbnail_workers", 2)
+        cls.thumbnail_cache_expire_days = SystemConfig.get_int("thumbnail_cache_expire_days", 90)
+        cls.fs_index_workers = SystemConfig.get_int("fs_index_workers", 4)
         cls.plugins_dir = os.path.join(cls.data_dir, "scripts", "plugins")
         cls.plugins_upload_dir = os.path.join(cls.plugins_dir, "upload")
 
@@ -316,6 +331,19 @@ class WebConfig:
     # 定时任务开关
     cron_enabled = True
 
+    # 异步任务配置, 事件处理和其他异步任务使用不同的线程
+    async_event_workers = 2
+    async_default_workers = 2
+    async_queue_size = 500
+
+    # 搜索处理器并发执行的配置
+    search_parallel = True
+    search_workers = 8
+    search_handler_timeout_ms = 1000
+
+    # 从节点同步文件的并发下载数
+    fs_sync_workers = 4
+
     @classmethod
     def init(cls):
         cls.server_home = SystemConfig.get_str("server_home", "")
@@ -335,6 +363,13 @@ class WebConfig:
         cls.sync_files_from_leader = SystemConfig.get_bool("sync_files_from_leader", False)
         
         cls.cron_enabled = SystemConfig.get_bool("cron_enabled", True)
+        cls.async_event_workers = SystemConfig.get_int("async_event_workers", 2)
+        cls.async_default_workers = SystemConfig.get_int("async_default_workers", 2)
+        cls.async_queue_size = SystemConfig.get_int("async_queue_size", 500)
+        cls.search_parallel = SystemConfig.get_bool("search_parallel", True)
+        cls.search_workers = SystemConfig.get_int("search_workers", 8)
+        cls.search_handler_timeout_ms = SystemConfig.get_int("search_handler_timeout_ms", 1000)
+        cls.fs_sync_workers = SystemConfig.get_int("fs_sync_workers", 4)
     
     @classmethod
     def load_nav_list(cls):
@@ -415,6 +450,12 @@ class DatabaseConfig:
     block_cache_size = 16 * 1024**2
     write_buffer_size = 4 * 1024**2
     max_open_files = 1000
+    # KV读取对象的缓存大小(字节), 0表示不开启
+    db_object_cache_size = 16 * 1024**2
+    # 后台修复索引每秒处理的记录数, 0表示不限速
+    db_index_repair_ops = 200
+    # 后台修复索引每分钟最多执行的秒数
+    db_index_repair_tick_seconds = 20
 
     # mysql相关配置
     mysql_cloud_type="" # mysql云服务类型
@@ -423,6 +464,12 @@ class DatabaseConfig:
     # sqlite配置 { DELETE, TRUNCATE, PERSIST, WAL, MEMORY, OFF }
     sqlite_journal_mode = "delete"
     sqlite_page_size = 0
+    # KV区间查询每次读取的行数
+    sqlite_range_page_size = 100
+    # KV区间查询使用流式游标(只在WAL模式下生效)
+    sqlite_range_stream = True
+    # KV写入前的检查使用布隆过滤器跳过一定不存在的key
+    sqlite_key_filter = True
     
     # ssdb相关配置
     ssdb_host = ""
@@ -443,11 +490,17 @@ class DatabaseConfig:
         cls.block_cache_size = SystemConfig.get_int("block_cache_size")
         cls.write_buffer_size = SystemConfig.get_int("write_buffer_size")
         cls.max_open_files = SystemConfig.get_int("max_open_files")
+        cls.db_object_cache_size = SystemConfig.get_int("db_object_cache_size", 16 * 1024**2)
         cls.db_profile_table_proxy = SystemConfig.get_int("db_profile_table_proxy")
         cls.db_sys_log_max_size = SystemConfig.get_int("db_sys_log_max_size", 100000)
+        cls.db_index_repair_ops = SystemConfig.get_int("db_index_repair_ops", 200)
+        cls.db_index_repair_tick_seconds = SystemConfig.get_int("db_index_repair_tick_seconds", 20)
 
         cls.sqlite_journal_mode = SystemConfig.get_str("sqlite_journal_mode", "delete")
         cls.sqlite_page_size = SystemConfig.get_int("sqlite_page_size", 0)
+        cls.sqlite_range_page_size = SystemConfig.get_int("sqlite_range_page_size", 100)
+        cls.sqlite_range_stream = SystemConfig.get_bool("sqlite_range_stream", True)
+        cls.sqlite_key_filter = SystemConfig.get_bool("sqlite_key_filter", True)
 
         cls.ssdb_host = SystemConfig.get_str("ssdb_host", "127.0.0.1")
         cls.ssdb_port = SystemConfig.get_int("ssdb_port", 8888)
@@ -21,10 +21,11 @@ import xutils
 import threading
 import logging
 import xnote_migrate
-from collections import deque
 from threading import Thread
 from xutils import Storage
 from xutils import logutil
+from xutils import executor_util
+from xutils.perf_util import LatencyHistogram
 from xutils import tojson, MyStdout, cacheutil, u, dbutil, fsutil
 
 __version__ = "1.0"
@@ -32,19 +33,24 @@ __author__ = "xupingmao (578749341@qq.com)"
 __copyright__ = "(C) 2016-2021 xupingmao. GNU GPL 3."
 __contributors__ = []
 
-dbutil.register_table("schedule", "任务调度表 <schedule:id>")
+dbutil.register_table("schedule", "任务调度表 <schedule:id>", binlog=True)
 
 TASK_POOL_SIZE = 500
+# 异步任务的通道, 事件处理和其他异步任务分开执行, 日志任务在 logutil.LOG_LANE
+EVENT_LANE = "event"
+DEFAULT_LANE = "default"
 LOCK = threading.RLock()
 _event_logger = logutil.new_mem_logger("xmanager.event")
-_async_logger = logutil.new_mem_logger("xmanager.async")
-_debug_logger = logutil.new_mem_logger("xmanager.debug")
 _error_logger = logutil.new_mem_logger("xmanager.error")
 
 # 对外接口
 _manager = None # type: HandlerManager
 _event_manager = None # type: EventManager
 
+_executor = executor_util.get_executor()
+_executor.add_lane(EVENT_LANE, worker_count=2, max_queue_size=TASK_POOL_SIZE)
+_executor.add_lane(DEFAULT_LANE, worker_count=2, max_queue_size=TASK_POOL_SIZE)
+
 
 class HandlerLocal:
 
@@ -517,9 +523,8 @@ class CronTaskManager:
         self.do_load_tasks()
 
         if not self.thread_started and xconfig.WebConfig.cron_enabled:
-            # 任务队列处理线程，开启两个线程
-            WorkerThread("WorkerThread-1").start()
-            WorkerThread("WorkerThread-2").start()
+            # 任务队列处理线程
+            start_executor()
 
             # 定时任务调度线程
             CronTaskThread(run).start()
@@ -588,49 +593,68 @@ class SyncTaskThread(Thread):
             quick_sleep(sleep_seconds)
 
 
-class WorkerThread(Thread):
-    """执行任务队列的线程，内部有一个队列，所有线程共享"""
+class EventStat:
+    """事件处理器的耗时统计, 按照 (event_type, key) 保存, 重新加载模块后保留"""
 
-    # deque是线程安全的
-    _task_queue = deque()
+    _stats = dict() # type: dict[tuple[str, str], EventStat]
+    # 超过这个耗时(毫秒)的调用记录到 xmanager.event 日志
+    slow_threshold_ms = 100
 
-    def __init__(self, name="WorkerThread"):
-        super(WorkerThread, self).__init__()
-        self.daemon = True
-        self.name = name
+    def __init__(self, event_type="", key=""):
+        self.event_type = event_type
+        self.key = key
+        self.is_async = False
+        self.failed = 0
+        self.histogram = LatencyHistogram()
 
-    def run(self):
-        while True:
-            # queue.Queue默认是block模式
-            # 但是deque没有block模式，popleft可能抛出IndexError异常
-            try:
-                if self._task_queue:
-                    func, args, kw = self._task_queue.popleft()
+    @classmethod
+    def get(cls, event_type="", key=""):
+        stat_key = (event_type, key)
+        stat = cls._stats.get(stat_key)
+        if stat == None:
+            with LOCK:
+                stat = cls._stats.get(stat_key)
+                if stat == None:
+                    stat = EventStat(event_type, key)
+                    cls._stats[stat_key] = stat
+        return stat
 
-                    _async_logger.log("qsize:(%d), execute:(%s)",
-                                      len(self._task_queue), func)
+    @classmethod
+    def list_stats(cls, event_type=None):
+        result = []
+        for stat in list(cls._stats.values()):
+            if event_type != None and stat.event_type != event_type:
+                continue
+            item = stat.histogram.to_dict()
+            item.event_type = stat.event_type
+            item.key = stat.key
+            item.is_async = stat.is_async
+            item.failed = stat.failed
+            result.append(item)
+        return result
 
-                    func(*args, **kw)
-                else:
-                    time.sleep(0.01)
-            except Exception as e:
-                err = xutils.print_exc()
-                _async_logger.log("exception: %s", err)
+    @classmethod
+    def reset_all(cls):
+        for stat in list(cls._stats.values()):
+            stat.failed = 0
+            stat.histogram.reset()
 
-    @staticmethod
-    def add_task(func, args, kw):
-        _async_logger.log("add_task, key:(%s)", func)
-        WorkerThread._task_queue.append([func, args, kw])
+    def add(self, cost_ms=0.0):
+        self.histogram.add(cost_ms)
+        if cost_ms >= self.slow_threshold_ms:
+            _event_logger.log("event:(%s), key:(%s), cost_time:(%.2fms)",
+                              self.event_type, self.key, cost_ms)
 
 
 class EventHandler:
     """事件处理器,执行的时候不抛出异常"""
 
-    def __init__(self, event_type, func, is_async=True, description=None):
+    def __init__(self, event_type, func, is_async=True, description=None, lane=EVENT_LANE):
         self.event_type = event_type
         self.key = None
         self.func = func
         self.is_async = is_async
+        self.lane = lane
         self.description = description
         self.profile = True
 
@@ -641,27 +665,27 @@ class EventHandler:
         else:
             self.key = func_name
 
-    def execute(self, ctx=None):
-        _debug_logger.log("event:(%s) key:(%s), is_async:(%s)",
-                          self.event_type, self.key, self.is_async)
+        self.stat = EventStat.get(event_type, self.key)
+        self.stat.is_async = is_async
 
+    def execute(self, ctx=None):
         if self.is_async:
             # 异步执行
-            put_task(self.func, ctx)
+            _executor.submit(self.run, (ctx,), lane=self.lane, key=self.key)
         else:
             # 同步执行
-            try:
-                start = 0.0
-                if self.profile:
-                    start = time.time()
-                self.func(ctx)
-                if self.profile:
-                    cost_time = (time.time()-start)*1000
-                    # xutils.trace("EventHandler", self.key, int((stop-start)*1000))
-                    _event_logger.log(
-                        "key:(%s), cost_time:(%.2fms)", self.key, cost_time)
-            except:
-                xutils.print_exc()
+            self.run(ctx)
+
+    def run(self, ctx=None):
+        start = time.perf_counter()
+        try:
+            self.func(ctx)
+        except:
+            self.stat.failed += 1
+            xutils.print_exc()
+        finally:
+            if self.profile:
+                self.stat.add((time.perf_counter()-start)*1000)
 
     def __eq__(self, other):
         if self.key is not None:
@@ -678,18 +702,16 @@ class SearchHandler(EventHandler):
 
     pattern = re.compile(r".*")
 
-    def execute(self, ctx=None):        
+    def execute(self, ctx=None):
         try:
             matched = self.pattern.match(ctx.key)
-            if not matched:
-                return
-            start = time.time()
-            ctx.groups = matched.groups()
-            self.func(ctx)
-            stop = time.time()
-            xutils.trace("SearchHandler", self.key, int((stop-start)*1000))
         except:
             xutils.print_exc()
+            return
+        if not matched:
+            return
+        ctx.groups = matched.groups()
+        self.run(ctx)
 
     def __str__(self):
         pattern = u(self.pattern.pattern)
@@ -712,6 +734,8 @@ class EventManager:
     @since 2018/01/10
     """
     _handlers = dict()
+    # 事件处理器链的快照, 注册的时候生成不可变的tuple, fire的时候直接遍历
+    _dispatch_table = dict() # type: dict[str, tuple[EventHandler, ...]]
 
     def add_handler(self, handler):
         """注册事件处理器
@@ -726,18 +750,24 @@ class EventManager:
         xutils.trace("EventRegister", "%s" % handler)
         handlers.append(handler)
         self._handlers[event_type] = handlers
+        self._dispatch_table[event_type] = tuple(handlers)
+
+    def get_handlers(self, event_type=""):
+        # type: (str) -> tuple[EventHandler, ...]
+        return self._dispatch_table.get(event_type, ())
 
     def fire(self, event_type, ctx=None):
-        handlers = self._handlers.get(event_type, [])
-        for handler in handlers:
+        for handler in self._dispatch_table.get(event_type, ()):
             handler.execute(ctx)
 
     def remove_handlers(self, event_type=None):
         """移除事件处理器"""
         if event_type is None:
             self._handlers = dict()
+            self._dispatch_table = dict()
         else:
             self._handlers[event_type] = []
+            self._dispatch_table[event_type] = ()
 
 
 @xutils.log_init_deco("xmanager.init")
@@ -784,24 +814,25 @@ def load_init_script():
             print("Failed to execute script %s" % xconfig.INIT_SCRIPT)
 
 
-def put_task(func, *args, **kw):
-    """添加异步任务到队列，如果队列满了会自动降级成同步执行"""
-    if len(WorkerThread._task_queue) > TASK_POOL_SIZE:
-        # TODO 大部分是写日志的任务，日志任务单独加一个线程处理
-        func_name = get_func_abs_name(func)
-        xutils.warn_sync(
-            "xmanager", "task deque is full func_name=%s" % func_name)
-        try:
-            func(*args, **kw)
-        except Exception:
-            xutils.print_exc()
-    else:
-        put_task_async(func, *args, **kw)
+def start_executor():
+    """按照配置启动异步任务的工作线程"""
+    config = xconfig.WebConfig
+    _executor.add_lane(EVENT_LANE, worker_count=config.async_event_workers,
+                       max_queue_size=config.async_queue_size)
+    _executor.add_lane(DEFAULT_LANE, worker_count=config.async_default_workers,
+                       max_queue_size=config.async_queue_size)
+    _executor.start(EVENT_LANE)
+    _executor.start(DEFAULT_LANE)
+
+def get_executor():
+    return _executor
 
+def put_task(func, *args, **kw):
+    """添加异步任务到队列，如果队列满了会在当前线程执行"""
+    _executor.submit(func, args, kw, lane=DEFAULT_LANE)
 
-def put_task_async(func, *args, **kw):
-    """添加异步任务到队列"""
-    WorkerThread.add_task(func, args, kw)
+# 兼容旧的接口
+put_task_async = put_task
 
 def get_handler_manager():
     # type: () -> HandlerManager
@@ -856,8 +887,10 @@ def fire(event_type, ctx=None):
     get_event_manager().fire(event_type, ctx)
 
 
-def listen(event_type_list, is_async=True, description=None):
-    """事件监听器注解"""
+def listen(event_type_list, is_async=True, description=None, lane=EVENT_LANE):
+    """事件监听器注解
+    @param lane: 异步执行的通道, 低优先级的任务可以使用 logutil.LOG_LANE
+    """
 
     # 同步任务使用专门的线程执行
     if event_type_list == "sync.step":
@@ -869,13 +902,15 @@ def listen(event_type_list, is_async=True, description=None):
             for event_type in event_type_list:
                 handler = EventHandler(event_type, func,
                                        is_async=is_async,
-                                       description=description)
+                                       description=description,
+                                       lane=lane)
                 event_manager.add_handler(handler)
         else:
             event_type = event_type_list
             handler = EventHandler(event_type, func,
                                    is_async=is_async,
-                                   description=description)
+                                   description=description,
+                                   lane=lane)
             event_manager.add_handler(handler)
         return func
     return deco
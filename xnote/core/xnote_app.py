@@ -152,6 +152,9 @@ def init_kv_engine():
             db_file = os.path.join(xconfig.DB_DIR, "sqlite", "kv_store.db")
             config_dict = Storage()
             config_dict.sqlite_journal_mode = xconfig.DatabaseConfig.sqlite_journal_mode
+            config_dict.sqlite_range_page_size = xconfig.DatabaseConfig.sqlite_range_page_size
+            config_dict.sqlite_range_stream = xconfig.DatabaseConfig.sqlite_range_stream
+            config_dict.sqlite_key_filter = xconfig.DatabaseConfig.sqlite_key_filter
             db_instance = SqliteKV(db_file, config_dict=config_dict)
             db_instance.sql_logger = xnote_trace.SqlLogger()
             db_instance.debug = xconfig.DatabaseConfig.db_debug
@@ -202,6 +205,10 @@ def init_kv_engine():
         # 是否开启binlog
         binlog = xconfig.DatabaseConfig.binlog
         db_cache = cacheutil.MultiLevelCache()  # 多级缓存：内存+持久化
+        object_cache_size = xconfig.DatabaseConfig.db_object_cache_size
+        if object_cache_size > 0:
+            # 读取对象的LRU缓存，写入时失效
+            db_cache = dbutil_cache.KvObjectCache(db_cache, max_bytes=object_cache_size)
 
         # 初始化leveldb数据库
         dbutil.init(xconfig.DB_DIR,
@@ -344,10 +344,30 @@ def init_file_info():
         manager.add_column("ftype", "varchar(16)", "")
         manager.add_column("fsize", "bigint", 0)
         manager.add_column("user_id", "bigint", 0)
+        # 文件内容的sha256, 用于同步的时候跳过相同的文件
+        manager.add_column("fhash", "varchar(64)", "")
 
         manager.add_index("user_id")
         manager.add_index("fpath", key_len=100)
         manager.add_index(["ftype", "fpath"], key_len_list=[0, 100])
+        manager.add_index("fhash")
+
+
+def init_file_name_index():
+    """文件名的三元组(trigram)索引, 用于按照文件名搜索
+    @since 2026/10/18
+    """
+    table_name = "file_name_index"
+    comment = "文件名三元组索引"
+    with create_default_table_manager(table_name, comment=comment) as manager:
+        manager.add_column("gram", "varchar(16)", "", comment="文件名的三元组")
+        manager.add_column("file_id", "bigint", 0, comment="file_info的ID")
+
+        manager.add_index(["gram", "file_id"])
+        manager.add_index("file_id")
+        # 索引数据可以重建, 不需要同步和记录profile
+        manager.table_info.log_profile = False
+        manager.table_info.enable_binlog = False
 
 
 def init_site_visit_log():
@@ -427,6 +447,41 @@ def init_comment_index_table():
         manager.table_info.enable_binlog = True
 
 
+def init_search_index_table():
+    """全文搜索的倒排索引
+    @since 2026/10/18
+    """
+    table_name = "search_index"
+    comment = "全文搜索倒排索引"
+    with create_default_table_manager(table_name, comment=comment) as manager:
+        manager.add_column("search_type", "tinyint", 0, comment="搜索类型")
+        manager.add_column("user_id", "bigint", 0, comment="用户ID")
+        manager.add_column("token", "varchar(64)", "", comment="词元")
+        manager.add_column("target_id", "bigint", 0, comment="关联的对象ID")
+        manager.add_column("tf", "int", 0, comment="词频")
+        manager.add_column("positions", "text", "", comment="词元出现的位置")
+        manager.add_column("doc_len", "int", 0, comment="对象的词元总数")
+
+        manager.add_index(["user_id", "search_type", "token"], key_len_list=[0, 0, 64])
+        manager.add_index("target_id")
+        # 索引数据可以重建, 不需要同步和记录profile
+        manager.table_info.log_profile = False
+        manager.table_info.enable_binlog = False
+
+    # 倒排索引的统计信息, 在写入索引的时候增量更新
+    table_name = "search_index_stat"
+    comment = "全文搜索索引统计"
+    with create_default_table_manager(table_name, comment=comment) as manager:
+        manager.add_column("search_type", "tinyint", 0, comment="搜索类型")
+        manager.add_column("user_id", "bigint", 0, comment="用户ID")
+        manager.add_column("doc_count", "bigint", 0, comment="对象数量")
+        manager.add_column("total_len", "bigint", 0, comment="对象的词元总数之和")
+
+        manager.add_index(["user_id", "search_type"], is_unique=True)
+        manager.table_info.log_profile = False
+        manager.table_info.enable_binlog = False
+
+
 def init_user_note_log():
     """用户笔记日志, 从kv数据迁移过来
     @since 2023/10/22
@@ -548,6 +603,7 @@ def init():
     init_record_table()
     init_user_table()
     init_file_info()
+    init_file_name_index()
     init_site_visit_log()
     
     # 标签相关
@@ -564,6 +620,9 @@ def init():
     init_note_index_table()
     init_user_note_log()
 
+    # 全文索引
+    init_search_index_table()
+
     # 通用的分享记录
     init_share_info_table()
     
@@ -27,33 +27,33 @@ def init():
     init_deleted_table()
     
     # 网络文件映射到本地文件
-    dbutil.register_table("fs_map", "文件映射")
-    dbutil.register_table("fs_ctype", "缓存的Content-Type")
-    dbutil.register_table("txt_info", "txt文件信息")
-    dbutil.register_table("fs_sync_index", "文件同步索引信息")
+    dbutil.register_table("fs_map", "文件映射", binlog=True)
+    dbutil.register_table("fs_ctype", "缓存的Content-Type", binlog=True)
+    dbutil.register_table("txt_info", "txt文件信息", binlog=True)
+    dbutil.register_table("fs_sync_index", "文件同步索引信息", binlog=True)
     
-    dbutil.register_table("user_config", "用户配置表")
-    db = dbutil.register_table("session", "用户会话信息")
+    dbutil.register_table("user_config", "用户配置表", binlog=True)
+    db = dbutil.register_table("session", "用户会话信息", binlog=True)
     db.register_index("user", columns=["user_name"])
-    dbutil.register_table("sys_config", "系统配置表")
+    dbutil.register_table("sys_config", "系统配置表", binlog=True)
     
-    dbutil.register_table("user_stat", "用户数据统计")
+    dbutil.register_table("user_stat", "用户数据统计", binlog=True)
 
-    db = dbutil.register_table("plugin_visit", "插件访问日志")
+    db = dbutil.register_table("plugin_visit", "插件访问日志", binlog=True)
     db.register_index("k_url", columns=["user", "url"])
     db.rebuild_index("v2")
 
     # 操作日志
-    dbutil.register_table("user_op_log", "用户操作日志表", user_attr="user_name")
+    dbutil.register_table("user_op_log", "用户操作日志表", user_attr="user_name", binlog=True)
 
     # 月度计划
-    db = dbutil.register_table("month_plan", "月度计划")
+    db = dbutil.register_table("month_plan", "月度计划", binlog=True)
     db.register_index("user_month", columns = ["user", "month"])
 
 def init_system_table():
-    dbutil.register_table("sys_log", "系统日志")
-    dbutil.register_table("dict", "词典")
-    dbutil.register_table("migrate_failed", "迁移失败记录")
+    dbutil.register_table("sys_log", "系统日志", binlog=True)
+    dbutil.register_table("dict", "词典", binlog=True)
+    dbutil.register_table("migrate_failed", "迁移失败记录", binlog=True)
     db = dbutil.register_table("z", "老版本的zset实现")
     db.delete_table()
 
@@ -91,12 +91,12 @@ def init_deleted_table():
 def init_note_tables():
     # 笔记信息
     dbutil.register_table("note_tags", "笔记标签绑定",
-                          category="note", user_attr="user")
+                          category="note", user_attr="user", binlog=True)
     dbutil.register_table("note_tag_meta", "笔记标签",
-                          category="note", user_attr="user")
-    dbutil.register_table("note_draft", "笔记草稿", category="note", type="hash")
-    dbutil.register_table("note_lock", "笔记编辑锁", category="note")
-    dbutil.register_table("note_full", "笔记的完整信息", category="note")
+                          category="note", user_attr="user", binlog=True)
+    dbutil.register_table("note_draft", "笔记草稿", category="note", type="hash", binlog=True)
+    dbutil.register_table("note_lock", "笔记编辑锁", category="note", binlog=True)
+    dbutil.register_table("note_full", "笔记的完整信息", category="note", binlog=True)
 
     # ID维度笔记索引
     db = dbutil.register_table(
@@ -118,10 +118,10 @@ def init_note_tables():
     db.delete_table()
 
     # 笔记修改历史
-    dbutil.register_table("note_history_index", "笔记历史索引", category="note")
-    dbutil.register_table("note_history", "笔记的历史版本", category="note")
+    dbutil.register_table("note_history_index", "笔记历史索引", category="note", binlog=True)
+    dbutil.register_table("note_history", "笔记的历史版本", category="note", binlog=True)
     
-    db = dbutil.register_table("search_history", "搜索历史", user_attr="user", check_user=True)
+    db = dbutil.register_table("search_history", "搜索历史", user_attr="user", check_user=True, binlog=True)
     db.drop_index("user", comment = "使用二级key的表,不需要user索引")
 
     # 分享关系
@@ -132,7 +132,7 @@ def init_note_tables():
     db.delete_table()
 
 
-    db = dbutil.register_table("comment", "评论模型", category="note")
+    db = dbutil.register_table("comment", "评论模型", category="note", binlog=True)
     db.drop_index("user", comment = "用户索引")
     db.drop_index("note_id", comment = "笔记ID索引")
 
@@ -158,12 +158,12 @@ def init_note_tables():
     db.delete_table()
 
 def init_message_tables():
-    dbutil.register_table("message", "短文本", check_user=True, user_attr="user")
-    dbutil.register_table("msg_key", "备忘关键字/标签", check_user=True, user_attr="user")
+    dbutil.register_table("message", "短文本", check_user=True, user_attr="user", binlog=True)
+    dbutil.register_table("msg_key", "备忘关键字/标签", check_user=True, user_attr="user", binlog=True)
     
     db = dbutil.register_table("msg_backup", "随手记备份", check_user=True, user_attr="user")
     db.delete_table()
 
-    dbutil.register_table("msg_search_history", "备忘搜索历史", check_user=True, user_attr="user")
-    dbutil.register_table("msg_history", "备忘历史")
+    dbutil.register_table("msg_search_history", "备忘搜索历史", check_user=True, user_attr="user", binlog=True)
+    dbutil.register_table("msg_history", "备忘历史", binlog=True)
 
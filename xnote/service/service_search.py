@@ -0,0 +1,262 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 10:12:30
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 10:12:30
+@FilePath     : /xnote/xnote/service/service_search.py
+@Description  : 全文搜索的倒排索引
+"""
+# encoding=utf-8
+import enum
+import math
+import xtables
+from xutils import Storage, textutil
+
+
+class SearchTypeEnum(enum.Enum):
+    empty = 0
+    note = 1 # 笔记
+    msg = 2  # 随手记
+
+
+class SearchIndexDO(Storage):
+    """倒排索引的记录, 一条记录对应一个(词元, 对象)"""
+    def __init__(self):
+        self.search_type = 0
+        self.user_id = 0
+        self.token = ""
+        self.target_id = 0
+        self.tf = 0
+        self.positions = ""
+        self.doc_len = 0
+
+    def get_position_list(self):
+        if self.positions == "" or self.positions == None:
+            return []
+        return [int(x) for x in self.positions.split(",")]
+
+
+class SearchMatchResult:
+    """多个词元AND匹配的结果, 包含计算相关性需要的统计信息"""
+
+    def __init__(self):
+        self.tokens = [] # type: list[str]
+        self.target_ids = set() # type: set[int]
+        # token -> {target_id: tf}
+        self.tf_dict = dict() # type: dict[str, dict[int, int]]
+        # token -> 包含该词元的对象数量
+        self.df_dict = dict() # type: dict[str, int]
+        # target_id -> 对象的词元总数
+        self.doc_len_dict = dict() # type: dict[int, int]
+
+
+class SearchIndexService:
+    """全文搜索服务, 维护 token -> [target_id] 的倒排索引"""
+    db = xtables.get_table_by_name("search_index")
+    # 对象数量和长度的统计, 在更新索引的同一个事务里面增量维护
+    stat_db = xtables.get_table_by_name("search_index_stat")
+    # 每个词元最多记录的位置数量
+    max_positions = 20
+    # 候选集小于这个数量时, 后续的词元查询会带上候选集
+    max_filter_size = 500
+    # BM25参数
+    bm25_k1 = 1.2
+    bm25_b = 0.75
+
+    def __init__(self, search_type = SearchTypeEnum.empty):
+        self.search_type = search_type.value
+
+    def build_postings(self, text=""):
+        # type: (str) -> dict[str, list[int]]
+        postings = dict()
+        for token, position in textutil.split_index_tokens(text):
+            positions = postings.get(token)
+            if positions == None:
+                positions = []
+                postings[token] = positions
+            positions.append(position)
+        return postings
+
+    def update_index(self, user_id=0, target_id=0, text=""):
+        """重建单个对象的索引"""
+        assert user_id != 0, "user_id can not be 0"
+        assert target_id != 0, "target_id can not be 0"
+
+        postings = self.build_postings(text)
+        doc_len = sum([len(x) for x in postings.values()])
+        with self.db.transaction():
+            self._delete_index_and_stat(target_id)
+            for token in postings:
+                positions = postings[token]
+                record = SearchIndexDO()
+                record.search_type = self.search_type
+                record.user_id = user_id
+                record.token = token
+                record.target_id = target_id
+                record.tf = len(positions)
+                record.positions = ",".join([str(x) for x in positions[:self.max_positions]])
+                record.doc_len = doc_len
+                self.db.insert(**record)
+            if len(postings) > 0:
+                self.update_stat(user_id, doc_delta=1, len_delta=doc_len)
+        return len(postings)
+
+    def delete_index(self, target_id=0):
+        with self.db.transaction():
+            return self._delete_index_and_stat(target_id)
+
+    def _delete_index_and_stat(self, target_id=0):
+        where = dict(search_type=self.search_type, target_id=target_id)
+        old = self.db.select_first(what="user_id,doc_len", where=where)
+        if old == None:
+            return 0
+        self.update_stat(old.user_id, doc_delta=-1, len_delta=-old.doc_len)
+        return self.db.delete(where=where)
+
+    def update_stat(self, user_id=0, doc_delta=0, len_delta=0):
+        """增量更新统计信息, 统计记录不存在的时候创建"""
+        sql = "UPDATE %s SET doc_count=doc_count+$doc_delta, total_len=total_len+$len_delta " % self.stat_db.tablename \
+            + "WHERE user_id=$user_id AND search_type=$search_type"
+        vars = dict(user_id=user_id, search_type=self.search_type, doc_delta=doc_delta, len_delta=len_delta)
+        if self.stat_db.raw_query(sql, vars=vars) == 0:
+            self.stat_db.insert(user_id=user_id, search_type=self.search_type,
+                                doc_count=max(0, doc_delta), total_len=max(0, len_delta))
+
+    def rebuild_stat(self, user_id=0):
+        """根据索引重新计算统计信息"""
+        sql = "SELECT COUNT(1) AS doc_count, SUM(doc_len) AS total_len FROM " \
+            + "(SELECT target_id, MAX(doc_len) AS doc_len FROM %s " % self.db.tablename \
+            + "WHERE user_id=$user_id AND search_type=$search_type GROUP BY target_id) t"
+        vars = dict(user_id=user_id, search_type=self.search_type)
+        with self.db.transaction():
+            record = self.db.query(sql, vars=vars)[0]
+            where = dict(user_id=user_id, search_type=self.search_type)
+            self.stat_db.delete(where=where)
+            self.stat_db.insert(user_id=user_id, search_type=self.search_type,
+                                doc_count=int(record.doc_count or 0), total_len=int(record.total_len or 0))
+
+    def _build_token_where(self, user_id=0, token="", id_filter=None):
+        where = "user_id=$user_id AND search_type=$search_type"
+        vars = dict(user_id=user_id, search_type=self.search_type, token=token)
+
+        if textutil.is_cjk(token[0]):
+            where += " AND token=$token"
+        else:
+            where += " AND token>=$token AND token<$token_end"
+            vars["token_end"] = token + "\uffff"
+
+        if id_filter != None:
+            where += " AND target_id IN $id_filter"
+            vars["id_filter"] = list(id_filter)
+        return where, vars
+
+    def list_target_ids(self, user_id=0, token="", id_filter=None):
+        # type: (int, str, set|None) -> set[int]
+        """查询词元对应的对象ID, 英文单词按照前缀匹配"""
+        return set(self.list_postings(user_id, token, id_filter))
+
+    def list_postings(self, user_id=0, token="", id_filter=None, doc_len_dict=None):
+        # type: (int, str, set|None, dict|None) -> dict[int, int]
+        """查询词元的倒排列表, 返回 target_id -> tf, 前缀匹配的多个词元词频累加"""
+        where, vars = self._build_token_where(user_id, token, id_filter)
+        result = dict()
+        for record in self.db.select(what="target_id,tf,doc_len", where=where, vars=vars):
+            target_id = record.target_id
+            result[target_id] = result.get(target_id, 0) + record.tf
+            if doc_len_dict != None:
+                doc_len_dict[target_id] = record.doc_len
+        return result
+
+    def count_doc_freq(self, user_id=0, token=""):
+        where, vars = self._build_token_where(user_id, token)
+        if textutil.is_cjk(token[0]):
+            return self.db.count(where=where, vars=vars)
+        record = self.db.select_first(what="COUNT(DISTINCT target_id) AS amount", where=where, vars=vars)
+        return record.amount
+
+    def match(self, user_id=0, words=[]):
+        # type: (int, list[str]) -> SearchMatchResult
+        """多个关键字按照AND语义匹配, 同时收集词频信息"""
+        result = SearchMatchResult()
+        result.tokens = textutil.split_query_tokens(words)
+        if len(result.tokens) == 0:
+            return result
+
+        candidates = None # type: set[int]|None
+        for token in result.tokens:
+            id_filter = None
+            if candidates != None and len(candidates) <= self.max_filter_size:
+                id_filter = candidates
+            postings = self.list_postings(user_id, token, id_filter, result.doc_len_dict)
+            result.tf_dict[token] = postings
+            if id_filter == None:
+                # 没有过滤条件时查询的是完整的倒排列表
+                result.df_dict[token] = len(postings)
+            if candidates == None:
+                candidates = set(postings)
+            else:
+                candidates = candidates & set(postings)
+            if len(candidates) == 0:
+                break
+
+        result.target_ids = candidates or set()
+        return result
+
+    def search(self, user_id=0, words=[], limit=1000):
+        # type: (int, list[str], int) -> list[int]
+        """多个关键字按照AND语义查询, 返回对象ID列表"""
+        match_result = self.match(user_id, words)
+        result = sorted(match_result.target_ids, reverse=True)
+        if limit > 0:
+            return result[:limit]
+        return result
+
+    def get_corpus_stat(self, user_id=0):
+        """对象总数和平均长度, 用于计算BM25"""
+        record = self.stat_db.select_first(where=dict(user_id=user_id, search_type=self.search_type))
+        stat = Storage()
+        stat.doc_count = 0
+        stat.avg_len = 0
+        if record != None and record.doc_count > 0:
+            stat.doc_count = int(record.doc_count)
+            stat.avg_len = float(record.total_len) / stat.doc_count
+        return stat
+
+    def compute_idf(self, doc_count=0, df=0):
+        return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+    def compute_bm25(self, tf=0, doc_len=0, avg_len=0, idf=0.0):
+        if tf <= 0:
+            return 0.0
+        k1 = self.bm25_k1
+        norm = 1 - self.bm25_b
+        if avg_len > 0:
+            norm += self.bm25_b * doc_len / avg_len
+        return idf * tf * (k1 + 1) / (tf + k1 * norm)
+
+    def score_bm25(self, user_id=0, match_result=SearchMatchResult()):
+        # type: (int, SearchMatchResult) -> dict[int, float]
+        """计算候选对象的BM25得分"""
+        scores = dict()
+        if len(match_result.target_ids) == 0:
+            return scores
+
+        stat = self.get_corpus_stat(user_id)
+        for token in match_result.tokens:
+            df = match_result.df_dict.get(token)
+            if df == None:
+                df = self.count_doc_freq(user_id, token)
+                match_result.df_dict[token] = df
+            idf = self.compute_idf(stat.doc_count, df)
+            postings = match_result.tf_dict.get(token, {})
+            for target_id in match_result.target_ids:
+                tf = postings.get(target_id, 0)
+                doc_len = match_result.doc_len_dict.get(target_id, 0)
+                score = self.compute_bm25(tf, doc_len, stat.avg_len, idf)
+                scores[target_id] = scores.get(target_id, 0.0) + score
+        return scores
+
+    def count_index(self, user_id=0):
+        return self.db.count(where=dict(search_type=self.search_type, user_id=user_id))
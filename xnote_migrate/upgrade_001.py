@@ -11,7 +11,7 @@ from .base import log_info
 from handlers.note import dao_log
 from . import base
 
-dbutil.register_table("note_migrate_log", "笔记迁移日志")
+dbutil.register_table("note_migrate_log", "笔记迁移日志", binlog=True)
 
 def do_upgrade():
     """升级入口"""
@@ -16,7 +16,7 @@ def do_upgrade():
 
 
 def fix_note_share():
-    dbutil.register_table("note_share_from", "分享发送者关系表 <note_share_from:from_user:note_id>")
+    dbutil.register_table("note_share_from", "分享发送者关系表 <note_share_from:from_user:note_id>", binlog=True)
     db = dbutil.get_table("note_share_from")
     for value in db.iter(limit = -1):
         note_id = value.note_id
@@ -21,7 +21,7 @@ def do_upgrade():
     base.execute_upgrade(upgrade_key, upgrade_comment)
 
 def upgrade_comment():
-    dbutil.register_table("note_comment", "笔记评论")
+    dbutil.register_table("note_comment", "笔记评论", binlog=True)
     db = dbutil.get_table("note_comment")
     
     dao_comment.drop_comment_table()
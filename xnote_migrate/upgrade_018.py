@@ -0,0 +1,29 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 11:02:40
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 11:02:40
+@FilePath     : /xnote/xnote_migrate/upgrade_018.py
+@Description  : 构建笔记/随手记的全文索引
+"""
+
+import xauth
+from . import base
+
+def do_upgrade():
+    base.execute_upgrade("20261018_note_search_index", build_note_search_index)
+    base.execute_upgrade("20261018_msg_search_index", build_msg_search_index)
+
+
+def build_note_search_index():
+    from handlers.note.dao_search import NoteSearchIndexDao
+    for user_info in xauth.iter_user(limit=-1):
+        NoteSearchIndexDao.rebuild_user_index(creator_id=user_info.id)
+
+
+def build_msg_search_index():
+    from handlers.message.dao import MsgSearchIndexDao
+    for user_info in xauth.iter_user(limit=-1):
+        MsgSearchIndexDao.rebuild_user_index(user_name=user_info.name)
@@ -0,0 +1,20 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 23:12:05
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 23:12:05
+@FilePath     : /xnote/xnote_migrate/upgrade_019.py
+@Description  : 构建文件名的三元组索引
+"""
+
+from . import base
+
+def do_upgrade():
+    base.execute_upgrade("20261018_file_name_index", build_file_name_index)
+
+
+def build_file_name_index():
+    from handlers.fs.fs_helper import FileNameIndexDao
+    FileNameIndexDao.rebuild()
@@ -0,0 +1,24 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 23:40:16
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 23:40:16
+@FilePath     : /xnote/xnote_migrate/upgrade_020.py
+@Description  : 初始化全文索引的统计信息
+"""
+
+import xauth
+from . import base
+
+def do_upgrade():
+    base.execute_upgrade("20261018_search_index_stat", build_search_index_stat)
+
+
+def build_search_index_stat():
+    from xnote.service import SearchIndexService, SearchTypeEnum
+    for search_type in (SearchTypeEnum.note, SearchTypeEnum.msg):
+        service = SearchIndexService(search_type)
+        for user_info in xauth.iter_user(limit=-1):
+            service.rebuild_stat(user_id=user_info.id)
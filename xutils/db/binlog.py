@@ -8,17 +8,27 @@
 @FilePath     : /xnote/xutils/db/binlog.py
 @Description  : 数据库的binlog,用于同步
 """
-from web import Storage
+from xutils.base import Storage
 from xutils.db.dbutil_base import count_table, prefix_iter
-from xutils.db.dbutil_base import db_put, prefix_list, register_table, db_batch_delete
+from xutils.db.dbutil_base import put_bytes, prefix_list, register_table, db_batch_delete
+from xutils.db.dbutil_base import create_write_batch
 from xutils.db.dbutil_id_gen import IdGenerator
 
+import time
+import json
+import zlib
 import struct
+import bisect
+import base64
 import threading
 import logging
-import base64
+import collections
 
 register_table("_binlog", "数据同步的binlog")
+register_table("_binlog_seg", "binlog分段")
+
+# binlog记录的字段, 按照顺序打包成数组, 末尾的空字段不保存
+RECORD_FIELDS = ("optype", "key", "ts", "table_name", "value", "old_value")
 
 class BinLogOpType:
     """binlog操作枚举"""
@@ -41,14 +51,35 @@ class FileLog(Storage):
         self.webpath = ""
         self.old_webpath = ""
         self.mtime = 0.0
+        self.fhash = ""
+
+class BinLogSegment(Storage):
+    """binlog分段的索引信息, 分段包含 [start_seq, end_seq] 范围内的binlog"""
+
+    def __init__(self, start_seq=0, end_seq=0, count=0):
+        self.start_seq = start_seq
+        self.end_seq = end_seq
+        self.count = count
+
 
 class BinLog:
+    """binlog分成两部分
+    - 尾部: 每条binlog一行(_binlog:<hex id>), 和数据在同一个批量操作中提交, 保证一致性
+    - 分段: 尾部的binlog积累到 _segment_size 条以后打包压缩成一个分段(_binlog_seg:<hex start_id>)
+    清理过期的binlog的时候直接删除整个分段, 查询的时候通过分段索引二分查找
+    """
     _table_name = "_binlog"
+    _segment_table_name = "_binlog_seg"
     _lock = threading.RLock()
     _delete_lock = threading.RLock()
     _instance = None
     _is_enabled = False
     _max_size = 10000
+    # 每个分段的binlog数量
+    _segment_size = 1000
+    # add_log在批量操作提交之前就分配了ID, 所以尾部的ID可能有空洞(还没有提交或者已经放弃)
+    # 封存分段的时候只封存连续的ID, 空洞之后的binlog超过这个时间才认为空洞的ID已经放弃
+    _seal_grace_seconds = 300
     log_debug = False
     logger = logging.getLogger("binlog")
     id_gen = IdGenerator(_table_name)
@@ -60,6 +91,12 @@ class BinLog:
             if self._instance != None:
                 raise Exception("只能创建一个BinLog单例")
             self._instance = self
+            self._segments = None # type: list[BinLogSegment]|None
+            self._segment_starts = [] # type: list[int]
+            # 最近解码的分段, 从节点顺序读取的时候会连续访问同一个分段
+            self._segment_cache = collections.OrderedDict()
+            self._seal_running = threading.Lock()
+            self._seal_scheduled = False
 
     def _pack_id(self, log_id=0):
         return struct.pack('>Q', log_id).hex()
@@ -74,9 +111,6 @@ class BinLog:
 
         raise Exception("can not unpack value: %r" % id_str)
 
-    def _pack_id_v0(self, log_id=0):
-        return "%020d" % log_id
-
     @property
     def last_seq(self):
         return self.id_gen.current_id_int()
@@ -96,32 +130,149 @@ class BinLog:
     def set_enabled(cls, is_enabled):
         cls._is_enabled = is_enabled
 
+    @classmethod
+    def is_enabled(cls):
+        return cls._is_enabled
+
     @classmethod
     def set_max_size(cls, max_size):
         cls._max_size = max_size
 
-    def count_size(self):
+    @classmethod
+    def set_segment_size(cls, segment_size, seal_grace_seconds=None):
+        assert segment_size > 0, "segment_size必须大于0"
+        cls._segment_size = segment_size
+        if seal_grace_seconds != None:
+            cls._seal_grace_seconds = seal_grace_seconds
+
+    def _pack_record(self, body):
+        # type: (dict) -> list
+        record = [body.get(name) for name in RECORD_FIELDS]
+        while len(record) > 0 and record[-1] == None:
+            record.pop()
+        return record
+
+    def _unpack_record(self, record):
+        # type: (list|dict) -> Storage
+        if isinstance(record, dict):
+            # 兼容老版本的JSON对象格式
+            return Storage(**record)
+        result = Storage()
+        for name, value in zip(RECORD_FIELDS, record):
+            if value != None:
+                result[name] = value
+        return result
+
+    def _encode_record(self, record):
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def _encode_segment(self, records):
+        # type: (list[tuple[int, list]]) -> dict
+        data = zlib.compress(self._encode_record(records))
+        return dict(codec="zlib", start_seq=records[0][0], end_seq=records[-1][0],
+                    count=len(records), data=base64.b64encode(data).decode("ascii"))
+
+    def _decode_segment(self, seg_value):
+        # type: (dict) -> list[tuple[int, Storage]]
+        assert seg_value.get("codec") == "zlib"
+        data = zlib.decompress(base64.b64decode(seg_value.get("data")))
+        return [(seq, self._unpack_record(record)) for seq, record in json.loads(data)]
+
+    def get_segment_key(self, start_seq=0):
+        return self._segment_table_name + ":" + self._pack_id(start_seq)
+
+    def get_segments(self):
+        # type: () -> list[BinLogSegment]
+        """分段索引, 按照start_seq排序, 第一次访问的时候加载"""
+        if self._segments != None:
+            return self._segments
+        with self._delete_lock:
+            if self._segments == None:
+                segments = []
+                for value in prefix_iter(self._segment_table_name):
+                    segments.append(BinLogSegment(value.start_seq, value.end_seq, value.count))
+                self._set_segments(segments)
+        return self._segments
+
+    def reset_segment_index(self):
+        """数据库发生了外部变更(比如恢复备份)之后需要重新加载分段索引"""
+        with self._delete_lock:
+            self._segments = None
+            self._segment_starts = []
+            self._segment_cache.clear()
+
+    def _set_segments(self, segments):
+        # type: (list[BinLogSegment]) -> None
+        """设置分段索引, 按照start_seq排序, 丢弃和前面的分段重叠的分段"""
+        result = [] # type: list[BinLogSegment]
+        for seg in sorted(segments, key=lambda x: x.start_seq):
+            if len(result) > 0 and seg.start_seq <= result[-1].end_seq:
+                self.logger.error("overlapping segment, start_seq=%s, end_seq=%s", seg.start_seq, seg.end_seq)
+                continue
+            result.append(seg)
+        self._segment_starts = [seg.start_seq for seg in result]
+        self._segments = result
+    
+    def _get_segment_records(self, segment):
+        # type: (BinLogSegment) -> list[tuple[int, Storage]]
+        records = self._segment_cache.get(segment.start_seq)
+        if records != None:
+            return records
+        seg_value = prefix_list(self._segment_table_name, key_from=self.get_segment_key(segment.start_seq), limit=1)
+        if len(seg_value) == 0 or seg_value[0].get("start_seq") != segment.start_seq:
+            # 分段已经不存在了, 索引过期
+            self.logger.warning("segment not found, start_seq=%s", segment.start_seq)
+            self.reset_segment_index()
+            return []
+        records = self._decode_segment(seg_value[0])
+        with self._lock:
+            self._segment_cache[segment.start_seq] = records
+            while len(self._segment_cache) > 4:
+                self._segment_cache.popitem(last=False)
+        return records
+
+    def find_segment_index(self, seq=0):
+        """二分查找seq所在的分段"""
+        segments = self.get_segments()
+        index = bisect.bisect_right(self._segment_starts, seq) - 1
+        return max(0, min(index, len(segments)))
+
+    def count_tail_size(self):
         return count_table(self._table_name)
 
+    def count_size(self):
+        segment_size = sum([seg.count for seg in self.get_segments()])
+        return segment_size + self.count_tail_size()
+
     def get_record_key(self, log_id):
         return self._table_name + ":" + log_id
     
     def get_last_log(self):
         logs = prefix_list(self._table_name, reverse=True,
                            limit=1, include_key=False)
-        if len(logs) == 0:
-            return None
-        return logs[0]
+        if len(logs) > 0:
+            return self._unpack_record(logs[0])
+        segments = self.get_segments()
+        if len(segments) > 0:
+            seq, log = self._get_segment_records(segments[-1])[-1]
+            return log
+        return None
 
     def get_last_key(self):
         logs = prefix_list(self._table_name, reverse=True,
                            limit=1, include_key=True)
-        if len(logs) == 0:
-            return None
-        key, value = logs[0]
-        return key.split(":")[1]
+        if len(logs) > 0:
+            key, value = logs[0]
+            return key.split(":")[1]
+        segments = self.get_segments()
+        if len(segments) > 0:
+            return self._pack_id(segments[-1].end_seq)
+        return None
 
     def find_start_seq(self):
+        segments = self.get_segments()
+        if len(segments) > 0:
+            return segments[0].start_seq
         logs = prefix_list(self._table_name, limit=1, include_key=True)
         if len(logs) == 0:
             return 1
@@ -132,10 +283,12 @@ class BinLog:
     def _put_log(self, log_id, log_body, batch=None):
         key = self.get_record_key(log_id)
         # print("binlog(%s,%s)" % (key, log_body))
+        key_bytes = key.encode("utf-8")
+        value_bytes = self._encode_record(self._pack_record(log_body))
         if batch != None:
-            batch.put(key, log_body)
+            batch.put_bytes(key_bytes, value_bytes)
         else:
-            db_put(key, log_body)
+            put_bytes(key_bytes, value_bytes)
 
     def add_log(self, optype, key, value=None, batch=None, old_value=None, *, record_value=False, table_name=None):
         if not self._is_enabled:
@@ -144,7 +297,8 @@ class BinLog:
         # 获取自增ID操作是并发安全的, 所以这里不需要加锁, 加锁过多不仅会导致性能下降, 还可能引发死锁问题
         new_id = self.id_gen.create_increment_id_int()
         binlog_id = self._pack_id(new_id)
-        binlog_body = dict(optype=optype, key=key)
+        # ts用于计算从节点的同步延迟(秒)
+        binlog_body = dict(optype=optype, key=key, ts=int(time.time()))
         if self.record_old_value and old_value != None:
             binlog_body["old_value"] = old_value
         if record_value and value != None:
@@ -153,46 +307,170 @@ class BinLog:
             binlog_body["table_name"] = table_name
         self._put_log(binlog_id, binlog_body, batch=batch)
 
+        if new_id % self._segment_size == 0:
+            self.seal_segments_async()
+
+    def iter_logs(self, last_seq=0):
+        """从last_seq开始按照顺序遍历binlog
+        @return Iterator[tuple[int, Storage]]
+        """
+        # next_seq是下一个需要返回的seq
+        next_seq = last_seq
+        while True:
+            segments = self.get_segments()
+            for segment in segments[self.find_segment_index(next_seq):]:
+                if segment.end_seq < next_seq:
+                    continue
+                for seq, log in self._get_segment_records(segment):
+                    if seq >= next_seq:
+                        yield seq, log
+                next_seq = segment.end_seq + 1
+
+            # 遍历尾部的过程中可能有其他线程把尾部封存成分段, 被封存的binlog会从尾部消失
+            # 遇到ID跳跃或者遍历结束的时候检查一下分段索引, 被封存了就从分段中继续读取
+            is_sealed = False
+            key_from = self.get_record_key(self._pack_id(next_seq))
+            for key, value in prefix_iter(self._table_name, key_from=key_from, include_key=True):
+                seq = self._unpack_id(key.split(":")[1])
+                if seq > next_seq and self._is_sealed(next_seq):
+                    is_sealed = True
+                    break
+                yield seq, self._unpack_record(value)
+                next_seq = seq + 1
+
+            if not is_sealed and not self._is_sealed(next_seq):
+                return
+
+    def _is_sealed(self, seq=0):
+        """seq是否已经被封存到分段中, 封存是在_delete_lock中执行的, 加锁等待正在执行的封存完成"""
+        with self._delete_lock:
+            segments = self.get_segments()
+            return len(segments) > 0 and segments[-1].end_seq >= seq
+
     def list(self, last_seq=0, limit=10, map_func=None):
         """从last_seq开始查询limit个binlog"""
-        start_id = self._pack_id(last_seq)
-        key_from = self._table_name + ":" + start_id
-        return prefix_list(self._table_name, key_from=key_from, limit=limit, map_func=map_func)
+        result = []
+        for seq, log in self.iter_logs(last_seq):
+            if map_func != None:
+                key = self.get_record_key(self._pack_id(seq))
+                log = map_func(key, log)
+                if log == None:
+                    continue
+            result.append(log)
+            if limit > 0 and len(result) >= limit:
+                break
+        return result
+
+    def seal_segments_async(self):
+        """后台封存分段, 最多只有一个线程在排队等待, 写入高峰期不会堆积封存线程"""
+        with self._lock:
+            if self._seal_scheduled:
+                return
+            self._seal_scheduled = True
+        thread = threading.Thread(target=self._run_seal_worker, name="BinlogSealer")
+        thread.daemon = True
+        thread.start()
+
+    def _run_seal_worker(self):
+        with self._seal_running:
+            with self._lock:
+                # 开始执行的时候清除标记, 执行期间新产生的封存请求会启动下一个线程, 不会丢失
+                self._seal_scheduled = False
+            self._seal_segments()
+
+    def seal_segments(self, wait=True):
+        """把尾部已经提交的binlog打包成分段
+        @param {bool} wait: 已经有线程在执行的时候是否等待
+        """
+        if not self._seal_running.acquire(blocking=wait):
+            return
+        try:
+            self._seal_segments()
+        finally:
+            self._seal_running.release()
+
+    def _seal_segments(self):
+        with self._delete_lock:
+            segments = list(self.get_segments())
+            while True:
+                expect_seq = None
+                key_from = None
+                if len(segments) > 0:
+                    # 超过等待时间才提交的binlog(seq小于已经封存的范围)保留在尾部, 随着所在的分段一起过期
+                    expect_seq = segments[-1].end_seq + 1
+                    key_from = self.get_record_key(self._pack_id(expect_seq))
+                rows = prefix_list(self._table_name, key_from=key_from, limit=self._segment_size, include_key=True)
+                if len(rows) < self._segment_size:
+                    break
+                records = []
+                keys = []
+                for key, value in rows:
+                    seq = self._unpack_id(key.split(":")[1])
+                    log = self._unpack_record(value)
+                    if not self._is_sealable(seq, log, expect_seq):
+                        break
+                    records.append((seq, self._pack_record(log)))
+                    keys.append(key)
+                    expect_seq = seq + 1
+                if len(records) < self._segment_size:
+                    break
+
+                seg_value = self._encode_segment(records)
+                batch = create_write_batch()
+                batch.put(self.get_segment_key(seg_value["start_seq"]), seg_value)
+                for key in keys:
+                    batch.delete(key)
+                batch.commit()
+
+                segments.append(BinLogSegment(seg_value["start_seq"], seg_value["end_seq"], seg_value["count"]))
+                self._set_segments(segments)
+                self.logger.info("seal segment, start_seq=%s, count=%s", seg_value["start_seq"], seg_value["count"])
+
+    def _is_sealable(self, seq, log, expect_seq):
+        # type: (int, Storage, int|None) -> bool
+        """ID连续说明前面的binlog都已经提交; 有空洞的时候等待空洞的ID提交或者超时放弃"""
+        if expect_seq == None or seq == expect_seq:
+            # 还没有分段的时候从第一条binlog开始封存
+            return True
+        ts = log.get("ts") or 0
+        return ts <= time.time() - self._seal_grace_seconds
 
     def delete_expired(self):
         assert self._max_size != None, "binlog_max_size未设置"
         assert self._max_size > 0, "binlog_max_size必须大于0"
 
-        start_seq = self.find_start_seq()
+        self.seal_segments()
 
-        size = self.count_size()
-        self.logger.info("count size:%s", size)
+        with self._delete_lock:
+            segments = list(self.get_segments())
+            size = self.count_size()
+            self.logger.info("count size:%s", size)
 
-        if size > self._max_size:
-            with self._delete_lock:
+            # 整个分段删除, 保留的binlog数量不少于max_size
+            while len(segments) > 0 and size - segments[0].count >= self._max_size:
+                segment = segments.pop(0)
+                self.delete_batch([self.get_segment_key(segment.start_seq)])
+                self._segment_cache.pop(segment.start_seq, None)
+                size -= segment.count
+                self._set_segments(segments)
+                # 分段封存之后才提交的binlog留在尾部, 跟着分段一起过期
+                size -= self._delete_tail_before(segment.end_seq)
+            
+            if len(segments) == 0 and size > self._max_size:
+                # 还没有分段, 直接删除尾部的binlog
                 limit = size - self._max_size
-                self.logger.info("limit size: %s", size)
                 keys = []
-                batch_size = 100
-
-                key_from = self._table_name + ":" + self._pack_id(start_seq)
-                for key, value in prefix_iter(self._table_name, key_from=key_from, limit=limit, include_key=True):
-                    keys.append(key)
-                    if len(keys) >= batch_size:
-                        self.delete_batch(keys)
-                        keys = []
-                
-                # 兼容历史版本
-                key_from_old = self._table_name + ":" + self._pack_id_v0(start_seq)
-                key_to_old = self._table_name + ":" + self._pack_id_v0(start_seq + limit)
-                for key, value in prefix_iter(self._table_name, key_from=key_from_old, key_to=key_to_old, include_key=True):
+                for key, value in prefix_iter(self._table_name, limit=limit, include_key=True):
                     keys.append(key)
-                    if len(keys) >= batch_size:
-                        self.delete_batch(keys)
-                        keys = []
-                
                 self.delete_batch(keys)
     
+    def _delete_tail_before(self, end_seq=0):
+        """删除尾部seq不超过end_seq的binlog"""
+        key_to = self.get_record_key(self._pack_id(end_seq))
+        keys = [key for key, value in prefix_iter(self._table_name, key_to=key_to, include_key=True)]
+        self.delete_batch(keys)
+        return len(keys)
+
     def delete_batch(self, keys):
         if len(keys) == 0:
             return
@@ -33,6 +33,7 @@
 * prefix_list
 * prefix_iter
 * prefix_count
+* DBSnapshot      只读快照
 
 """
 # 先加载标准库
@@ -85,6 +86,8 @@ class KvDataBase:
     driver_sorted_set = ""
     # 缓存对象（拥有put/get两个方法）
     cache = interfaces.empty_cache
+    # 读取对象的缓存, 通过 set_db_cache 设置 ObjectCacheInterface 的实现开启
+    object_cache = None # type: interfaces.ObjectCacheInterface|None
 
     @classmethod
     def init(cls, kw):
@@ -136,10 +139,11 @@ class WriteBatchProxy(BatchInterface):
         self.debug = False
 
     def check_and_put(self, key, val):
-        old_val = get(key)
-        if old_val == val:
-            # 值相同，不需要更新
-            return
+        if self.db_instance.MayExist(key.encode("utf-8")):
+            old_val = get(key)
+            if old_val == val:
+                # 值相同，不需要更新
+                return
         self.put(key, val)
 
     def put(self, key, val, check_table=True):
@@ -175,6 +179,8 @@ class WriteBatchProxy(BatchInterface):
         self._inserts[key_bytes] = val_bytes
 
     def check_and_delete(self, key):
+        if not self.db_instance.MayExist(key.encode("utf-8")):
+            return
         old_val = get(key)
         if old_val == None:
             # 值为空，不需要删除
@@ -211,7 +217,14 @@ class WriteBatchProxy(BatchInterface):
 
     def commit(self, sync=False, retries=0):
         self.log_debug_info()
-        self.db_instance.Write(self, sync)
+        try:
+            self.db_instance.Write(self, sync)
+        finally:
+            object_cache = KvDataBase.object_cache
+            if object_cache != None:
+                for key_set in (self._puts, self._inserts, self._deletes):
+                    for key in key_set:
+                        object_cache.delete_object(key.decode("utf-8"))
 
     def __enter__(self):
         return self
@@ -221,6 +234,33 @@ class WriteBatchProxy(BatchInterface):
             self.commit()
 
 
+class DBSnapshot:
+    """数据库只读快照, 快照内的遍历看不到创建之后的写入
+    驱动不支持快照的时候退化成直接读数据库
+
+    with DBSnapshot() as snapshot:
+        for key, value in prefix_iter("note", include_key=True, snapshot=snapshot):
+            ...
+    """
+
+    def __init__(self):
+        self.db = get_db_instance()
+        self.snapshot = None
+
+    def __enter__(self):
+        try:
+            self.snapshot = self.db.CreateSnapshot()
+        except NotImplementedError:
+            logging.warning("CreateSnapshot not supported, db=%s", self.db)
+            self.snapshot = self.db
+        return self.snapshot
+
+    def __exit__(self, type, value, traceback):
+        if self.snapshot is not self.db:
+            self.db.ReleaseSnapshot(self.snapshot)
+        self.snapshot = None
+
+
 def config(**kw):
     KvDataBase.init(kw)
 
@@ -313,6 +353,8 @@ class TableInfo:
         self.check_user = False
         self.user_attr = None
         self.is_deleted = False
+        # 所有的写入都记录了binlog(LdbTable/KvHashTable/dbutil.put/dbutil.delete)
+        self.binlog = False
 
     def check_and_register(self):
         if self.user_attr != None:
@@ -323,6 +365,8 @@ class TableInfo:
             # 检查结构是否一致，不能注册不一致的结构
             assert old_table.check_user == self.check_user, "conflict table registry: %s" % self.name
             assert old_table.user_attr == self.user_attr, "confilct table registry: %s" % self.name
+            if self.binlog:
+                old_table.binlog = True
             # 已经注册
             return old_table
         self._info_dict[self.name] = self
@@ -434,6 +478,7 @@ def register_table(table_name, description, **kw):  # type: (...)->TableInfo
     :param check_user: 是否检查用户
     :param user_attr: 用户的属性名
     :param type: 表的类型 {table, index, sorted_set}
+    :param binlog: 所有的写入是否都记录了binlog, 增量备份只复制binlog里面变更的key
     """
     # TODO 考虑过这个方法直接返回一个 LdbTable 实例
     # LdbTable可能针对同一个`table`会有不同的实例
@@ -452,6 +497,7 @@ def _register_table_inner(table_name, description, **kw):
     info.check_user = kw.get("check_user", False)
     info.user_attr = kw.get("user_attr")
     info.type = kw.get("type", "table")
+    info.binlog = kw.get("binlog", False)
     info.check_and_register()
 
     return info
@@ -521,11 +567,19 @@ def db_get(key, default_value=None):
             # print("key=%r", key)
             raise TypeError("expect str but see %r" % type(key))
 
-        key = key.encode("utf-8")
-        value = _leveldb.Get(key)
+        object_cache = KvDataBase.object_cache
+        if object_cache != None:
+            found, result = object_cache.get_object(key)
+            if found:
+                return result
+            version = object_cache.get_version()
+
+        value = _leveldb.Get(key.encode("utf-8"))
         result = convert_bytes_to_object(value)
         if result is None:
             return default_value
+        if object_cache != None:
+            object_cache.put_object(key, result, version)
         return result
     except KeyError:
         return default_value
@@ -534,19 +588,35 @@ def db_batch_get(key_list, default_value=None):
     # type: (list[str], object) -> dict[str, object]
     """批量查询"""
     check_leveldb()
-    
+
+    result = dict()
+    object_cache = KvDataBase.object_cache
+    version = 0
     key_bytes_list = []
     for key in key_list:
+        if object_cache != None:
+            found, object = object_cache.get_object(key)
+            if found:
+                result[key] = object
+                continue
         key_bytes_list.append(key.encode("utf-8"))
 
+    if len(key_bytes_list) == 0:
+        return result
+
+    if object_cache != None:
+        version = object_cache.get_version()
+
     batch_result = _leveldb.BatchGet(key_bytes_list)
-    result = dict()
     for key in batch_result:
         value = batch_result.get(key)
         object = convert_bytes_to_object(value)
+        key_str = key.decode("utf-8")
         if object is None:
             object = default_value
-        result[key.decode("utf-8")] = object
+        elif object_cache != None:
+            object_cache.put_object(key_str, object, version)
+        result[key_str] = object
     return result
 
 
@@ -558,10 +628,13 @@ def db_put(key, obj_value, sync=False, check_table=True):
     """
     check_before_write(key, check_table)
 
-    key = key.encode("utf-8")
+    key_bytes = key.encode("utf-8")
     # 注意json序列化有个问题，会把dict中数字开头的key转成字符串
     value = convert_object_to_json(obj_value)
-    _leveldb.Put(key, value.encode("utf-8"), sync=sync)
+    try:
+        _leveldb.Put(key_bytes, value.encode("utf-8"), sync=sync)
+    finally:
+        delete_object_cache(key)
 
 
 def put(*args, **kw):
@@ -570,7 +643,10 @@ def put(*args, **kw):
 
 def put_bytes(key, value, sync=False):
     check_before_write(key.decode("utf-8"))
-    _leveldb.Put(key, value, sync=sync)
+    try:
+        _leveldb.Put(key, value, sync=sync)
+    finally:
+        delete_object_cache(key.decode("utf-8"))
 
 
 def db_delete(key, sync=False):
@@ -580,8 +656,10 @@ def db_delete(key, sync=False):
     # 删除日志
     logging.info("Delete key: %s", key)
 
-    key = key.encode("utf-8")
-    _leveldb.Delete(key, sync=sync)
+    try:
+        _leveldb.Delete(key.encode("utf-8"), sync=sync)
+    finally:
+        delete_object_cache(key)
 
 
 def delete(*args, **kw):
@@ -594,7 +672,11 @@ def db_batch_delete(keys=[]):
     for key in keys:
         key_bytes_list.append(key.encode("utf-8"))
 
-    return get_db_instance().BatchDelete(key_bytes_list)
+    try:
+        return get_db_instance().BatchDelete(key_bytes_list)
+    finally:
+        for key in keys:
+            delete_object_cache(key)
 
 def create_write_batch(db_instance=None):
     return WriteBatchProxy(db_instance=db_instance)
@@ -669,12 +751,14 @@ def prefix_iter(prefix,  # type: str
     :param {string} key_from: 开始的key(包含)
     :param {string} key_to: 结束的key(包含)
     :param {bool} parse_json=True: 是否解析JSON
+    :param {object} snapshot=None: 在快照上遍历, 参考`DBSnapshot`
     """
     check_leveldb()
 
     parse_json = kw.get("parse_json", True)
     scan_db = kw.get("scan_db", False)
     fill_cache = kw.get("fill_cache", False)
+    snapshot = kw.get("snapshot")
 
     if filter_func != None and map_func != None:
         raise Exception("不允许同时设置filter_func和map_func")
@@ -695,7 +779,10 @@ def prefix_iter(prefix,  # type: str
     else:
         key_to_bytes = key_to.encode("utf-8")
 
-    iterator = _leveldb.RangeIter(
+    if snapshot == None:
+        snapshot = _leveldb
+
+    iterator = snapshot.RangeIter(
         key_from_bytes, key_to_bytes, include_value=True,
         reverse=reverse, fill_cache=fill_cache)
 
@@ -783,6 +870,18 @@ def prefix_count(*args, **kw):
 
 def set_db_cache(cache):
     KvDataBase.cache = cache
+    if isinstance(cache, interfaces.ObjectCacheInterface):
+        KvDataBase.object_cache = cache
+    else:
+        KvDataBase.object_cache = None
+
+def get_object_cache():
+    return KvDataBase.object_cache
+
+def delete_object_cache(key=""):
+    object_cache = KvDataBase.object_cache
+    if object_cache != None:
+        object_cache.delete_object(key)
 
 def get_db_cache():
     KvDataBase.cache
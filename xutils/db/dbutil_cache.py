@@ -26,9 +26,13 @@ ttl的几种方案
 import time
 import random
 import logging
+import marshal
+import threading
+from collections import OrderedDict
 from .dbutil_base import db_get, db_put, db_delete, register_table, prefix_iter
 from xutils.db import encode
 from xutils import interfaces
+from xutils.base import Storage
 
 
 register_table("_ttl", "有效期")
@@ -116,4 +120,113 @@ class DatabaseCache(interfaces.CacheInterface):
         for key, value in iter:
             prefix, cache_key = key.split(":",1)
             result.append(cache_key)
-        return result
\ No newline at end of file
+        return result
+
+class KvObjectCache(interfaces.ObjectCacheInterface):
+    """KV读取对象的LRU缓存, 按照序列化后的字节数限制容量
+
+    - 缓存的是marshal序列化的字节, 每次读取都会返回新的对象, 调用方修改不会污染缓存
+    - 写入/删除的时候失效对应的key, 同时递增版本号, 读取期间发生写入的结果不会被缓存
+    - get/put/delete 代理给 delegate, 兼容原来的 KvDataBase.cache
+    """
+
+    def __init__(self, delegate=None, max_bytes=16*1024*1024, max_object_bytes=64*1024):
+        if delegate == None:
+            delegate = interfaces.empty_cache
+        self.delegate = delegate # type: interfaces.CacheInterface
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self.total_bytes = 0
+        self.version = 0
+        self.lock = threading.RLock()
+        self.data = OrderedDict() # type: OrderedDict[str, bytes]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default_value=None):
+        return self.delegate.get(key, default_value)
+
+    def put(self, key, value, expire=-1, expire_random=600):
+        return self.delegate.put(key, value, expire=expire, expire_random=expire_random)
+
+    def delete(self, key):
+        return self.delegate.delete(key)
+
+    def get_version(self):
+        return self.version
+
+    def get_object(self, key=""):
+        with self.lock:
+            value_bytes = self.data.get(key)
+            if value_bytes == None:
+                self.misses += 1
+                return False, None
+            self.data.move_to_end(key)
+            self.hits += 1
+
+        value = marshal.loads(value_bytes)
+        if isinstance(value, dict):
+            value = Storage(**value)
+        return True, value
+
+    def put_object(self, key="", value=None, version=0):
+        if isinstance(value, dict):
+            value = dict(value)
+        try:
+            value_bytes = marshal.dumps(value)
+        except ValueError:
+            # 包含不支持marshal的类型
+            return
+        size = len(value_bytes)
+        if size > self.max_object_bytes or size > self.max_bytes:
+            return
+
+        with self.lock:
+            if version != self.version:
+                # 读取期间发生了写入, 放弃缓存
+                return
+            self._remove(key)
+            self.data[key] = value_bytes
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, old_bytes = self.data.popitem(last=False)
+                self.total_bytes -= len(old_bytes)
+                self.evictions += 1
+
+    def delete_object(self, key=""):
+        with self.lock:
+            self.version += 1
+            if self._remove(key):
+                self.invalidations += 1
+
+    def _remove(self, key=""):
+        old_bytes = self.data.pop(key, None)
+        if old_bytes == None:
+            return False
+        self.total_bytes -= len(old_bytes)
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.data.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            hit_rate = 0.0
+            if total > 0:
+                hit_rate = self.hits / total
+            return Storage(
+                count = len(self.data),
+                size = self.total_bytes,
+                max_size = self.max_bytes,
+                hits = self.hits,
+                misses = self.misses,
+                hit_rate = hit_rate,
+                evictions = self.evictions,
+                invalidations = self.invalidations,
+            )
@@ -13,6 +13,7 @@ from xutils.db.dbutil_base import (
     count_table, prefix_iter
 )
 from xutils.db.encode import encode_str, decode_str
+from xutils.db.binlog import BinLog
 from . import filters
 
 class KvHashTable:
@@ -34,6 +35,7 @@ class KvHashTable:
         self.user_name = user_name
         self.prefix = table_name
         self.first_table = first_table
+        self.binlog = BinLog.get_instance()
 
         if user_name != None and user_name != "":
             self.prefix += ":" + encode_str(user_name)
@@ -80,6 +82,11 @@ class KvHashTable:
         
         if batch != None:
             batch.put(row_key, value)
+            self.binlog.add_log("put", row_key, value, batch=batch)
+        elif self.binlog.is_enabled():
+            # binlog和数据在同一个批量操作中提交
+            with dbutil_base.create_write_batch() as batch:
+                self.put(key, value, batch=batch)
         else:
             db_put(row_key, value)
 
@@ -118,6 +125,10 @@ class KvHashTable:
 
         if batch != None:
             batch.delete(row_key)
+            self.binlog.add_log("delete", row_key, batch=batch)
+        elif self.binlog.is_enabled():
+            with dbutil_base.create_write_batch() as batch:
+                self.delete(key, batch=batch)
         else:
             db_delete(row_key)
     
@@ -127,7 +138,13 @@ class KvHashTable:
         db_keys = []
         for key in keys:
             db_keys.append(self.build_key(key))
-        dbutil_base.db_batch_delete(db_keys)
+        if self.binlog.is_enabled():
+            with dbutil_base.create_write_batch() as batch:
+                for db_key in db_keys:
+                    batch.delete(db_key)
+                    self.binlog.add_log("delete", db_key, batch=batch)
+        else:
+            dbutil_base.db_batch_delete(db_keys)
 
     def count(self, prefix = None):
         if prefix != None:
@@ -27,7 +27,10 @@ class IdGenerator:
         assert start_id > 0
         max_id_key = "_max_id:" + self.table_name
         key_bytes = max_id_key.encode("utf-8")
-        return base.get_db_instance().Increase(key_bytes, start_id=start_id)
+        try:
+            return base.get_db_instance().Increase(key_bytes, start_id=start_id)
+        finally:
+            base.delete_object_cache(max_id_key)
     
     def current_id_int(self):
         max_id_key = "_max_id:" + self.table_name
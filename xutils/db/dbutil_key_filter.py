@@ -0,0 +1,244 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 21:05:12
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 21:05:12
+@FilePath     : /xnote/xutils/db/dbutil_key_filter.py
+@Description  : key存在性过滤器
+
+写入前的检查(check_and_put/check_and_delete)需要先读一次旧值, 插入为主的场景下这些key基本都是新的
+- 每个表一个布隆过滤器, 第一次检查的时候扫描表的key加载, 之后的写入同步加入过滤器
+- 加载的时候不持有存储的写锁, 加载期间的写入先记录下来, 加载完成以后补充到过滤器; 加载期间的检查都返回可能存在
+- 布隆过滤器判断不存在的key一定不存在, 可以跳过查询
+- 最近写入的key缓存, 命中的key一定存在, 不需要计算布隆过滤器
+- 布隆过滤器不支持删除, 删除只会增加误判, 不影响正确性; 写入的数量超过容量以后丢弃, 下次检查的时候重新加载
+- 绕过驱动直接修改数据库文件的写入不会被记录, 和对象缓存的限制一样
+"""
+import math
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from xutils.base import Storage
+
+
+class BloomFilter:
+    """布隆过滤器"""
+
+    def __init__(self, capacity=1024, error_rate=0.01):
+        assert capacity > 0
+        self.capacity = capacity
+        self.error_rate = error_rate
+        bit_count = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.bit_count = max(64, bit_count)
+        self.hash_count = max(1, int(round(self.bit_count / capacity * math.log(2))))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # type: (bytes) -> list[int]
+        # 双重哈希模拟多个哈希函数
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, key):
+        # type: (bytes) -> None
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= (1 << (pos & 7))
+        self.count += 1
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def is_full(self):
+        return self.count > self.capacity
+
+    def estimate_error_rate(self):
+        """根据已经加入的数量估算误判率"""
+        return (1 - math.exp(-self.hash_count * self.count / self.bit_count)) ** self.hash_count
+
+    def memory_size(self):
+        return len(self.bits)
+
+
+class TableKeyFilter:
+    """单个表的key过滤器"""
+
+    def __init__(self, table_name=b""):
+        self.table_name = table_name
+        self.bloom = None # type: BloomFilter|None
+        self.checks = 0
+        # 布隆过滤器判断不存在, 跳过的查询次数
+        self.skipped = 0
+        # 布隆过滤器判断存在, 实际查询不存在
+        self.false_positives = 0
+        self.loads = 0
+        # 正在加载的时候写入的key, 加载完成以后加入布隆过滤器
+        self.pending = None # type: list[bytes]|None
+
+    def stats(self):
+        bloom = self.bloom
+        result = Storage(table_name = self.table_name.decode("utf-8"),
+                         key_count = 0, capacity = 0, memory = 0,
+                         checks = self.checks, skipped = self.skipped,
+                         false_positives = self.false_positives,
+                         estimate_error_rate = 0.0, loads = self.loads)
+        if bloom != None:
+            result.key_count = bloom.count
+            result.capacity = bloom.capacity
+            result.memory = bloom.memory_size()
+            result.estimate_error_rate = bloom.estimate_error_rate()
+        return result
+
+
+class KeyExistsFilter:
+    """KV存储的key存在性过滤器
+    load_func(table_name) 返回表的所有key的迭代器, 在锁外面执行
+    调用方需要在写入提交以后调用 on_put, 保证加载期间提交的key要么被扫描到, 要么被记录到pending
+    """
+
+    def __init__(self, load_func, count_func=None, recent_size=10000, min_capacity=1024, error_rate=0.01):
+        self.load_func = load_func
+        # count_func(table_name) 返回表的key数量, 用于计算容量, 这样加载的时候不需要把key都放到内存里
+        self.count_func = count_func
+        self.recent_size = recent_size
+        self.min_capacity = min_capacity
+        self.error_rate = error_rate
+        # 只保护过滤器自身的状态, 不会在持有锁的时候读取数据库
+        self.lock = threading.Lock()
+        self.tables = dict() # type: dict[bytes, TableKeyFilter]
+        # 最近写入的key, 一定存在
+        self.recent = OrderedDict() # type: OrderedDict[bytes, bool]
+        self.recent_hits = 0
+
+    def get_table_name(self, key):
+        # type: (bytes) -> bytes|None
+        pos = key.find(b":")
+        if pos <= 0:
+            return None
+        return key[:pos]
+
+    def _get_filter(self, table_name):
+        table_filter = self.tables.get(table_name)
+        if table_filter == None:
+            table_filter = TableKeyFilter(table_name)
+            self.tables[table_name] = table_filter
+        return table_filter
+
+    def _load(self, table_filter):
+        # type: (TableKeyFilter) -> None
+        """在锁外面加载布隆过滤器, 调用之前需要在锁里面设置pending"""
+        table_name = table_filter.table_name
+        try:
+            if self.count_func != None:
+                keys = self.load_func(table_name)
+                key_count = self.count_func(table_name)
+            else:
+                keys = list(self.load_func(table_name))
+                key_count = len(keys)
+            capacity = max(self.min_capacity, key_count * 2)
+            bloom = BloomFilter(capacity=capacity, error_rate=self.error_rate)
+            for key in keys:
+                bloom.add(key)
+        except:
+            with self.lock:
+                table_filter.pending = None
+            raise
+
+        with self.lock:
+            for key in table_filter.pending:
+                if key not in bloom:
+                    bloom.add(key)
+            table_filter.pending = None
+            table_filter.loads += 1
+            if not bloom.is_full():
+                # 超过容量的话下次检查的时候重新加载
+                table_filter.bloom = bloom
+
+    def may_exist(self, key):
+        # type: (bytes) -> bool
+        """返回False表示key一定不存在"""
+        table_name = self.get_table_name(key)
+        if table_name == None:
+            return True
+
+        with self.lock:
+            if key in self.recent:
+                self.recent_hits += 1
+                return True
+            table_filter = self._get_filter(table_name)
+            table_filter.checks += 1
+            bloom = table_filter.bloom
+            if bloom != None:
+                if key in bloom:
+                    return True
+                table_filter.skipped += 1
+                return False
+            if table_filter.pending != None:
+                # 其他线程正在加载
+                return True
+            table_filter.pending = []
+
+        self._load(table_filter)
+        with self.lock:
+            bloom = table_filter.bloom
+            if bloom == None or key in bloom:
+                return True
+            table_filter.skipped += 1
+            return False
+
+    def on_lookup(self, key, found):
+        # type: (bytes, bool) -> None
+        """记录查询结果, 用于统计实际的误判次数"""
+        if found:
+            return
+        table_name = self.get_table_name(key)
+        if table_name == None:
+            return
+        with self.lock:
+            table_filter = self.tables.get(table_name)
+            if table_filter != None and table_filter.bloom != None and key in table_filter.bloom:
+                table_filter.false_positives += 1
+
+    def on_put(self, key):
+        # type: (bytes) -> None
+        table_name = self.get_table_name(key)
+        if table_name == None:
+            return
+        with self.lock:
+            table_filter = self.tables.get(table_name)
+            if table_filter != None and table_filter.pending != None:
+                table_filter.pending.append(key)
+            if table_filter != None and table_filter.bloom != None and key not in table_filter.bloom:
+                table_filter.bloom.add(key)
+                if table_filter.bloom.is_full():
+                    # 超过容量以后误判率会快速上升, 下次检查的时候按照新的数量重新加载
+                    table_filter.bloom = None
+            self.recent[key] = True
+            self.recent.move_to_end(key)
+            while len(self.recent) > self.recent_size:
+                self.recent.popitem(last=False)
+
+    def on_delete(self, key):
+        # type: (bytes) -> None
+        with self.lock:
+            self.recent.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+            self.recent.clear()
+
+    def stats(self):
+        with self.lock:
+            table_stats = [self.tables[name].stats() for name in sorted(self.tables.keys())]
+            memory = sum([item.memory for item in table_stats])
+            return Storage(tables = table_stats, memory = memory,
+                           recent_count = len(self.recent),
+                           recent_hits = self.recent_hits)
@@ -12,7 +12,7 @@
 from urllib.parse import quote
 from xutils import Storage
 from xutils.db.dbutil_base import *
-from xutils.db.dbutil_table_index import TableIndex, TableIndexRepair
+from xutils.db.dbutil_table_index import TableIndex, TableIndexRepair, TableIndexBuilder, IndexRepairJob
 from xutils.db.encode import (
     decode_str,
     encode_index_value,
@@ -30,6 +30,7 @@ register_table("_max_id", "最大ID")
 register_table("_index", "通用索引")
 register_table("_meta", "表元信息")
 register_table("_idx_version", "索引版本")
+register_table("_index_repair", "索引修复进度")
 
 db = register_table("_repair_error", "修复错误记录")
 db.register_index("ctime")
@@ -391,7 +392,38 @@ class LdbTable:
         update_obj = obj
         self._put_obj(key, update_obj)
 
-    def rebuild_single_index(self, obj, user_name=None):
+    def update_by_key_in_batch(self, key, obj, batch, old_obj=None):
+        """在外部的批量操作中更新记录, 由调用方负责提交
+        @param {dict} old_obj 更新前的值, 用于更新索引
+        """
+        self._check_key(key)
+        self._check_value(obj, key=key)
+
+        obj[self.key_name] = key
+        obj[self.id_name] = self._get_id_from_key(key)
+        if old_obj != None:
+            self._format_value(key, old_obj)
+        batch.put(key, self._convert_to_db_row(obj))
+        self._update_index(old_obj, obj, batch)
+        if self.binlog_enabled:
+            self.binlog.add_log("put", key, obj, batch=batch, old_value=old_obj)
+
+    def delete_by_key_in_batch(self, key, batch, old_obj=None):
+        """在外部的批量操作中删除记录, 由调用方负责提交"""
+        self._check_before_delete(key)
+        if old_obj is None:
+            return
+        self._format_value(key, old_obj)
+        self._delete_index(old_obj, batch)
+        batch.delete(key)
+        if self.binlog_enabled:
+            self.binlog.add_log("delete", key, old_obj,
+                                batch=batch, old_value=old_obj)
+
+    def rebuild_single_index(self, obj, user_name=None, use_latest=False):
+        """重建单条记录的索引
+        :param {bool} use_latest: 使用数据库里面最新的值, obj可能是从快照读取的旧值
+        """
         self._check_value(obj)
         self._check_user_name(user_name)
 
@@ -399,6 +431,11 @@ class LdbTable:
         batch = create_write_batch()
         with get_write_lock(key):
             old_obj = get(key)
+            if use_latest:
+                if old_obj == None:
+                    # 快照之后被删除了, 删除的时候已经清理了索引
+                    return
+                obj = old_obj
             self._format_value(key, obj)
             self._update_index(old_obj, obj, batch,
                                force_update=True)
@@ -410,6 +447,19 @@ class LdbTable:
         repair.table_name = self.table_name
         repair.repair_index()
 
+    def create_repair_job(self, chunk_size=100, ops_per_second=0):
+        """创建增量修复索引的任务, 参考`IndexRepairJob`"""
+        return IndexRepairJob(self, LdbTable("_repair_error"),
+                              chunk_size=chunk_size, ops_per_second=ops_per_second)
+
+    def bulk_rebuild_index(self):
+        """批量重建索引, 只能在没有并发写入的场景使用(比如持有`get_write_lock()`)"""
+        if self.build_index_func != None:
+            # 自定义的索引只能逐条修复
+            self.repair_index()
+            return None
+        return TableIndexBuilder(self).build()
+
     def rebuild_index(self, version="v1"):
         """重建索引, 可以通过设置新的version值重新建立索引"""
         idx_version_key = "_idx_version:%s" % self.table_name
@@ -432,7 +482,13 @@ class LdbTable:
         for obj in obj_list:
             key = self._get_key_from_obj(obj)
             keys.append(key)
-        db_batch_delete(keys)
+        if not (self.binlog_enabled and self.binlog.is_enabled()):
+            db_batch_delete(keys)
+            return
+        with create_write_batch() as batch:
+            for key in keys:
+                batch.delete(key)
+                self.binlog.add_log("delete", key, batch=batch)
 
     def delete_by_id(self, id, user_name=None):
         id = str(id)
@@ -460,7 +516,7 @@ class LdbTable:
             batch.commit()
 
     def iter(self, offset=0, limit=20, reverse=False, key_from=None,
-             filter_func=None, where = None, fill_cache=False, user_name=None):
+             filter_func=None, where = None, fill_cache=False, user_name=None, snapshot=None):
         """返回一个遍历的迭代器
         :param {int} offset: 返回结果下标开始
         :param {int} limit:  返回结果最大数量
@@ -469,6 +525,7 @@ class LdbTable:
         :param {str} key_from: 开始的key，这里是相对的key，也就是不包含table_name
         :param {func} filter_func: 过滤函数
         :param {str} user_name: 用户标识
+        :param {object} snapshot: 数据库快照, 参考`DBSnapshot`
         """
         if key_from == "":
             key_from = None
@@ -489,7 +546,7 @@ class LdbTable:
 
         for key, value in prefix_iter(prefix, filter_func, offset, limit,
                                       reverse=reverse, include_key=True, key_from=key_from,
-                                      fill_cache=fill_cache):
+                                      fill_cache=fill_cache, snapshot=snapshot):
             yield self._format_value(key, value)
 
     def list(self, *args, **kw):
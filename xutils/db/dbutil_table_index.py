@@ -21,12 +21,17 @@ from xutils.db.encode import encode_index_value, clean_value_before_update, deco
 from xutils.db.dbutil_base import (
     db_delete, 
     db_get, 
+    db_put,
+    db_batch_get,
+    get_write_lock,
+    create_write_batch,
     validate_obj, 
     validate_str, 
     validate_dict, 
     prefix_iter, 
     delete_index_count_cache,
     IndexInfo,
+    DBSnapshot,
 )
 from xutils.db import dbutil_base
 from xutils.interfaces import BatchInterface
@@ -191,6 +196,9 @@ class TableIndexRepair:
         self.repair_error_db = error_db
         self.table_name = ""
         self.debug = False
+        # 无效索引批量删除
+        self.delete_batch = create_write_batch()
+        self.delete_batch_size = 1000
     
     def current_time(self):
         return time.strftime('%Y-%m-%d %H:%M:%S')
@@ -211,42 +219,55 @@ class TableIndexRepair:
         if len(db.index_names) == 0:
             return
 
+        # 在快照上遍历, 修复过程中的写入不会导致重复或者遗漏, 写入会自己维护索引
+        with DBSnapshot() as snapshot:
+            self.do_repair_index_on_snapshot(snapshot)
+
+        # 清理count缓存
+        for name in db.index_names:
+            delete_index_count_cache(db.table_name, name)
+
+    def do_repair_index_on_snapshot(self, snapshot):
+        db = self.db
+
         # 先删除无效的索引，这样速度更快
         for name in db.index_names:
             prefix1 = "_index$%s$%s" % (db.table_name, name)      # v1版本的索引前缀
             prefix2 = IndexInfo.build_prefix(db.table_name, name) # v2版本的索引前缀
-            self.delete_invalid_index(name, prefix1)
-            self.delete_invalid_index(name, prefix2)
+            self.delete_invalid_index(name, prefix1, snapshot=snapshot)
+            self.delete_invalid_index(name, prefix2, snapshot=snapshot)
 
-        for value in db.iter(limit=-1):
-            if db._need_check_user:
-                key = value._key
-                assert xutils.is_str(key)
-                try:
-                    parts = key.split(":")
-                    if len(parts) != 3:
-                        logging.error("invalid key: %s", key)
-                        error_log = ErrorLog()
-                        error_log.key = key
-                        error_log.value = value
-                        error_log.type = "record"
-                        error_log.ctime = self.current_time()
-                        self.repair_error_db.insert(error_log)
-                        db_delete(key)
-                        continue
-                    table_name, user_name, id = key.split(":")
-                    user_name = decode_str(user_name)
-                except ValueError:
-                    xutils.print_exc()
-                    logging.error("invalid record key: %s", key)
-                    continue
-                db.rebuild_single_index(value, user_name=user_name)
-            else:
-                db.rebuild_single_index(value)
-        
-        # 清理count缓存
-        for name in db.index_names:
-            delete_index_count_cache(db.table_name, name)
+        for value in db.iter(limit=-1, snapshot=snapshot):
+            user_name = self.check_record(value)
+            if user_name is False:
+                continue
+            db.rebuild_single_index(value, user_name=user_name, use_latest=True)
+
+    def check_record(self, value):
+        """检查记录的key, 返回用户名, 无效的记录返回False"""
+        db = self.db
+        if not db._need_check_user:
+            return None
+        key = value._key
+        assert xutils.is_str(key)
+        try:
+            parts = key.split(":")
+            if len(parts) != 3:
+                logging.error("invalid key: %s", key)
+                error_log = ErrorLog()
+                error_log.key = key
+                error_log.value = value
+                error_log.type = "record"
+                error_log.ctime = self.current_time()
+                self.repair_error_db.insert(error_log)
+                db_delete(key)
+                return False
+            table_name, user_name, id = key.split(":")
+            return decode_str(user_name)
+        except ValueError:
+            xutils.print_exc()
+            logging.error("invalid record key: %s", key)
+            return False
 
     def do_delete(self, key):
         if self.debug:
@@ -255,7 +276,13 @@ class TableIndexRepair:
         if not self.is_index_key(key):
             logging.warning("Invalid index key:(%s)", key)
             return
-        db_delete(key)
+        self.delete_batch.delete(key)
+        if self.delete_batch.size() >= self.delete_batch_size:
+            self.flush_delete()
+
+    def flush_delete(self):
+        self.delete_batch.commit()
+        self.delete_batch = create_write_batch()
     
     def is_index_key(self, key):
         return key.startswith("_index$") or key.startswith(self.table_name + "$")
@@ -268,63 +295,314 @@ class TableIndexRepair:
             return getattr(record, key)
         return None
 
-    def delete_invalid_index(self, index_name, index_prefix):
-        db = self.db
+    def get_table_index(self, index_name):
         index_info = dbutil_base.IndexInfo.get_table_index_info(self.table_name, index_name)
         assert isinstance(index_info, IndexInfo)
-        index = TableIndex(index_info)
-
-        for old_key, index_object in prefix_iter(index_prefix, include_key=True):
-            if isinstance(index_object, dict):
-                # copy
-                record = index_object.get("value")
-                record_key = index_object.get("key")
-            else:
-                # ref
-                record_key = index_object
-                record = db_get(record_key)
+        return TableIndex(index_info)
+
+    def delete_invalid_index(self, index_name, index_prefix, snapshot=None):
+        index = self.get_table_index(index_name)
+        for old_key, index_object in prefix_iter(index_prefix, include_key=True, snapshot=snapshot):
+            self.check_index(index, index_name, old_key, index_object)
+        self.flush_delete()
+
+    def check_index(self, index, index_name, old_key, index_object):
+        """检查单个索引, 无效的索引加入删除批次"""
+        db = self.db
+        if isinstance(index_object, dict):
+            # copy
+            record = index_object.get("value")
+            record_key = index_object.get("key")
+        else:
+            # ref
+            record_key = index_object
+            record = db_get(record_key)
+        
+        # record_key是主数据的key
             
-            # record_key是主数据的key
-                
-            if record is None:
-                logging.debug("empty record, key:(%s), record_id:(%s)",
-                              old_key, record_key)
-                self.do_delete(old_key)
-                continue
+        if record is None:
+            logging.debug("empty record, key:(%s), record_id:(%s)",
+                          old_key, record_key)
+            self.do_delete(old_key)
+            return
 
-            if not isinstance(record_key, str):
-                logging.debug("invalid record key, key:(%s), record_id:(%s)",
-                              old_key, record_key)
+        if not isinstance(record_key, str):
+            logging.debug("invalid record key, key:(%s), record_id:(%s)",
+                          old_key, record_key)
+            self.do_delete(old_key)
+            return
+
+        user_name = None
+        encoded_index_value = index.get_index_value(record)
+        record_id = db._get_id_from_key(record_key)
+
+        if db._need_check_user:
+            try:
+                parser = KeyParser(record_key)
+                table_name = parser.pop_left()
+                user_name = parser.pop_left()
+                user_name = decode_str(user_name)
+            except:
+                logging.error("invalid key: (%s)", record_key)
+                error_log = ErrorLog()
+                error_log.key = old_key
+                error_log.value = str(record_key)
+                error_log.type = "index"
+                error_log.ctime = self.current_time()
+                self.repair_error_db.insert(error_log)
                 self.do_delete(old_key)
+                return
+
+        prefix = db._get_index_prefix(index_name, user_name)
+        new_key = db._build_key_no_prefix(
+            prefix, encoded_index_value, record_id)
+
+        if new_key != old_key:
+            logging.debug("index dismatch, key:(%s), record_id:(%s), correct_key:(%s)",
+                          old_key, record_key, new_key)
+            self.do_delete(old_key)
+
+
+class IndexRepairPhase:
+    index = "index"   # 检查索引, 删除无效的索引
+    record = "record" # 遍历记录, 重建索引
+
+
+class IndexRepairJob:
+    """增量的索引修复任务, 由定时任务分多次执行
+    - 每次处理一小批数据, 进度保存在`_index_repair:<table_name>`, 中断以后从检查点继续
+    - 一批记录的索引合并成一次批量写入
+    - 按照每秒处理的数量限速, 避免影响正常的请求
+    """
+
+    checkpoint_prefix = "_index_repair:"
+
+    def __init__(self, db, error_db, chunk_size=100, ops_per_second=0):
+        self.db = db
+        self.repair = TableIndexRepair(db, error_db)
+        self.repair.table_name = db.table_name
+        self.chunk_size = chunk_size
+        # 每秒处理的数量, 0表示不限速
+        self.ops_per_second = ops_per_second
+        self.checkpoint_key = self.checkpoint_prefix + db.table_name
+        self.state = self.load_checkpoint()
+
+    def load_checkpoint(self):
+        # type: () -> Storage|None
+        state = db_get(self.checkpoint_key)
+        if state == None:
+            return None
+        return Storage(**state)
+
+    def save_checkpoint(self):
+        self.state.update_time = time.time()
+        db_put(self.checkpoint_key, self.state)
+
+    def start(self):
+        """开始一次新的修复, 会覆盖之前的进度"""
+        now = time.time()
+        self.state = Storage(table_name = self.db.table_name,
+                             phase = IndexRepairPhase.index,
+                             index_pos = 0,
+                             last_key = "",
+                             index_count = 0,
+                             record_count = 0,
+                             start_time = now,
+                             update_time = now,
+                             done = len(self.db.index_names) == 0)
+        self.save_checkpoint()
+
+    def is_running(self):
+        return self.state != None and not self.state.done
+
+    def get_index_prefixes(self):
+        db = self.db
+        result = []
+        for name in db.index_names:
+            result.append((name, "_index$%s$%s" % (db.table_name, name)))      # v1版本的索引前缀
+            result.append((name, IndexInfo.build_prefix(db.table_name, name))) # v2版本的索引前缀
+        return result
+
+    def run(self, max_seconds=10.0):
+        """执行一段时间, 返回是否已经完成"""
+        if not self.is_running():
+            return True
+        deadline = time.time() + max_seconds
+        while not self.state.done and time.time() < deadline:
+            start_time = time.time()
+            count = self.run_chunk()
+            self.save_checkpoint()
+            self.throttle(count, time.time() - start_time)
+        if self.state.done:
+            delete_index_count_cache_by_table(self.db)
+        return self.state.done
+
+    def throttle(self, count, cost_time):
+        if self.ops_per_second <= 0 or count == 0:
+            return
+        sleep_time = count / self.ops_per_second - cost_time
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+
+    def run_chunk(self):
+        if self.state.phase == IndexRepairPhase.index:
+            return self.check_index_chunk()
+        return self.rebuild_record_chunk()
+
+    def iter_chunk(self, prefix, parse_json=True):
+        """从检查点之后读取一批数据, 检查点的key可能已经被删除了, 所以不能使用offset跳过"""
+        last_key = self.state.last_key
+        key_from = None
+        if last_key != "":
+            key_from = last_key
+        count = 0
+        for key, value in prefix_iter(prefix, include_key=True, key_from=key_from,
+                                      limit=self.chunk_size + 1, parse_json=parse_json):
+            if key == last_key:
+                continue
+            yield key, value
+            count += 1
+            if count >= self.chunk_size:
+                break
+
+    def check_index_chunk(self):
+        state = self.state
+        prefixes = self.get_index_prefixes()
+        if state.index_pos >= len(prefixes):
+            state.phase = IndexRepairPhase.record
+            state.last_key = ""
+            return 0
+
+        index_name, prefix = prefixes[state.index_pos]
+        index = self.repair.get_table_index(index_name)
+        count = 0
+        for key, value in self.iter_chunk(prefix):
+            self.repair.check_index(index, index_name, key, value)
+            state.last_key = key
+            count += 1
+        self.repair.flush_delete()
+
+        state.index_count += count
+        if count < self.chunk_size:
+            # 当前索引检查完成
+            state.index_pos += 1
+            state.last_key = ""
+        return count
+
+    def rebuild_record_chunk(self):
+        state = self.state
+        db = self.db
+        keys = []
+        count = 0
+        for key, value in self.iter_chunk(db.prefix):
+            state.last_key = key
+            count += 1
+            value = db._format_value(key, value)
+            if self.repair.check_record(value) is False:
                 continue
+            keys.append(key)
+
+        # 持有写锁读取最新的值, 和正常的写入互斥
+        with get_write_lock():
+            batch = create_write_batch()
+            records = db_batch_get(keys)
+            for key in keys:
+                record = records.get(key)
+                if record == None:
+                    # 已经被删除了
+                    continue
+                record = db._format_value(key, record)
+                db._update_index(record, record, batch, force_update=True)
+            batch.commit()
+
+        state.record_count += count
+        if count < self.chunk_size:
+            state.done = True
+        return count
+
 
-            user_name = None
-            encoded_index_value = index.get_index_value(record)
-            record_id = db._get_id_from_key(record_key)
+def delete_index_count_cache_by_table(db):
+    for name in db.index_names:
+        delete_index_count_cache(db.table_name, name)
 
-            if db._need_check_user:
+
+class TableIndexBuilder:
+    """批量重建索引, 用于导入数据之后一次性生成索引
+    - 先清空旧的索引, 再遍历一次主数据生成所有的索引
+    - 不读取旧的索引值, 索引按照key排序以后批量写入
+    - 不处理并发写入, 只能在导入这种独占的场景使用
+    """
+
+    def __init__(self, db, batch_size=5000):
+        self.db = db
+        self.batch_size = batch_size
+        self.record_count = 0
+        self.index_count = 0
+        self.error_count = 0
+
+    def drop_index(self):
+        db = self.db
+        keys = []
+        for name in db.index_names:
+            prefix1 = "_index$%s$%s" % (db.table_name, name)      # v1版本的索引前缀
+            prefix2 = IndexInfo.build_prefix(db.table_name, name) # v2版本的索引前缀
+            for prefix in (prefix1, prefix2):
+                for key, value in prefix_iter(prefix, include_key=True, parse_json=False):
+                    keys.append(key)
+        # 遍历结束以后再删除, 避免删除影响遍历的游标
+        for start in range(0, len(keys), self.batch_size):
+            batch = create_write_batch()
+            for key in keys[start:start+self.batch_size]:
+                batch.delete(key)
+            batch.commit()
+        return len(keys)
+
+    def build_index_items(self, index, obj):
+        obj_key = obj.get(index.key_name)
+        index_key, index_value = index.get_index_key(obj)
+        if index.index_info.ignore_none_value and index_value == chr(0):
+            return None
+        if index.index_type == "copy":
+            clean_obj = dict(**obj)
+            clean_value_before_update(clean_obj)
+            return index_key, dict(key = obj_key, value = clean_obj)
+        return index_key, obj_key
+
+    def flush(self, items):
+        # 按照key排序以后写入, 对B树和LSM树都更友好
+        items.sort(key = lambda item: item[0])
+        batch = create_write_batch()
+        for index_key, index_value in items:
+            batch.put(index_key, index_value, check_table=False)
+        batch.commit()
+        self.index_count += len(items)
+
+    def build(self):
+        db = self.db
+        if len(db.indexes) == 0:
+            return self
+        start_time = time.time()
+        self.drop_index()
+
+        items = []
+        for obj in db.iter(limit=-1):
+            self.record_count += 1
+            for index in db.indexes:
                 try:
-                    parser = KeyParser(record_key)
-                    table_name = parser.pop_left()
-                    user_name = parser.pop_left()
-                    user_name = decode_str(user_name)
+                    item = self.build_index_items(index, obj)
                 except:
-                    logging.error("invalid key: (%s)", record_key)
-                    error_log = ErrorLog()
-                    error_log.key = old_key
-                    error_log.value = str(record_key)
-                    error_log.type = "index"
-                    error_log.ctime = self.current_time()
-                    self.repair_error_db.insert(error_log)
-                    self.do_delete(old_key)
+                    self.error_count += 1
+                    logging.error("build index failed, key:(%s)", obj.get(index.key_name))
                     continue
+                if item != None:
+                    items.append(item)
+            if len(items) >= self.batch_size:
+                self.flush(items)
+                items = []
+        self.flush(items)
 
-            prefix = db._get_index_prefix(index_name, user_name)
-            new_key = db._build_key_no_prefix(
-                prefix, encoded_index_value, record_id)
-
-            if new_key != old_key:
-                logging.debug("index dismatch, key:(%s), record_id:(%s), correct_key:(%s)",
-                              old_key, record_key, new_key)
-                self.do_delete(old_key)
-
+        for name in db.index_names:
+            delete_index_count_cache(db.table_name, name)
+        logging.info("build index done, table:(%s), records:(%d), indexes:(%d), cost_time:(%.2fs)",
+                     db.table_name, self.record_count, self.index_count, time.time() - start_time)
+        return self
@@ -69,6 +69,115 @@ class ConnectionWrapper:
         self.close()        
 
 
+class MySQLSnapshot:
+    """基于一致性读事务的只读快照
+    InnoDB在REPEATABLE READ级别下, 事务内的查询都读取事务开始时的MVCC版本, 不会加锁, 也不会阻塞写入
+    """
+
+    def __init__(self, db_instance, scan_limit=200):
+        # type: (web.db.MySQLDB, int) -> None
+        self.scan_limit = scan_limit
+        # 使用独立的连接, 不影响连接池里面的其他查询
+        self.conn = db_instance._connect(db_instance.keywords)
+        self.lock = threading.RLock()
+        self.closed = False
+        try:
+            self._execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            self._execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+        except Exception:
+            self.conn.close()
+            raise
+
+    def _execute(self, sql, args=None):
+        with self.lock:
+            if self.closed:
+                raise Exception("snapshot is closed")
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(sql, args)
+                if cursor.description == None:
+                    return []
+                return list(cursor.fetchall())
+            finally:
+                cursor.close()
+
+    def mysql_to_py(self, obj):
+        if isinstance(obj, bytearray):
+            return bytes(obj)
+        return obj
+
+    def Get(self, key):
+        rows = self._execute("SELECT value FROM kv_store WHERE `key`=%s", (key,))
+        if len(rows) > 0:
+            return self.mysql_to_py(rows[0][0])
+        return None
+
+    def BatchGet(self, key_list):
+        # type: (list[bytes]) -> dict[bytes, bytes]
+        result = dict()
+        if len(key_list) == 0:
+            return result
+        sql = "SELECT `key`, value FROM kv_store WHERE `key` IN (%s)" % ",".join(["%s"] * len(key_list))
+        for key, value in self._execute(sql, tuple(key_list)):
+            result[self.mysql_to_py(key)] = self.mysql_to_py(value)
+        return result
+
+    def RangeIter(self, key_from=None, key_to=None,
+                  reverse=False, include_value=True, fill_cache=False):
+        """区间查询, 参数和`MySQLKV.RangeIterRaw`一致, 分页查询都在同一个事务里面"""
+        if key_from == None:
+            key_from = b''
+        if key_to == None:
+            key_to = b'\xff'
+
+        limit = self.scan_limit
+        if include_value:
+            sql = "SELECT `key`, value FROM kv_store"
+        else:
+            sql = "SELECT `key` FROM kv_store"
+        sql += " WHERE `key` >= %s AND `key` <= %s"
+        if reverse:
+            sql += " ORDER BY `key` DESC"
+        else:
+            sql += " ORDER BY `key` ASC"
+        sql += " LIMIT %d" % (limit + 1)
+
+        while True:
+            rows = self._execute(sql, (key_from, key_to))
+            for row in rows[:limit]:
+                key = self.mysql_to_py(row[0])
+                if include_value:
+                    if row[1] == None:
+                        continue
+                    yield key, self.mysql_to_py(row[1])
+                else:
+                    yield key
+
+            if len(rows) <= limit:
+                return
+
+            # 最后一行是下一页的第一行
+            last_key = self.mysql_to_py(rows[-1][0])
+            if reverse:
+                key_to = last_key
+            else:
+                key_from = last_key
+
+    def Count(self, key_from=b'', key_to=b'\xff'):
+        rows = self._execute("SELECT COUNT(*) FROM kv_store WHERE `key` >= %s AND `key` <= %s", (key_from, key_to))
+        return self.mysql_to_py(rows[0][0])
+
+    def Release(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self.conn.rollback()
+            finally:
+                self.conn.close()
+
+
 class MySQLKVOld:
     holder = Holder()
     lock = threading.RLock()
@@ -511,7 +620,11 @@ class MySQLKV(interfaces.DBInterface):
         yield from self.RangeIterRaw(*args, **kw)
 
     def CreateSnapshot(self):
-        raise NotImplementedError("CreateSnapshot")
+        return MySQLSnapshot(self.db, scan_limit=self.scan_limit)
+
+    def ReleaseSnapshot(self, snapshot):
+        if isinstance(snapshot, MySQLSnapshot):
+            snapshot.Release()
 
     def Write(self, batch, sync=False):
         assert isinstance(batch, interfaces.BatchInterface)
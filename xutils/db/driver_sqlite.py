@@ -14,6 +14,7 @@ import time
 
 from xutils.mem_util import log_mem_info_deco
 from xutils import interfaces
+from xutils.db.dbutil_key_filter import KeyExistsFilter
 
 class FreeLock:
 
@@ -54,12 +55,137 @@ class Holder(threading.local):
         if self.db != None:
             self.db.close()
 
+class CursorHolder(threading.local):
+    """每个线程缓存一个游标, 连接变化的时候重新创建"""
+    def __init__(self):
+        self.conn = None # type: sqlite3.Connection|None
+        self.cursor = None # type: sqlite3.Cursor|None
+
+
+class SqliteSnapshot:
+    """基于WAL读事务的只读快照
+    - 使用独立的连接开启读事务, 第一次查询以后读事务固定在当时的WAL位置, 之后的写入都不可见
+    - WAL模式下读事务不会阻塞写入, 只是快照释放之前WAL不能完全checkpoint, 所以用完要及时释放
+    """
+
+    def __init__(self, db_file, range_page_size=100, busy_timeout=5.0):
+        self.db_file = db_file
+        self.range_page_size = range_page_size
+        # 自动提交模式, 事务由自己控制
+        self.conn = sqlite3.connect(db_file, timeout=busy_timeout,
+                                    isolation_level=None, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.closed = False
+        try:
+            self.conn.execute("BEGIN")
+            # 读一次数据库才会真正开启读事务
+            self.conn.execute("SELECT 1 FROM kv_store LIMIT 1").fetchall()
+        except Exception:
+            self.conn.close()
+            raise
+
+    def _execute(self, sql, args=()):
+        # type: (str, tuple) -> list
+        with self.lock:
+            self._check_closed()
+            return self.conn.execute(sql, args).fetchall()
+
+    def _check_closed(self):
+        if self.closed:
+            raise Exception("snapshot is closed")
+
+    def Get(self, key):
+        rows = self._execute("SELECT value FROM kv_store WHERE `key` = ?", (key,))
+        if len(rows) > 0:
+            return rows[0][0]
+        return None
+
+    def BatchGet(self, key_list):
+        # type: (list[bytes]) -> dict[bytes, bytes]
+        result = dict()
+        if len(key_list) == 0:
+            return result
+        sql = "SELECT `key`, value FROM kv_store WHERE `key` IN (%s)" % ",".join(["?"] * len(key_list))
+        for key, value in self._execute(sql, tuple(key_list)):
+            result[key] = value
+        return result
+
+    def RangeIter(self, key_from=None, key_to=None,
+                  reverse=False, include_value=True, fill_cache=False):
+        """区间查询, 参数和`SqliteKV.RangeIter`一致"""
+        if key_from == None:
+            key_from = b''
+        if key_to == None:
+            key_to = b'\xff'
+
+        if include_value:
+            sql = "SELECT `key`, value FROM kv_store WHERE `key` >= ? AND `key` <= ?"
+        else:
+            sql = "SELECT `key` FROM kv_store WHERE `key` >= ? AND `key` <= ?"
+        if reverse:
+            sql += " ORDER BY `key` DESC"
+        else:
+            sql += " ORDER BY `key` ASC"
+
+        with self.lock:
+            self._check_closed()
+            cursor = self.conn.cursor()
+            cursor.execute(sql, (key_from, key_to))
+        try:
+            while True:
+                with self.lock:
+                    self._check_closed()
+                    rows = cursor.fetchmany(self.range_page_size)
+                if len(rows) == 0:
+                    return
+                for row in rows:
+                    if include_value:
+                        if row[1] == None:
+                            continue
+                        yield row[0], row[1]
+                    else:
+                        yield row[0]
+        finally:
+            with self.lock:
+                if not self.closed:
+                    cursor.close()
+
+    def Count(self, key_from=b'', key_to=b'\xff'):
+        rows = self._execute("SELECT COUNT(*) FROM kv_store WHERE `key` >= ? AND `key` <= ?", (key_from, key_to))
+        return rows[0][0]
+
+    def Release(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self.conn.execute("ROLLBACK")
+            finally:
+                self.conn.close()
+
+    def __del__(self):
+        try:
+            self.Release()
+        except Exception:
+            pass
+
+
 class SqliteKV(interfaces.DBInterface):
 
     _lock = interfaces.get_write_lock()
     
     sql_logger = interfaces.SqlLoggerInterface()
 
+    # UPSERT语法从3.24.0开始支持
+    upsert_supported = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+    UPSERT_SQL = "INSERT INTO kv_store (`key`, value) VALUES (?, ?) ON CONFLICT(`key`) DO UPDATE SET value = excluded.value"
+    UPDATE_SQL = "UPDATE kv_store SET value = ? WHERE `key` = ?"
+    INSERT_IGNORE_SQL = "INSERT OR IGNORE INTO kv_store (`key`, value) VALUES (?, ?)"
+    INSERT_SQL = "INSERT INTO kv_store (`key`, value) VALUES (?, ?)"
+    DELETE_SQL = "DELETE FROM kv_store WHERE `key` = ?"
+
     def __init__(self, db_file, snapshot=None,
                  block_cache_size=None,
                  write_buffer_size=None,
@@ -71,10 +197,20 @@ class SqliteKV(interfaces.DBInterface):
         self.debug = debug
         self.config_dict = config_dict
         self.is_snapshot = False
+        self._cursor_holder = CursorHolder()
+        self.journal_mode = "delete"
+        # 区间查询每次从游标读取的行数
+        self.range_page_size = config_dict.get("sqlite_range_page_size") or 100
         self.init_journal_mode()
+        # 流式游标会一直持有读锁, DELETE模式下会阻塞其他连接的写入, 所以只在WAL模式下开启
+        self.range_stream = config_dict.get("sqlite_range_stream", True) and self.journal_mode == "wal"
+        # key存在性过滤器, 写入前的检查可以跳过一定不存在的key
+        self.key_filter = None # type: KeyExistsFilter|None
+        if config_dict.get("sqlite_key_filter", True):
+            self.key_filter = KeyExistsFilter(self._load_table_keys, self._count_table_keys)
 
         if snapshot != None:
-            # sqlite并不支持快照，这里模拟下
+            # 快照使用`CreateSnapshot`创建, 这个参数只是为了和leveldb的接口保持一致
             self.is_snapshot = True
 
     def init_journal_mode(self):
@@ -89,6 +225,7 @@ class SqliteKV(interfaces.DBInterface):
             if config_dict != None and journal_mode == "wal":
                 # WAL模式，并发度更高
                 self.db.query("PRAGMA journal_mode = WAL;")
+                self.journal_mode = "wal"
             else:
                 self.db.query("PRAGMA journal_mode = DELETE;")
 
@@ -99,8 +236,66 @@ class SqliteKV(interfaces.DBInterface):
         """PEP 249要求 Python 数据库驱动程序默认以手动提交模式运行"""
         pass
 
+    def _get_cursor(self):
+        # type: () -> sqlite3.Cursor
+        conn = self.db.ctx.db
+        holder = self._cursor_holder
+        if holder.conn is not conn:
+            holder.conn = conn
+            holder.cursor = conn.cursor()
+        return holder.cursor
+
+    def _commit_if_needed(self):
+        """不在事务中的时候自动提交, 和web.db的行为保持一致"""
+        ctx = self.db.ctx
+        if not ctx.transactions:
+            ctx.commit()
+
+    def _rollback_if_needed(self):
+        ctx = self.db.ctx
+        if not ctx.transactions:
+            ctx.rollback()
+
+    def _execute_many(self, sql, rows):
+        # type: (str, list[tuple]) -> None
+        if len(rows) == 0:
+            return
+        self._get_cursor().executemany(sql, rows)
+
+    def _upsert_many(self, rows):
+        # type: (list[tuple[bytes, bytes]]) -> None
+        """批量写入, 不使用 REPLACE INTO, 因为 REPLACE INTO 会直接删除数据重新插入, rowid会一直增加"""
+        if len(rows) == 0:
+            return
+        if self.upsert_supported:
+            self._execute_many(self.UPSERT_SQL, rows)
+        else:
+            rows = self._insert_new_rows(rows)
+            # 先更新已经存在的key, 再插入不存在的key
+            self._execute_many(self.UPDATE_SQL, [(value, key) for key, value in rows])
+            self._execute_many(self.INSERT_IGNORE_SQL, rows)
+
+    def _insert_new_rows(self, rows):
+        # type: (list[tuple[bytes, bytes]]) -> list[tuple[bytes, bytes]]
+        """一定不存在的key直接插入, 返回剩下需要更新的行"""
+        if self.key_filter == None:
+            return rows
+        new_rows = []
+        other_rows = []
+        for row in rows:
+            if self.key_filter.may_exist(row[0]):
+                other_rows.append(row)
+            else:
+                new_rows.append(row)
+        try:
+            self._execute_many(self.INSERT_SQL, new_rows)
+        except sqlite3.IntegrityError:
+            # 有绕过驱动的写入, 全部走更新流程
+            return rows
+        return other_rows
+
     def log_sql(self, sql="", vars=None, prefix=""):
-        if self.sql_logger:
+        if self.debug and self.sql_logger:
             raw_sql = self.db.query(sql, vars=vars, _test=True)
             self.sql_logger.append(f"{prefix} {raw_sql}")
 
@@ -111,10 +306,45 @@ class SqliteKV(interfaces.DBInterface):
         r_iter = self.db.query(sql, vars=vars)
         result = list(r_iter)
         self.log_sql(sql, vars=vars, prefix="[Get]")
+        if self.key_filter != None:
+            self.key_filter.on_lookup(key, len(result) > 0)
         if len(result) > 0:
             return result[0].value
         return None
 
+    def _load_table_keys(self, table_name):
+        """分页读取表的key, 返回key的迭代器, 不持有写锁, 也不会长时间持有读锁"""
+        key_from = table_name + b":"
+        key_to = table_name + b":\xff"
+        for key in self.RangeIterNoLock(key_from, key_to, include_value=False, page_size=1000):
+            yield bytes(key)
+
+    def _count_table_keys(self, table_name):
+        # type: (bytes) -> int
+        return self.Count(table_name + b":", table_name + b":\xff")
+
+    def MayExist(self, key):
+        # type: (bytes) -> bool
+        if self.key_filter == None:
+            return True
+        # 过滤器有自己的锁, 加载过程中并发写入的key通过_on_put补充
+        return self.key_filter.may_exist(key)
+
+    def _on_put(self, keys):
+        if self.key_filter != None:
+            for key in keys:
+                self.key_filter.on_put(key)
+
+    def _on_delete(self, keys):
+        if self.key_filter != None:
+            for key in keys:
+                self.key_filter.on_delete(key)
+
+    def GetKeyFilterStats(self):
+        if self.key_filter == None:
+            return None
+        return self.key_filter.stats()
+
 
     def BatchGet(self, key_list):
         # type: (list[bytes]) -> dict[bytes, bytes]
@@ -162,22 +392,21 @@ class SqliteKV(interfaces.DBInterface):
 
         with self._lock:
             try:
-                # 不使用 REPLACE INTO, 因为 REPLACE INTO 会直接删除数据重新插入, rowid会一直增加
-                # UPSERT语法比较晚支持，暂时不用
-                if self._exists(key, cursor=cursor):
-                    sql = "UPDATE kv_store SET value = $value WHERE `key` = $key;"
-                else:
-                    sql = "INSERT INTO kv_store (`key`, value) VALUES ($key, $value);"
-                vars = dict(key=key, value=value)
-                self.db.query(sql, vars=vars)
-                self.log_sql(sql, vars=vars, prefix="[Put]")
-            except Exception as e:
-                raise e
+                self._upsert_many([(key, value)])
+                self._commit_if_needed()
+            except Exception:
+                self._rollback_if_needed()
+                raise
+            self._on_put([key])
+            if self.debug:
+                self.sql_logger.append(f"[Put] key={key!r}")
 
     def Insert(self, key=b'', value=b''):
         insert_sql = "INSERT INTO kv_store (`key`, value) VALUES ($key, $value)"
         vars = dict(key=key,value=value)
-        self.db.query(insert_sql, vars=vars)
+        with self._lock:
+            self.db.query(insert_sql, vars=vars)
+            self._on_put([key])
 
     def Delete(self, key, sync=False):
         return self.doDelete(key, sync)
@@ -191,66 +420,91 @@ class SqliteKV(interfaces.DBInterface):
             self.sql_logger.append(f"Delete: {raw_sql}")
 
         with self._lock:
+            self._on_delete([key])
             return self.db.query(sql, vars=vars)
 
     def RangeIter(self, *args, **kw):
-        yield from self.RangeIterNoLock(*args, **kw)
-
-    def RangeIterNoLock(self, key_from=None, key_to=None,
-                        reverse=False, include_value=True, fill_cache=False):
-        has_next = True
-        limit = 100
-
-        sql_builder = []
+        if self.range_stream:
+            yield from self.RangeIterStream(*args, **kw)
+        else:
+            yield from self.RangeIterNoLock(*args, **kw)
 
+    def _build_range_sql(self, include_value=True, reverse=False, where="`key` >= ? AND `key` <= ?"):
         if include_value:
-            sql_builder.append("SELECT `key`, value FROM kv_store")
+            sql = "SELECT `key`, value FROM kv_store"
         else:
-            # 只包含key
-            sql_builder.append("SELECT `key` FROM kv_store")
-
-        sql_builder.append("WHERE `key` >= $key_from AND `key` <= $key_to")
-
+            # 只查询key, 可以直接使用主键索引, 不读取value
+            sql = "SELECT `key` FROM kv_store"
+        sql += " WHERE " + where
         if reverse:
-            sql_builder.append("ORDER BY key DESC")
+            sql += " ORDER BY `key` DESC"
         else:
-            sql_builder.append("ORDER BY key ASC")
+            sql += " ORDER BY `key` ASC"
+        return sql
 
-        sql_builder.append("LIMIT %s" % (limit+1))
-        sql_builder.append(";")
-
-        sql = " ".join(sql_builder)
+    def _iter_rows(self, rows, include_value=True):
+        for row in rows:
+            if include_value:
+                if row[1] == None:
+                    continue
+                yield row[0], row[1]
+            else:
+                yield row[0]
+
+    def RangeIterStream(self, key_from=None, key_to=None,
+                        reverse=False, include_value=True, fill_cache=False, page_size=None):
+        """使用一个游标流式读取区间数据"""
+        if key_from == None:
+            key_from = b''
+        if key_to == None:
+            key_to = b'\xff'
+        if page_size == None:
+            page_size = self.range_page_size
+
+        sql = self._build_range_sql(include_value, reverse)
+        # 使用独立的游标, 遍历过程中可以继续写入
+        cursor = self.db.ctx.db.cursor()
+        try:
+            cursor.execute(sql, (key_from, key_to))
+            if self.debug:
+                self.sql_logger.append(f"[RangeIterStream] {sql} key_from={key_from!r} key_to={key_to!r}")
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if len(rows) == 0:
+                    return
+                yield from self._iter_rows(rows, include_value)
+        finally:
+            cursor.close()
 
-        while has_next:
-            if key_from == None:
-                key_from = b''
+    def RangeIterNoLock(self, key_from=None, key_to=None,
+                        reverse=False, include_value=True, fill_cache=False, page_size=None):
+        """分页查询区间数据, 每一页都是一个独立的查询, 不会长时间持有读锁"""
+        if key_from == None:
+            key_from = b''
+        if key_to == None:
+            key_to = b'\xff'
+        if page_size == None:
+            page_size = self.range_page_size
+
+        sql = self._build_range_sql(include_value, reverse) + " LIMIT %d" % (page_size + 1)
+        while True:
+            cursor = self.db.ctx.db.cursor()
+            try:
+                cursor.execute(sql, (key_from, key_to))
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
 
-            if key_to == None:
-                key_to = b'\xff'
+            if self.debug:
+                self.sql_logger.append(f"[RangeIterNoLock rows:{len(rows)}] {sql} key_from={key_from!r} key_to={key_to!r}")
 
-            vars = dict(key_from=key_from, key_to=key_to)
-            result_iter = self.db.query(sql, vars=vars)
-            result = list(result_iter)
+            yield from self._iter_rows(rows[:page_size], include_value)
 
-            if self.debug:
-                raw_sql = self.db.query(sql, vars=vars, _test=True)
-                self.sql_logger.append(f"[RangeIterNoLock rows:{len(result)}] {raw_sql}")
-            
-            # return cur.execute(sql, tuple(params))
-            for item in result[:limit]:
-                if include_value:
-                    if item.value == None:
-                        continue
-                    yield item.key, item.value
-                else:
-                    yield item.key
-
-            has_next = len(result) > limit
-
-            if len(result) == 0:
+            if len(rows) <= page_size:
                 return
 
-            last_key = result[-1].key
+            # 最后一行是下一页的第一行
+            last_key = rows[-1][0]
             if reverse:
                 key_to = last_key
             else:
@@ -308,29 +562,48 @@ class SqliteKV(interfaces.DBInterface):
                 yield item.key
 
     def CreateSnapshot(self):
-        return self
+        if self.journal_mode != "wal":
+            # DELETE模式下长时间的读事务会阻塞写入, 直接读数据库
+            return self
+        return SqliteSnapshot(self.db_file, range_page_size=self.range_page_size)
+
+    def ReleaseSnapshot(self, snapshot):
+        if isinstance(snapshot, SqliteSnapshot):
+            snapshot.Release()
 
     @log_mem_info_deco("db.Write")
     def Write(self, batch, sync=False):
-        """执行批量操作"""
+        """执行批量操作, 按照类型分组后使用 executemany 写入"""
         assert isinstance(batch, interfaces.BatchInterface)
         # return self._db.write(batch, sync)
         if len(batch._puts) + len(batch._deletes) + len(batch._inserts) == 0:
             return
-        
 
+        put_rows = []
+        delete_rows = []
+        for key in batch._puts:
+            value = batch._puts[key]
+            if value is None:
+                delete_rows.append((key,))
+            else:
+                put_rows.append((key, value))
+        insert_rows = list(batch._inserts.items())
+        for key in batch._deletes:
+            delete_rows.append((key,))
+
+        start_time = time.time()
         with self._lock:
             with self.db.transaction():
-                for key in batch._puts:
-                    value = batch._puts[key]
-                    self.doPut(key, value)
-                
-                for key in batch._inserts:
-                    value = batch._inserts[key]
-                    self.Insert(key, value)
+                self._upsert_many(put_rows)
+                self._execute_many(self.INSERT_SQL, insert_rows)
+                self._execute_many(self.DELETE_SQL, delete_rows)
+            self._on_put([row[0] for row in put_rows])
+            self._on_put([row[0] for row in insert_rows])
+            self._on_delete([row[0] for row in delete_rows])
 
-                for key in batch._deletes:
-                    self.doDelete(key)
+        if self.debug:
+            cost_time = (time.time() - start_time) * 1000
+            self.sql_logger.append(f"[Write {cost_time:.2f}ms] puts:{len(put_rows)} inserts:{len(insert_rows)} deletes:{len(delete_rows)}")
 
 
     def Count(self, key_from=b'', key_to=b'\xff'):
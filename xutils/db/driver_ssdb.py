@@ -124,7 +124,7 @@ class SSDBKV(interfaces.DBInterface):
 
 
     def CreateSnapshot(self):
-        raise Exception("CreateSnapshot not supported")
+        raise NotImplementedError("CreateSnapshot not supported")
 
     def Write(self, batch_proxy, sync = False):
         """执行批量操作"""
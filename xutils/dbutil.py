@@ -3,6 +3,7 @@
 # @since 2021/12/04 15:36:42
 # @modified 2021/12/11 11:10:20
 # @filename dbutil.py
+import time
 from xutils.db.dbutil_base import *
 from xutils.db.dbutil_table import *
 from xutils.db.dbutil_hash import *
@@ -17,6 +18,29 @@ def _get_table_no_lock(table_name):
     return table
 
 
+def put(key, obj_value, sync=False, check_table=True):
+    """写入键值对, 开启binlog的时候和数据一起记录binlog"""
+    binlog = BinLog.get_instance()
+    if not binlog.is_enabled():
+        return db_put(key, obj_value, sync=sync, check_table=check_table)
+    batch = create_write_batch()
+    batch.put(key, obj_value, check_table=check_table)
+    binlog.add_log("put", key, obj_value, batch=batch)
+    batch.commit(sync)
+
+
+def delete(key, sync=False):
+    """删除键值对, 开启binlog的时候和数据一起记录binlog"""
+    binlog = BinLog.get_instance()
+    if not binlog.is_enabled():
+        return db_delete(key, sync=sync)
+    check_write_state()
+    batch = create_write_batch()
+    batch.delete(key)
+    binlog.add_log("delete", key, batch=batch)
+    batch.commit(sync)
+
+
 def get_table_old(table_name, type="rdb"):
     """获取table对象
     @param {str} table_name 表名
@@ -48,6 +72,37 @@ def get_hash_table(table_name, user_name=None):
     return KvHashTable(table_name, user_name=user_name)
 
 
+def start_index_repair(table_name):
+    """提交后台修复索引的任务, 由定时任务调用`run_index_repair_jobs`增量执行"""
+    job = get_table(table_name).create_repair_job()
+    job.start()
+    return job.state
+
+
+def list_index_repair_states():
+    return [Storage(**value) for value in prefix_iter("_index_repair")]
+
+
+def run_index_repair_jobs(max_seconds=10.0, chunk_size=100, ops_per_second=0):
+    """执行未完成的索引修复任务, 返回本次执行过的任务状态"""
+    deadline = time.time() + max_seconds
+    result = []
+    for state in list_index_repair_states():
+        if state.done:
+            continue
+        remain_seconds = deadline - time.time()
+        if remain_seconds <= 0:
+            break
+        table_info = get_table_info(state.table_name)
+        if table_info == None or table_info.is_deleted:
+            db_delete("_index_repair:" + state.table_name)
+            continue
+        job = get_table(state.table_name).create_repair_job(chunk_size=chunk_size, ops_per_second=ops_per_second)
+        job.run(remain_seconds)
+        result.append(job.state)
+    return result
+
+
 @xutils.log_init_deco("leveldb")
 def init(db_dir,
          block_cache_size=None,
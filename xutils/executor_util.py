@@ -0,0 +1,260 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 16:10:20
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 16:10:20
+@FilePath     : /xnote/xutils/executor_util.py
+@Description  : 异步任务执行器
+
+- 每个通道(lane)有独立的阻塞队列和工作线程, 日志之类的低优先级任务不会阻塞索引等任务
+- 队列满的时候等待 put_timeout 秒, 仍然放不进去就在调用方线程执行(CallerRuns), 同时记录拒绝次数
+- 按照任务的key统计等待时间和执行时间
+"""
+
+import time
+import queue
+import logging
+import threading
+import xutils
+from xutils.base import Storage
+
+
+class TaskStat:
+    """单个任务key的统计信息"""
+
+    def __init__(self, key=""):
+        self.key = key
+        self.lane = ""
+        self.count = 0
+        self.failed = 0
+        self.caller_runs = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_wait_time = 0.0
+        self.max_run_time = 0.0
+
+    def add(self, wait_time=0.0, run_time=0.0, success=True):
+        self.count += 1
+        if not success:
+            self.failed += 1
+        self.wait_time += wait_time
+        self.run_time += run_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        self.max_run_time = max(self.max_run_time, run_time)
+
+    def to_dict(self):
+        avg_wait_time = 0.0
+        avg_run_time = 0.0
+        if self.count > 0:
+            avg_wait_time = self.wait_time / self.count
+            avg_run_time = self.run_time / self.count
+        return Storage(
+            key = self.key,
+            lane = self.lane,
+            count = self.count,
+            failed = self.failed,
+            caller_runs = self.caller_runs,
+            avg_wait_ms = avg_wait_time * 1000,
+            max_wait_ms = self.max_wait_time * 1000,
+            avg_run_ms = avg_run_time * 1000,
+            max_run_ms = self.max_run_time * 1000,
+        )
+
+
+class TaskLane:
+    """任务通道, 一个阻塞队列+若干个工作线程"""
+
+    def __init__(self, name="default", worker_count=1, max_queue_size=500, put_timeout=0.5):
+        self.name = name
+        self.worker_count = worker_count
+        self.max_queue_size = max_queue_size
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.workers = [] # type: list[threading.Thread]
+        self.max_depth = 0
+        self.rejected = 0
+        self.submitted = 0
+
+    def is_started(self):
+        return len(self.workers) > 0
+
+    def start(self, on_task=None):
+        if self.is_started():
+            return
+        for i in range(self.worker_count):
+            name = "%sWorker-%d" % (self.name.capitalize(), i+1)
+            worker = threading.Thread(target=self._run, args=(on_task,), name=name)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def put(self, item):
+        """放入队列, 队列满了返回False"""
+        try:
+            if self.is_started():
+                self.queue.put(item, timeout=self.put_timeout)
+            else:
+                # 工作线程还没启动, 不需要等待
+                self.queue.put_nowait(item)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.submitted += 1
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def _run(self, on_task):
+        while True:
+            item = self.queue.get()
+            try:
+                on_task(self, item)
+            finally:
+                self.queue.task_done()
+
+    def wait_done(self, timeout=60):
+        """等待队列中的任务执行完成, 主要用于测试"""
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks > 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+    def stats(self):
+        return Storage(
+            name = self.name,
+            worker_count = len(self.workers),
+            depth = self.queue.qsize(),
+            max_depth = self.max_depth,
+            max_queue_size = self.max_queue_size,
+            submitted = self.submitted,
+            rejected = self.rejected,
+        )
+
+
+class TaskExecutor:
+    """多通道的任务执行器"""
+
+    default_lane = "default"
+
+    def __init__(self):
+        self.lanes = dict() # type: dict[str, TaskLane]
+        self.task_stats = dict() # type: dict[str, TaskStat]
+        self.lock = threading.RLock()
+
+    def add_lane(self, name="default", worker_count=1, max_queue_size=500, put_timeout=0.5):
+        with self.lock:
+            lane = self.lanes.get(name)
+            if lane == None:
+                lane = TaskLane(name, worker_count=worker_count,
+                                max_queue_size=max_queue_size, put_timeout=put_timeout)
+                self.lanes[name] = lane
+            elif not lane.is_started():
+                # 还没启动的通道可以修改配置, 已经在队列中的任务保留
+                lane.worker_count = worker_count
+                lane.max_queue_size = max_queue_size
+                lane.queue.maxsize = max_queue_size
+                lane.put_timeout = put_timeout
+            return lane
+
+    def get_lane(self, name=""):
+        lane = self.lanes.get(name)
+        if lane == None:
+            lane = self.lanes.get(self.default_lane)
+        if lane == None:
+            lane = self.add_lane(self.default_lane)
+        return lane
+
+    def start(self, name=None):
+        """启动工作线程, name为None的时候启动全部通道"""
+        with self.lock:
+            for lane in list(self.lanes.values()):
+                if name == None or lane.name == name:
+                    lane.start(self._execute)
+
+    def submit(self, func, args=(), kw={}, lane="", key=None):
+        """提交任务, 队列满了在当前线程执行
+        @return 是否异步执行
+        """
+        if key == None:
+            key = get_func_name(func)
+        task_lane = self.get_lane(lane)
+        item = (key, func, args, kw, time.time())
+        if task_lane.put(item):
+            return True
+
+        logging.warning("task queue is full, lane=%s, key=%s", task_lane.name, key)
+        self.get_stat(key, task_lane.name).caller_runs += 1
+        self._execute(task_lane, item)
+        return False
+
+    def get_stat(self, key="", lane=""):
+        stat = self.task_stats.get(key)
+        if stat == None:
+            with self.lock:
+                stat = self.task_stats.get(key)
+                if stat == None:
+                    stat = TaskStat(key)
+                    stat.lane = lane
+                    self.task_stats[key] = stat
+        return stat
+
+    def _execute(self, lane, item):
+        key, func, args, kw, submit_time = item
+        start_time = time.time()
+        success = True
+        try:
+            func(*args, **kw)
+        except:
+            success = False
+            xutils.print_exc()
+        finally:
+            stop_time = time.time()
+            stat = self.get_stat(key, lane.name)
+            with self.lock:
+                stat.add(start_time - submit_time, stop_time - start_time, success)
+
+    def wait_done(self, timeout=60):
+        for lane in list(self.lanes.values()):
+            if lane.is_started():
+                lane.wait_done(timeout)
+
+    def qsize(self, name=None):
+        if name != None:
+            return self.get_lane(name).queue.qsize()
+        return sum([x.queue.qsize() for x in self.lanes.values()])
+
+    def lane_stats(self):
+        return [self.lanes[name].stats() for name in sorted(self.lanes.keys())]
+
+    def stats(self, orderby="run_time"):
+        with self.lock:
+            result = [x.to_dict() for x in self.task_stats.values()]
+        if orderby == "wait_time":
+            result.sort(key=lambda x: x.max_wait_ms, reverse=True)
+        else:
+            result.sort(key=lambda x: x.avg_run_ms * x.count, reverse=True)
+        return result
+
+    def reset_stats(self):
+        with self.lock:
+            self.task_stats = dict()
+            for lane in self.lanes.values():
+                lane.max_depth = 0
+                lane.rejected = 0
+                lane.submitted = 0
+
+
+def get_func_name(func):
+    module = getattr(func, "__module__", None)
+    name = getattr(func, "__qualname__", None) or getattr(func, "__name__", str(func))
+    if module:
+        return module + "." + name
+    return name
+
+
+default_executor = TaskExecutor()
+
+def get_executor():
+    return default_executor
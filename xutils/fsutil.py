@@ -194,6 +194,17 @@ def get_file_size_int(fpath):
         return -1
     return 0
 
+def get_file_hash(fpath, algorithm="sha256", blocksize=1024*1024):
+    """计算文件内容的hash值,返回16进制字符串"""
+    hash_obj = hashlib.new(algorithm)
+    with open(fpath, "rb") as fp:
+        while True:
+            data = fp.read(blocksize)
+            if not data:
+                break
+            hash_obj.update(data)
+    return hash_obj.hexdigest()
+
 def get_file_size(fpath, format=False):
     size = get_file_size_int(fpath)
     if size < 0 and format:
@@ -46,6 +46,11 @@ class DBInterface:
         """
         raise NotImplementedError("Get")
     
+    def MayExist(self, key):
+        # type: (bytes) -> bool
+        """判断key是否可能存在, 返回False表示一定不存在, 可以跳过写入前的查询"""
+        return True
+
     def BatchGet(self, keys=[]):
         """批量get操作"""
         result = dict()
@@ -109,6 +114,10 @@ class DBInterface:
     def CreateSnapshot(self):
         raise NotImplementedError("CreateSnapshot")
 
+    def ReleaseSnapshot(self, snapshot):
+        """释放快照, 默认依赖垃圾回收"""
+        pass
+
     def Write(self, batch_proxy, sync = False):
         """兜底的批量操作,不保证原子性"""
         assert isinstance(batch_proxy, BatchInterface)
@@ -207,6 +216,24 @@ class CacheInterface:
     def delete(self, key):
         warnings.warn("CacheInterface.delete is not implemented")
 
+class ObjectCacheInterface(CacheInterface):
+    """KV数据库读取对象的缓存接口, 写入的时候需要失效"""
+
+    def get_version(self):
+        return 0
+
+    def get_object(self, key=""):
+        # type: (str) -> tuple[bool, object]
+        """返回 (是否命中, 对象的副本)"""
+        return False, None
+
+    def put_object(self, key="", value=None, version=0):
+        """写入对象, 如果version已经变化说明有并发的写入, 不能缓存"""
+        pass
+
+    def delete_object(self, key=""):
+        pass
+
 class SqlLoggerInterface:
 
     def append(self, sql):
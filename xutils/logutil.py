@@ -18,6 +18,7 @@ except ImportError:
 # 非标准库
 import xutils
 from xutils import fsutil
+from xutils import executor_util
 from xutils.imports import u
 
 
@@ -31,85 +32,24 @@ def _format_time():
     tf_base = time.strftime('%Y-%m-%d %H:%M:%S', st)
     return "%s,%03d" % (tf_base, msecs)
 
-class TaskPool:
-    def __init__(self, max_task_queue = 200):
-        self.MAX_TASK_QUEUE = max_task_queue
-        self.task_queue = deque()
-
-    def put_task(self, func, *args, **kw):
-        if len(self.task_queue) > self.MAX_TASK_QUEUE:
-            print(_format_time(), "Too many log task, queue_size:", len(self.task_queue))
-            func(*args, **kw)
-        else:
-            self.task_queue.append([func, args, kw])
-        
-    def popleft(self):
-        return self.task_queue.popleft()
-    
-    def size(self):
-        return len(self.task_queue)
-
-    def print_task_queue(self):
-        for item in self.task_queue:
-            print(item)
-
-
-empty_pool = TaskPool(0)
-
-class AsyncThreadBase(threading.Thread):
-    
-    def __init__(self, name="AsyncThread", task_pool = empty_pool):
-        super(AsyncThreadBase, self).__init__()
-        self.daemon = True
-        self.name = name
-        self.task_pool = task_pool
-
-    def run(self):
-        while True:
-            # queue.Queue默认是block模式
-            # 但是deque没有block模式，popleft可能抛出IndexError异常
-            try:
-                if self.task_pool.size() > 0:
-                    func, args, kw = self.task_pool.popleft()
-                    func(*args, **kw)
-                else:
-                    time.sleep(0.01)
-            except Exception as e:
-                xutils.print_exc()
-    
-    def wait_task_done(self):
-        while self.task_pool.size() > 0:
-            func, args, kw = self.task_pool.popleft()
-            func(*args, **kw)
-
-class LogThread(AsyncThreadBase):
-    def __init__(self, name="LogThread"):
-        super().__init__(name)
-
-class AsyncThread(AsyncThreadBase):
-    pass
-
-default_pool = TaskPool(200)
+LOG_LANE = "log"
 
 def init_async_pool(pool_size = 200, thread_size = 5):
-    global default_pool
-    default_pool = TaskPool(pool_size)
-
-    for i in range(thread_size):
-        suffix = str(i+1)
-        thread = AsyncThread(name = "AsyncThread-" + suffix, task_pool=default_pool)
-        thread.start()
+    """初始化日志类异步任务的通道, 和事件处理的通道隔离"""
+    executor = executor_util.get_executor()
+    executor.add_lane(LOG_LANE, worker_count=thread_size, max_queue_size=pool_size)
+    executor.start(LOG_LANE)
 
 def wait_task_done():
-    while default_pool.size() > 0:
-        time.sleep(0.1) # 等待任务完成
+    # 等待异步任务完成
+    executor_util.get_executor().wait_done()
 
 def async_func_deco():
     """同步调用转化成异步调用的装饰器"""
     def deco(func):
+        key = executor_util.get_func_name(func)
         def handle(*args, **kw):
-            global default_pool
-            default_pool.put_task(func, *args, **kw)
+            executor_util.get_executor().submit(func, args, kw, lane=LOG_LANE, key=key)
         return handle
     return deco
 
@@ -302,6 +302,64 @@ def http_download(address, destpath = None, dirname = None):
     finally:
         dest.close()
 
+def http_download_resume(address, destpath, total_size=-1, timeout=60, validator=None):
+    """支持断点续传的下载, destpath中已经下载的部分不会重新下载
+    @param {int} total_size 文件总大小, 小于0表示未知
+    @param {str|None} validator 远程文件的版本(比如大小+修改时间), 保存在`destpath.validator`里面,
+        和已经下载的部分不一致的时候重新下载, 下载的文件使用完之后调用方需要删除这个文件
+    @return {int} 本次下载的字节数
+    """
+    offset = 0
+    if os.path.exists(destpath):
+        offset = os.path.getsize(destpath)
+    if validator != None:
+        validator_path = destpath + ".validator"
+        old_validator = None
+        if os.path.exists(validator_path):
+            with open(validator_path) as fp:
+                old_validator = fp.read()
+        if offset > 0 and old_validator != validator:
+            # 远程文件已经变化, 已经下载的部分不能续传
+            offset = 0
+            os.remove(destpath)
+        with open(validator_path, "w") as fp:
+            fp.write(validator)
+    if total_size >= 0 and offset >= total_size:
+        if offset > total_size:
+            # 远程文件变小了, 重新下载
+            offset = 0
+        else:
+            return 0
+
+    headers = {
+        "User-Agent": USER_AGENT
+    }
+    if offset > 0:
+        if total_size > 0:
+            headers["Range"] = "bytes=%d-%d" % (offset, total_size-1)
+        else:
+            headers["Range"] = "bytes=%d-" % offset
+
+    request = Request(get_http_url(address), headers = headers)
+    stream = urlopen(request, timeout = timeout)
+    try:
+        # 服务端不支持Range的时候返回整个文件
+        if offset > 0 and stream.getcode() == 206:
+            mode = "ab"
+        else:
+            mode = "wb"
+        readsize = 0
+        with open(destpath, mode) as dest:
+            while True:
+                chunk = stream.read(BUFSIZE)
+                if not chunk:
+                    break
+                dest.write(chunk)
+                readsize += len(chunk)
+        return readsize
+    finally:
+        stream.close()
+
 def tcp_send(domain, port, content, timeout=1, on_recv_func=None):
     """发送TCP请求, 由于TCP协议没有终止标识，超时就返回所有结果
     @param {string} domain 域名
@@ -0,0 +1,72 @@
+# -*- coding:utf-8 -*-
+"""
+@Author       : xupingmao
+@email        : 578749341@qq.com
+@Date         : 2026-10-18 17:05:41
+@LastEditors  : xupingmao
+@LastEditTime : 2026-10-18 17:05:41
+@FilePath     : /xnote/xutils/perf_util.py
+@Description  : 性能统计工具
+"""
+
+import bisect
+from xutils.base import Storage
+
+# 耗时分桶的上界(毫秒), 按照1-2-5递增
+DEFAULT_BUCKETS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500,
+                   1000, 2000, 5000, 10000, 20000, 60000)
+
+class LatencyHistogram:
+    """耗时分布的直方图, 内存占用固定, 分位数的精度是桶的边界
+    为了不影响调用方的性能没有加锁, 并发写入可能有少量误差
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, cost_ms=0.0):
+        index = bisect.bisect_left(self.bounds, cost_ms)
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += cost_ms
+        if cost_ms > self.max_ms:
+            self.max_ms = cost_ms
+
+    def percentile(self, p=0.5):
+        """返回分位数的近似值(所在桶的上界)"""
+        if self.count == 0:
+            return 0.0
+        target = p * self.count
+        acc = 0
+        for index, count in enumerate(self.counts):
+            acc += count
+            if acc >= target and count > 0:
+                if index >= len(self.bounds):
+                    return self.max_ms
+                return min(self.bounds[index], self.max_ms)
+        return self.max_ms
+
+    def avg(self):
+        if self.count == 0:
+            return 0.0
+        return self.total_ms / self.count
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def to_dict(self):
+        return Storage(
+            count = self.count,
+            avg_ms = self.avg(),
+            max_ms = self.max_ms,
+            p50_ms = self.percentile(0.5),
+            p95_ms = self.percentile(0.95),
+            p99_ms = self.percentile(0.99),
+        )
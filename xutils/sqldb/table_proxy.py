@@ -93,6 +93,26 @@ class TableProxy:
                 profile_log.op_type = "insert"
                 self.profile_logger.log(profile_log)
         
+    def multiple_insert(self, values, _test=False):
+        # type: (list[dict], bool) -> None
+        """批量插入, 不返回ID, 只用于没有开启binlog的表"""
+        self.check_write_state()
+        assert not self.enable_binlog, "multiple_insert does not support binlog"
+        values = [self.fix_sql_keywords(item) for item in values]
+        start_time = time.time()
+        try:
+            self.db.multiple_insert(self.tablename, values, seqname=False, _test=_test)
+        except Exception as e:
+            del self.db.ctx.db # 尝试重新连接
+            raise e
+        finally:
+            cost_time = time.time() - start_time
+            if self.log_profile and self.table_info.log_profile:
+                profile_log = self._new_profile_log()
+                profile_log.cost_time = cost_time
+                profile_log.op_type = "multiple_insert"
+                self.profile_logger.log(profile_log)
+
     def select(self, vars=None, what='*', where=None, order=None, group=None,
                limit=None, offset=None, _test=False):
         where = self.fix_sql_keywords(where)
@@ -672,7 +672,97 @@ def split_words(search_key):
     # print(words)
     return words
 
- 
+
+_INDEX_TOKEN_PATTERN = re.compile(r"[0-9a-z_]+|[\u3400-\u4dff\u4e00-\u9fff]+")
+_seg_instance = None
+
+def _get_seg():
+    global _seg_instance
+    if _seg_instance is None:
+        from smallseg import SEG
+        _seg_instance = SEG()
+    return _seg_instance
+
+def _cut_cjk(text):
+    """使用smallseg对中文进行分词，返回顺序排列的分词结果"""
+    words = _get_seg().cut(text)
+    words.reverse()
+    return words
+
+def split_index_tokens(text, max_token_length=64):
+    """拆分用于全文索引的词元，返回 (token, position) 的列表
+    - 英文/数字按照单词拆分
+    - 中日韩字符同时保留单字以及smallseg的分词结果
+    - position是单词/单字的序号, 分词结果的position是它的第一个字的序号
+        >>> split_index_tokens("Hello World")
+        [('hello', 0), ('world', 1)]
+        >>> split_index_tokens("中文abc")
+        [('中', 0), ('文', 1), ('中文', 0), ('abc', 2)]
+    """
+    if text is None:
+        return []
+
+    result = []
+    position = 0
+    for match in _INDEX_TOKEN_PATTERN.finditer(text.lower()):
+        part = match.group()
+        if not is_cjk(part[0]):
+            result.append((part[:max_token_length], position))
+            position += 1
+            continue
+
+        for offset, c in enumerate(part):
+            result.append((c, position + offset))
+
+        if len(part) > 1:
+            cursor = 0
+            for word in _cut_cjk(part):
+                if len(word) < 2:
+                    continue
+                offset = part.find(word, cursor)
+                if offset < 0:
+                    continue
+                result.append((word, position + offset))
+                cursor = offset + 1
+
+        position += len(part)
+    return result
+
+def split_query_tokens(words):
+    """把`split_words`的结果转换成索引查询的词元, 和`split_index_tokens`的规则保持一致
+        >>> split_query_tokens(["中", "文", "abc"])
+        ['中文', 'abc']
+        >>> split_query_tokens(["中", "c++"])
+        ['中', 'c']
+    """
+    result = []
+    cjk_buf = []
+
+    def flush_cjk():
+        if len(cjk_buf) == 1:
+            result.append(cjk_buf[0])
+        elif len(cjk_buf) > 1:
+            for word in _cut_cjk("".join(cjk_buf)):
+                if len(word) >= 2 and word not in result:
+                    result.append(word)
+        del cjk_buf[:]
+
+    for word in words:
+        if len(word) == 1 and is_cjk(word):
+            cjk_buf.append(word)
+            continue
+        flush_cjk()
+        for match in _INDEX_TOKEN_PATTERN.finditer(word.lower()):
+            part = match.group()
+            if is_cjk(part[0]):
+                cjk_buf.extend(part)
+                flush_cjk()
+            elif part not in result:
+                result.append(part)
+    flush_cjk()
+    return result
+
+
 def escape_html(text):
     """html转义, 参考`lib/tornado/escape.py`"""
     # 必须先处理&